@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Скрипт для добавления колонки sha256 в таблицу distribution_files
+"""
+from sqlalchemy import inspect, text
+from database import engine
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def add_sha256_column():
+    """Добавить колонку sha256 и индекс по ней"""
+    try:
+        columns = [column["name"] for column in inspect(engine).get_columns("distribution_files")]
+        if "sha256" in columns:
+            logger.info("ℹ️  Колонка sha256 уже существует")
+            return
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE distribution_files ADD COLUMN sha256 VARCHAR(64)"))
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_distribution_files_sha256 ON distribution_files (sha256)"
+            ))
+        logger.info("✅ Колонка sha256 успешно добавлена!")
+    except Exception as e:
+        logger.error(f"❌ Ошибка при добавлении колонки: {e}")
+        raise
+
+if __name__ == "__main__":
+    print("🔧 Добавление колонки sha256 в distribution_files...")
+    add_sha256_column()
+    print("✅ Готово!")
@@ -0,0 +1,160 @@
+"""
+Бенчмарк авторизации: p50/p99 латентность защищённого эндпоинта под конкурентной нагрузкой
+
+Сравнивает старую зависимость (синхронный PyJWKClient внутри async функции)
+и текущую get_current_user (асинхронный JWKS + проверка подписи в потоке).
+JWKS отдаётся локальным HTTP сервером с искусственной задержкой, приложение
+работает в uvicorn в отдельном потоке, нагрузка идёт по настоящему HTTP.
+
+Запуск:
+    python bench_auth.py --requests 400 --concurrency 50 --jwks-delay 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import Depends, FastAPI, HTTPException, Security
+from fastapi.security import HTTPAuthorizationCredentials
+import uvicorn
+
+os.environ.setdefault("CLERK_SECRET_KEY", "sk_test_benchmark")
+sys.path.append(str(Path(__file__).parent))
+
+import clerk_auth  # noqa: E402
+from clerk_auth import get_current_user, security  # noqa: E402
+
+KID = "bench-key"
+
+
+def make_jwks_server(public_jwk: dict, delay: float) -> ThreadingHTTPServer:
+    """Локальный JWKS endpoint с задержкой ответа"""
+    body = json.dumps({"keys": [public_jwk]}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def legacy_get_current_user(
+    credentials: HTTPAuthorizationCredentials = Security(security)
+) -> dict:
+    """Реализация до рефакторинга: блокирующий PyJWKClient на каждый запрос"""
+    token = credentials.credentials
+    try:
+        issuer = jwt.decode(token, options={"verify_signature": False})["iss"]
+        jwks_client = jwt.PyJWKClient(f"{issuer}/.well-known/jwks.json", cache_keys=True)
+        signing_key = jwks_client.get_signing_key_from_jwt(token)
+        return jwt.decode(token, signing_key.key, algorithms=["RS256"], options={"verify_aud": False})
+    except jwt.PyJWTError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/legacy")
+    async def legacy(user=Depends(legacy_get_current_user)):
+        return {"user_id": user["sub"]}
+
+    @app.get("/current")
+    async def current(user=Depends(get_current_user)):
+        return {"user_id": user["sub"]}
+
+    return app
+
+
+def start_app_server(app: FastAPI) -> uvicorn.Server:
+    """Запускает приложение в uvicorn в отдельном потоке со своим event loop"""
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+async def run_load(base_url: str, path: str, token: str, total: int, concurrency: int) -> list:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(path, headers={"Authorization": f"Bearer {token}"})
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{path}: {response.status_code} {response.text}")
+
+        await asyncio.gather(*(one() for _ in range(total)))
+
+    return latencies
+
+
+def report(name: str, latencies: list):
+    ordered = sorted(latencies)
+    p50 = statistics.median(ordered)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{name:<10} n={len(ordered):<5} p50={p50 * 1000:8.1f} ms   p99={p99 * 1000:8.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--jwks-delay", type=float, default=0.2, help="задержка JWKS ответа, сек")
+    args = parser.parse_args()
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    public_jwk.update({"kid": KID, "use": "sig", "alg": "RS256"})
+
+    server = make_jwks_server(public_jwk, args.jwks_delay)
+    issuer = f"http://127.0.0.1:{server.server_address[1]}"
+    token = jwt.encode(
+        {"sub": "user_bench", "iss": issuer, "exp": int(time.time()) + 3600},
+        private_key,
+        algorithm="RS256",
+        headers={"kid": KID},
+    )
+
+    app_server = start_app_server(build_app())
+    port = app_server.servers[0].sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+    print(f"JWKS delay: {args.jwks_delay * 1000:.0f} ms, "
+          f"{args.requests} запросов, concurrency {args.concurrency}")
+
+    report("legacy", await run_load(base_url, "/legacy", token, args.requests, args.concurrency))
+    # Холодный кэш: первая волна запросов ждёт одну загрузку JWKS
+    clerk_auth._jwks_cache.clear()
+    report("current", await run_load(base_url, "/current", token, args.requests, args.concurrency))
+
+    app_server.should_exit = True
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+"""
+Бенчмарк генерации HTML письма: стоимость одного рендера до и после компиляции шаблона
+
+legacy - полная сборка документа из f-строк на каждый вызов (как раньше),
+compiled - склейка закэшированных частей шаблона с заголовком, текстом и приветствием,
+personalized - подстановка приветствия в письмо, отрендеренное один раз на рассылку.
+Брендинг с логотипом, подписью, соцсетями и футером; получатели с разными именами.
+
+Запуск:
+    python bench_email_template.py --renders 20000
+"""
+import argparse
+import html
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+import email_template  # noqa: E402
+
+BRANDING = {
+    'primary_color': '#1D4ED8',
+    'secondary_color': '#9333EA',
+    'accent_color': '#10B981',
+    'company_name': 'ООО Пример',
+    'company_tagline': 'Технологии для медиа',
+    'contact_person': 'Иван Петров',
+    'contact_email': 'press@example.com',
+    'contact_phone': '+7 495 000-00-00',
+    'website': 'https://example.com',
+    'logo_url': 'https://example.com/logo.png',
+    'linkedin_url': 'https://linkedin.com/company/example',
+    'twitter_url': 'https://twitter.com/example',
+    'telegram_url': 'https://t.me/example',
+    'email_signature': None,
+    'default_closing': 'С уважением',
+    'show_logo_in_header': True,
+    'show_social_links': True,
+    'footer_text': 'Вы получили это письмо как представитель СМИ.',
+}
+
+TITLE = "ООО Пример запускает платформу для рассылки пресс-релизов"
+CONTENT = ("Москва, 1 октября - ООО Пример объявляет о запуске новой платформы. " * 40).strip()
+
+
+def legacy_render(recipient_name: str) -> str:
+    # Значения экранируются так же, как в скомпилированном шаблоне
+    return email_template._render_document(
+        html.escape(TITLE, quote=False), html.escape(CONTENT, quote=False), BRANDING,
+        html.escape(email_template._greeting(recipient_name), quote=False)
+    ).strip()
+
+
+def compiled_render(recipient_name: str) -> str:
+    return email_template.generate_email_html(
+        TITLE, CONTENT, BRANDING, recipient_name, cache_key=("bench-user", "2026-01-01")
+    )
+
+
+_bodies = email_template.render_email_bodies(TITLE, CONTENT, BRANDING, cache_key=("bench-user", "2026-01-01"))
+_personalized = email_template.PersonalizedEmail(
+    _bodies["email_html"], _bodies["email_plain"], _bodies["greeting_spans"]
+)
+
+
+def personalized_render(recipient_name: str) -> str:
+    return _personalized.render(recipient_name)[0]
+
+
+def measure(render, renders: int, rounds: int = 5) -> float:
+    """Медиана по раундам, микросекунды на рендер"""
+    results = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for i in range(renders):
+            render(f"Получатель {i % 100}")
+        results.append((time.perf_counter() - started) / renders * 1e6)
+    return statistics.median(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=20000)
+    args = parser.parse_args()
+
+    expected = legacy_render("Тест")
+    if email_template.EMAIL_MINIFY_HTML:
+        expected = email_template.minify_html(expected)
+    if not email_template.EMAIL_STYLE_DEDUPE:
+        assert expected == compiled_render("Тест") == personalized_render("Тест"), \
+            "HTML скомпилированного шаблона отличается"
+    print(f"HTML: {len(legacy_render('Тест').encode())} -> {len(compiled_render('Тест').encode())} байт")
+
+    legacy = measure(legacy_render, args.renders)
+    compiled = measure(compiled_render, args.renders)
+    personalized = measure(personalized_render, args.renders)
+    print(f"{'legacy':<12} {legacy:8.2f} us/render")
+    print(f"{'compiled':<12} {compiled:8.2f} us/render   x{legacy / compiled:.1f}")
+    print(f"{'personalized':<12} {personalized:8.2f} us/render   x{legacy / personalized:.1f}")
+    print(f"cache: {email_template.template_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
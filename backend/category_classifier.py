@@ -0,0 +1,189 @@
+"""
+Локальный классификатор тематики пресс-релиза по категориям СМИ
+
+BM25 по "документам" категорий: название, описание и словарь ключевых слов,
+выученный из прошлых рассылок (тексты релизов, отправленных в СМИ категории).
+Если лидеры явно отделены от остальных категорий, ответ отдаётся сразу,
+иначе вызывающий код обращается к LLM.
+"""
+import logging
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"[а-яёa-z0-9]+")
+
+# Частые слова, не несущие тематики
+STOPWORDS = {
+    "и", "в", "во", "на", "с", "со", "по", "для", "от", "до", "из", "за", "к", "о", "об",
+    "что", "как", "это", "его", "ее", "её", "их", "при", "также", "а", "но", "или", "не",
+    "году", "года", "год", "компания", "компании", "который", "которые", "которая",
+    "будет", "более", "свой", "своих", "этом", "этого", "том", "всех", "уже", "так",
+    "the", "and", "of", "to", "in", "for", "on", "with", "is", "a",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова в нижнем регистре, без стоп-слов, с грубым стеммингом по префиксу"""
+    tokens = []
+    for word in _WORD_RE.findall((text or "").lower().replace("ё", "е")):
+        if len(word) < 3 or word in STOPWORDS:
+            continue
+        # Обрезка окончаний: "технологии", "технологий" -> "технол"
+        tokens.append(word[:6])
+    return tokens
+
+
+class CategoryClassifier:
+    """BM25 классификатор по категориям СМИ"""
+
+    def __init__(
+        self,
+        categories: List[dict],
+        learned_texts: Optional[Dict[int, List[str]]] = None,
+        lexicon_size: int = 100,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        """
+        Args:
+            categories: Категории [{"id", "name", "description"}]
+            learned_texts: Тексты прошлых рассылок по id категории
+            lexicon_size: Сколько отличительных слов брать из прошлых рассылок на категорию
+        """
+        self.categories = categories
+        self.k1 = k1
+        self.b = b
+        self.lexicons = self._learn_lexicons(learned_texts or {}, lexicon_size)
+
+        self.doc_terms: Dict[int, Counter] = {}
+        for category in categories:
+            terms = Counter()
+            # Название важнее описания, описание важнее выученных слов
+            for token in tokenize(category["name"]):
+                terms[token] += 3
+            for token in tokenize(category.get("description") or ""):
+                terms[token] += 2
+            for token in self.lexicons.get(category["id"], []):
+                terms[token] += 1
+            self.doc_terms[category["id"]] = terms
+
+        lengths = [sum(terms.values()) for terms in self.doc_terms.values()]
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 1.0
+
+        document_frequency = Counter()
+        for terms in self.doc_terms.values():
+            document_frequency.update(terms.keys())
+        total = len(self.doc_terms)
+        self.idf = {
+            term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def _learn_lexicons(self, learned_texts: Dict[int, List[str]], lexicon_size: int) -> Dict[int, List[str]]:
+        """Отличительные слова категории по TF-IDF между категориями"""
+        counts = {category_id: Counter(token for text in texts for token in tokenize(text))
+                  for category_id, texts in learned_texts.items() if texts}
+        if not counts:
+            return {}
+
+        category_frequency = Counter()
+        for counter in counts.values():
+            category_frequency.update(counter.keys())
+        total = len(counts)
+
+        lexicons = {}
+        for category_id, counter in counts.items():
+            scored = {
+                token: count * math.log(1 + total / category_frequency[token])
+                for token, count in counter.items()
+                if count >= 2
+            }
+            lexicons[category_id] = sorted(scored, key=scored.get, reverse=True)[:lexicon_size]
+        return lexicons
+
+    def score(self, text: str) -> Dict[int, float]:
+        """BM25 оценка текста для каждой категории"""
+        query = set(tokenize(text))
+        scores = {}
+        for category_id, terms in self.doc_terms.items():
+            length = sum(terms.values())
+            score = 0.0
+            for token in query:
+                tf = terms.get(token)
+                if not tf:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * length / self.avg_length)
+                score += self.idf[token] * tf * (self.k1 + 1) / norm
+            scores[category_id] = score
+        return scores
+
+    def classify(
+        self,
+        text: str,
+        min_score: float = 3.0,
+        relative_cutoff: float = 0.5,
+        min_margin: float = 0.25,
+        max_categories: int = 5,
+    ) -> Optional[dict]:
+        """
+        Подбирает категории, если результат однозначен.
+
+        Выбираются категории с оценкой не ниже relative_cutoff от лучшей (не больше
+        max_categories). Результат считается уверенным, если лучшая оценка не меньше
+        min_score, а первая невыбранная категория отстаёт от последней выбранной
+        хотя бы на min_margin (доля от лучшей оценки).
+
+        Returns:
+            Анализ в формате ответа LLM или None, если нужен LLM
+        """
+        scores = self.score(text)
+        ranked = sorted(
+            (item for item in scores.items() if item[1] > 0),
+            key=lambda item: item[1],
+            reverse=True
+        )
+        if not ranked or ranked[0][1] < min_score:
+            return None
+
+        top_score = ranked[0][1]
+        selected = [item for item in ranked if item[1] >= relative_cutoff * top_score][:max_categories]
+        if len(ranked) > len(selected):
+            gap = (selected[-1][1] - ranked[len(selected)][1]) / top_score
+            if gap < min_margin:
+                return None
+
+        names = {category["id"]: category["name"] for category in self.categories}
+        query = set(tokenize(text))
+        selected_categories = []
+        for category_id, category_score in selected:
+            matched = [token for token in query if token in self.doc_terms[category_id]]
+            selected_categories.append({
+                "category_name": names[category_id],
+                "relevance_score": max(1, round(10 * category_score / top_score)),
+                "reasoning": f"Совпадения по ключевым словам: {', '.join(sorted(matched)[:8])}"
+            })
+
+        return {
+            "selected_categories": selected_categories,
+            "text_summary": _first_sentence(text),
+            "target_audience": "Журналисты профильных СМИ",
+            "source": "local_classifier"
+        }
+
+
+def _first_sentence(text: str, limit: int = 200) -> str:
+    sentence = re.split(r"(?<=[.!?])\s", (text or "").strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit].rstrip() + "…"
+
+
+def collect_learned_texts(rows) -> Dict[int, List[str]]:
+    """Группирует (category_id, текст рассылки) по категориям"""
+    learned = defaultdict(list)
+    for category_id, text in rows:
+        if text:
+            learned[category_id].append(text)
+    return dict(learned)
@@ -0,0 +1,172 @@
+"""
+Circuit breaker для вызовов внешних моделей
+
+Для каждой модели хранится скользящее окно последних вызовов. Если доля ошибок
+(или слишком медленных ответов) превышает порог, breaker открывается и модель
+пропускается до истечения open_seconds. Затем breaker переходит в half-open и
+пропускает пробный запрос: успех закрывает его, ошибка снова открывает.
+"""
+import os
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import Dict, Optional
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Breaker одной модели"""
+
+    def __init__(
+        self,
+        name: str,
+        window_size: int = 20,
+        min_calls: int = 5,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 15.0,
+        slow_rate_threshold: float = 0.8,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate_threshold = slow_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = CircuitState.CLOSED
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self._calls = deque(maxlen=window_size)  # (ok, slow, latency)
+        self._half_open_in_flight = 0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Можно ли сейчас отправить запрос в модель"""
+        with self._lock:
+            if self.state == CircuitState.OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    return False
+                self.state = CircuitState.HALF_OPEN
+                self._half_open_in_flight = 0
+
+            if self.state == CircuitState.HALF_OPEN:
+                if self._half_open_in_flight >= self.half_open_max_calls:
+                    return False
+                self._half_open_in_flight += 1
+
+            return True
+
+    def release(self):
+        """Запрос отменён без результата (например, проиграл hedging-гонку)"""
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN and self._half_open_in_flight > 0:
+                self._half_open_in_flight -= 1
+
+    def record_success(self, latency: float):
+        with self._lock:
+            slow = latency >= self.slow_call_seconds
+            if self.state == CircuitState.HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                if not slow:
+                    self._close()
+                    self._calls.append((True, False, latency))
+                    return
+            self._calls.append((True, slow, latency))
+            self._evaluate()
+
+    def record_failure(self, latency: float):
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                self._open()
+                return
+            self._calls.append((False, latency >= self.slow_call_seconds, latency))
+            self._evaluate()
+
+    def _evaluate(self):
+        if self.state != CircuitState.CLOSED or len(self._calls) < self.min_calls:
+            return
+        if self.failure_rate >= self.failure_rate_threshold or self.slow_rate >= self.slow_rate_threshold:
+            self._open()
+
+    def _open(self):
+        self.state = CircuitState.OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+
+    def _close(self):
+        self.state = CircuitState.CLOSED
+        self.opened_at = None
+        self._calls.clear()
+
+    @property
+    def failure_rate(self) -> float:
+        if not self._calls:
+            return 0.0
+        return sum(1 for ok, _, _ in self._calls if not ok) / len(self._calls)
+
+    @property
+    def slow_rate(self) -> float:
+        if not self._calls:
+            return 0.0
+        return sum(1 for _, slow, _ in self._calls if slow) / len(self._calls)
+
+    @property
+    def health_score(self) -> float:
+        """Оценка здоровья модели от 0 до 1"""
+        if self.state == CircuitState.OPEN:
+            return 0.0
+        score = 1.0 - self.failure_rate - 0.5 * self.slow_rate
+        return round(max(0.0, min(1.0, score)), 3)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = [latency for ok, _, latency in self._calls if ok]
+            retry_in = None
+            if self.state == CircuitState.OPEN:
+                retry_in = round(max(0.0, self.open_seconds - (time.monotonic() - self.opened_at)), 1)
+            return {
+                "model": self.name,
+                "state": self.state.value,
+                "health_score": self.health_score,
+                "calls_in_window": len(self._calls),
+                "failure_rate": round(self.failure_rate, 3),
+                "slow_rate": round(self.slow_rate, 3),
+                "avg_latency": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "times_opened": self.times_opened,
+                "retry_in_seconds": retry_in,
+            }
+
+
+class CircuitBreakerRegistry:
+    """Набор breaker'ов по именам моделей с общими настройками из окружения"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._settings = {
+            "window_size": int(os.getenv("LLM_BREAKER_WINDOW", "20")),
+            "min_calls": int(os.getenv("LLM_BREAKER_MIN_CALLS", "5")),
+            "failure_rate_threshold": float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5")),
+            "slow_call_seconds": float(os.getenv("LLM_BREAKER_SLOW_CALL_SECONDS", "15")),
+            "slow_rate_threshold": float(os.getenv("LLM_BREAKER_SLOW_RATE", "0.8")),
+            "open_seconds": float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30")),
+        }
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers.setdefault(name, CircuitBreaker(name, **self._settings))
+        return breaker
+
+    def snapshot(self) -> list:
+        return [breaker.snapshot() for breaker in self._breakers.values()]
@@ -1,21 +1,47 @@
 """
 Clerk Authentication для FastAPI
 """
+import asyncio
+import logging
 import os
+import time
+import httpx
 import jwt
 import requests
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from fastapi import HTTPException, Security, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from functools import lru_cache
-from jwt import PyJWKClient
+from jwt import PyJWK
+
+logger = logging.getLogger(__name__)
 
 # Security scheme
 security = HTTPBearer()
+# Без auto_error: отсутствие заголовка Authorization не превращается в 403
+optional_security = HTTPBearer(auto_error=False)
 
 # Получаем Secret Key из переменных окружения
 CLERK_SECRET_KEY = os.getenv("CLERK_SECRET_KEY", "")
 
+# Если задан, принимаем токены только от этого issuer (например https://clerk.pressreach.ru)
+CLERK_ISSUER = os.getenv("CLERK_ISSUER", "").rstrip("/")
+
+# Сколько секунд держим JWKS в памяти процесса
+JWKS_CACHE_TTL = int(os.getenv("CLERK_JWKS_CACHE_TTL", "3600"))
+# Минимальный интервал между принудительными обновлениями JWKS (неизвестный kid)
+JWKS_MIN_REFRESH_INTERVAL = int(os.getenv("CLERK_JWKS_MIN_REFRESH_INTERVAL", "30"))
+JWKS_FETCH_TIMEOUT = float(os.getenv("CLERK_JWKS_FETCH_TIMEOUT", "5"))
+# Ограничение на число issuer в кэше, если CLERK_ISSUER не задан
+JWKS_MAX_ISSUERS = 16
+
+# issuer -> (время загрузки, {kid: PyJWK})
+_jwks_cache: Dict[str, Tuple[float, Dict[str, PyJWK]]] = {}
+_jwks_locks: Dict[str, asyncio.Lock] = {}
+# issuer -> время, раньше которого JWKS не запрашиваем повторно (после неудачной загрузки)
+_jwks_retry_after: Dict[str, float] = {}
+_http_client: Optional[httpx.AsyncClient] = None
+
 # Извлекаем publishable key для получения правильного JWKS URL
 # Clerk JWKS URL имеет формат: https://[clerk-domain]/.well-known/jwks.json
 # Для этого нам нужен либо publishable key либо домен
@@ -42,10 +68,134 @@ def get_jwks_url_from_secret_key(secret_key: str) -> str:
     return None
 
 
-def verify_clerk_token(token: str) -> dict:
+def _get_http_client() -> httpx.AsyncClient:
+    """Общий асинхронный HTTP клиент для загрузки JWKS"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(timeout=JWKS_FETCH_TIMEOUT)
+    return _http_client
+
+
+async def close_http_client():
+    """Закрыть HTTP клиент (вызывается при остановке приложения)"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def _fetch_jwks(issuer: str) -> Dict[str, PyJWK]:
+    """Загружает JWKS issuer'а без блокировки event loop"""
+    jwks_url = f"{issuer}/.well-known/jwks.json"
+    response = await _get_http_client().get(jwks_url)
+    response.raise_for_status()
+
+    keys = {}
+    for jwk_data in response.json().get("keys", []):
+        if jwk_data.get("use", "sig") != "sig" or not jwk_data.get("kid"):
+            continue
+        try:
+            keys[jwk_data["kid"]] = PyJWK(jwk_data)
+        except jwt.PyJWTError as e:
+            logger.warning(f"Пропущен некорректный JWK {jwk_data.get('kid')}: {e}")
+
+    logger.info(f"JWKS загружен для {issuer}: {len(keys)} ключей")
+    return keys
+
+
+def _issuer_lock(issuer: str) -> asyncio.Lock:
+    """
+    Lock загрузки JWKS для issuer. Без CLERK_ISSUER issuer берётся из непроверенного
+    токена, поэтому lock'и и отметки неудачных загрузок ограничены JWKS_MAX_ISSUERS:
+    лишние удаляются, кроме занятых и тех, чьи ключи есть в кэше.
+    """
+    lock = _jwks_locks.get(issuer)
+    if lock is None:
+        if len(_jwks_locks) >= JWKS_MAX_ISSUERS:
+            for other in list(_jwks_locks):
+                if other not in _jwks_cache and not _jwks_locks[other].locked():
+                    del _jwks_locks[other]
+                    _jwks_retry_after.pop(other, None)
+        lock = _jwks_locks[issuer] = asyncio.Lock()
+    return lock
+
+
+def _retry_pending(issuer: str, now: float) -> bool:
+    """После неудачной загрузки JWKS новая попытка - не раньше JWKS_MIN_REFRESH_INTERVAL"""
+    return now < _jwks_retry_after.get(issuer, 0.0)
+
+
+async def get_signing_key(issuer: str, kid: str) -> PyJWK:
+    """
+    Возвращает ключ подписи из кэша JWKS.
+
+    Загрузка выполняется под lock'ом на issuer, поэтому при холодном кэше
+    параллельные запросы ждут одну загрузку, а не запускают свою каждый.
+    Неизвестный kid (ротация ключей) вызывает обновление не чаще
+    JWKS_MIN_REFRESH_INTERVAL секунд. Если загрузка не удалась, следующая
+    попытка тоже не раньше чем через JWKS_MIN_REFRESH_INTERVAL: до неё
+    используются старые ключи (или сразу 503, если ключей нет).
+    """
+    cached = _jwks_cache.get(issuer)
+    now = time.monotonic()
+    if cached and kid in cached[1] and (now - cached[0] < JWKS_CACHE_TTL or _retry_pending(issuer, now)):
+        return cached[1][kid]
+    if not cached and _retry_pending(issuer, now):
+        raise HTTPException(status_code=503, detail="Unable to fetch JWKS: issuer unavailable")
+
+    async with _issuer_lock(issuer):
+        # Пока ждали lock, ключи мог загрузить другой запрос
+        cached = _jwks_cache.get(issuer)
+        now = time.monotonic()
+        fresh = cached is not None and now - cached[0] < JWKS_CACHE_TTL
+        if fresh and kid in cached[1]:
+            return cached[1][kid]
+
+        refresh_due = not fresh or now - cached[0] >= JWKS_MIN_REFRESH_INTERVAL
+        if refresh_due and not _retry_pending(issuer, now):
+            try:
+                keys = await _fetch_jwks(issuer)
+            except (httpx.HTTPError, ValueError) as e:
+                _jwks_retry_after[issuer] = time.monotonic() + JWKS_MIN_REFRESH_INTERVAL
+                if not cached:
+                    raise HTTPException(status_code=503, detail=f"Unable to fetch JWKS: {str(e)}")
+                # Issuer недоступен - продолжаем работать со старыми ключами
+                logger.warning(f"Не удалось обновить JWKS для {issuer}: {e}")
+            else:
+                _jwks_retry_after.pop(issuer, None)
+                if issuer not in _jwks_cache and len(_jwks_cache) >= JWKS_MAX_ISSUERS:
+                    _jwks_cache.pop(next(iter(_jwks_cache)))
+                _jwks_cache[issuer] = (now, keys)
+                cached = _jwks_cache[issuer]
+        elif not cached:
+            raise HTTPException(status_code=503, detail="Unable to fetch JWKS: issuer unavailable")
+
+    if kid not in cached[1]:
+        raise HTTPException(status_code=401, detail="Invalid token: unknown signing key")
+    return cached[1][kid]
+
+
+def _decode_verified(token: str, signing_key: PyJWK) -> dict:
+    """Проверка RSA подписи и срока действия (CPU-bound, выполняется в потоке)"""
+    return jwt.decode(
+        token,
+        signing_key.key,
+        algorithms=["RS256"],
+        options={
+            "verify_signature": True,
+            "verify_exp": True,
+            "verify_aud": False,  # Clerk токены могут не иметь audience
+        }
+    )
+
+
+async def verify_clerk_token(token: str) -> dict:
     """
     Проверяет JWT токен от Clerk с полной верификацией подписи
 
+    Ключи загружаются асинхронно и кэшируются на уровне процесса,
+    проверка подписи выполняется в пуле потоков.
+
     Args:
         token: JWT токен из Authorization header
 
@@ -59,34 +209,25 @@ def verify_clerk_token(token: str) -> dict:
         raise HTTPException(status_code=500, detail="CLERK_SECRET_KEY not configured")
 
     try:
-        # Сначала декодируем без проверки, чтобы получить issuer
+        # Сначала читаем заголовок и issuer без проверки подписи
+        header = jwt.get_unverified_header(token)
         unverified = jwt.decode(token, options={"verify_signature": False})
-        issuer = unverified.get("iss", "")
+        issuer = unverified.get("iss", "").rstrip("/")
 
-        # JWKS URL должен быть issuer + /.well-known/jwks.json
-        if issuer:
-            jwks_url = f"{issuer}/.well-known/jwks.json"
-        else:
+        if not issuer:
             raise HTTPException(status_code=401, detail="Token missing issuer")
+        if CLERK_ISSUER and issuer != CLERK_ISSUER:
+            raise HTTPException(status_code=401, detail="Invalid token: unexpected issuer")
+        if not header.get("kid"):
+            raise HTTPException(status_code=401, detail="Invalid token: missing kid")
 
-        # Используем PyJWKClient для получения ключей
-        jwks_client = PyJWKClient(jwks_url, cache_keys=True)
-        signing_key = jwks_client.get_signing_key_from_jwt(token)
+        signing_key = await get_signing_key(issuer, header["kid"])
 
         # Теперь верифицируем токен с правильным ключом
-        decoded = jwt.decode(
-            token,
-            signing_key.key,
-            algorithms=["RS256"],
-            options={
-                "verify_signature": True,
-                "verify_exp": True,
-                "verify_aud": False,  # Clerk токены могут не иметь audience
-            }
-        )
-
-        return decoded
+        return await asyncio.to_thread(_decode_verified, token, signing_key)
 
+    except HTTPException:
+        raise
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.InvalidTokenError as e:
@@ -107,12 +248,12 @@ async def get_current_user(
             return {"user_id": user["sub"]}
     """
     token = credentials.credentials
-    user_data = verify_clerk_token(token)
+    user_data = await verify_clerk_token(token)
     return user_data
 
 
 async def get_current_user_optional(
-    credentials: Optional[HTTPAuthorizationCredentials] = Security(security)
+    credentials: Optional[HTTPAuthorizationCredentials] = Security(optional_security)
 ) -> Optional[dict]:
     """
     Опциональная авторизация - возвращает None если токена нет
@@ -122,7 +263,7 @@ async def get_current_user_optional(
 
     try:
         token = credentials.credentials
-        user_data = verify_clerk_token(token)
+        user_data = await verify_clerk_token(token)
         return user_data
     except:
         return None
@@ -0,0 +1,17 @@
+"""
+Создание таблицы file_blobs (общее хранилище содержимого файлов рассылок)
+"""
+from database import Base, engine, FileBlob
+
+
+def create_file_blobs_table():
+    """Создать таблицу file_blobs"""
+    print("Создание таблицы file_blobs...")
+
+    Base.metadata.create_all(engine, tables=[FileBlob.__table__])
+
+    print("✅ Таблица file_blobs успешно создана!")
+
+
+if __name__ == "__main__":
+    create_file_blobs_table()
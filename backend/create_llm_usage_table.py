@@ -0,0 +1,17 @@
+"""
+Создание таблицы llm_usage в базе данных
+"""
+from database import Base, engine, LLMUsage
+
+
+def create_llm_usage_table():
+    """Создать таблицу llm_usage"""
+    print("Создание таблицы llm_usage...")
+
+    Base.metadata.create_all(engine, tables=[LLMUsage.__table__])
+
+    print("✅ Таблица llm_usage успешно создана!")
+
+
+if __name__ == "__main__":
+    create_llm_usage_table()
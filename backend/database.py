@@ -266,6 +266,7 @@ class DistributionFile(Base):
     file_path = Column(String(500), nullable=False)  # Путь к файлу на сервере
     file_size = Column(Integer, nullable=False)  # Размер в байтах
     file_type = Column(String(100))  # MIME type (image/png, application/pdf и т.д.)
+    sha256 = Column(String(64), index=True)  # Хэш содержимого (считается при загрузке)
 
     # Метаданные
     uploaded_at = Column(DateTime, default=datetime.utcnow)
@@ -277,6 +278,20 @@ class DistributionFile(Base):
         return f"<DistributionFile {self.id}: {self.file_name}>"
 
 
+class FileBlob(Base):
+    """Содержимое загруженного файла, общее для всех DistributionFile с тем же sha256"""
+    __tablename__ = 'file_blobs'
+
+    sha256 = Column(String(64), primary_key=True)
+    file_path = Column(String(500), nullable=False)  # uploads/blobs/ab/abcdef...
+    file_size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)  # Сколько DistributionFile ссылаются на файл
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<FileBlob {self.sha256[:12]} refs={self.ref_count}>"
+
+
 class DeliveryLog(Base):
     """Лог доставки пресс-релиза в конкретное СМИ"""
     __tablename__ = 'delivery_logs'
@@ -310,6 +325,30 @@ class DeliveryLog(Base):
         return f"<DeliveryLog {self.id}: {self.status}>"
 
 
+class LLMUsage(Base):
+    """Учёт вызова LLM (токены и стоимость) для квот пользователей"""
+    __tablename__ = 'llm_usage'
+
+    id = Column(Integer, primary_key=True)
+    clerk_user_id = Column(String(255), index=True)  # None - анонимный запрос
+
+    model = Column(String(255), nullable=False)
+    namespace = Column(String(50))  # press_release, improve_text, media_relevance
+    outcome = Column(String(20), nullable=False)  # success, error, cancelled, coalesced
+    attempt = Column(Integer, default=0)
+    streamed = Column(Boolean, default=False)
+
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    cost = Column(Float)  # Доллары, None если цена модели неизвестна
+    latency = Column(Float)  # Секунды
+
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<LLMUsage {self.id}: {self.model} {self.outcome}>"
+
+
 # Настройка подключения к БД
 DATABASE_URL = os.getenv(
     'DATABASE_URL',
@@ -1,12 +1,224 @@
 """
 Генерация персонализированных HTML email-шаблонов
+
+HTML письма компилируется один раз на брендинг: документ рендерится с метками
+на месте заголовка, текста и приветствия и режется по ним на статические части.
+Части (шапка с логотипом, подпись, соцсети, футер) кэшируются по ключу
+(пользователь, updated_at брендинга) или по содержимому брендинга, а на каждое
+письмо склеиваются только данные конкретного письма.
+
+При компиляции статические части минифицируются (отступы между тегами,
+комментарии); по желанию повторяющиеся inline стили выносятся в <style>.
+
+Заголовок, текст и приветствие - обычный текст и подставляются в HTML
+экранированными, одинаково при рендере шаблона и при подстановке приветствия
+получателя (PersonalizedEmail).
 """
+import html
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+# Брендинг по умолчанию (пользователь ещё не настроил брендинг)
+DEFAULT_BRANDING = {
+    'primary_color': '#3B82F6',
+    'secondary_color': '#8B5CF6',
+    'accent_color': '#10B981',
+    'company_name': 'Компания',
+    'contact_email': '',
+    'default_closing': 'С уважением',
+    'show_logo_in_header': True,
+    'show_social_links': True,
+    'logo_url': None,
+    'website': None,
+    'contact_person': None,
+    'email_signature': None,
+    'footer_text': None,
+}
+
+# Метки мест подстановки; в брендинге и тексте письма не встречаются
+_SLOT_MARK = "\x00slot:{}\x00"
+_SLOT_RE = re.compile(r"\x00slot:(\w+)\x00")
+
+TEMPLATE_CACHE_SIZE = 256
+
+# Минификация HTML шаблона (отступы и комментарии занимают ~30% письма)
+EMAIL_MINIFY_HTML = os.getenv("EMAIL_MINIFY_HTML", "true").lower() == "true"
+# Повторяющиеся inline стили -> классы в <style>; часть почтовых клиентов <style> вырезает
+EMAIL_STYLE_DEDUPE = os.getenv("EMAIL_STYLE_DEDUPE", "false").lower() == "true"
+
+_INDENT_AFTER_TAG_RE = re.compile(r">[ \t]*\n\s*")
+_INDENT_BEFORE_TAG_RE = re.compile(r"\s*\n[ \t]*<")
+_COMMENT_RE = re.compile(r"<!--(?!\[if).*?-->", re.DOTALL)
+_TAG_RE = re.compile(r"<[a-zA-Z][^>]*>")
+_STYLE_ATTR_RE = re.compile(r' style="([^"]*)"')
+_STYLE_SEPARATOR_RE = re.compile(r"\s*([:;])\s*")
+
+# Версия шаблона: увеличивается при изменении разметки или экранирования,
+# чтобы сохранённые рендеры писем (render_options_key) перерендерились
+EMAIL_TEMPLATE_VERSION = 2
+
+
+def render_options_key() -> str:
+    """Параметры, от которых зависит HTML письма, для ключа сохранённого рендера"""
+    return f"v{EMAIL_TEMPLATE_VERSION}:minify={int(EMAIL_MINIFY_HTML)}:dedupe={int(EMAIL_STYLE_DEDUPE)}"
+
+
+def _greeting(recipient_name: Optional[str]) -> str:
+    return f"Здравствуйте, {recipient_name}!" if recipient_name else "Здравствуйте!"
+
+
+class CompiledEmailTemplate:
+    """HTML письма, разрезанный на статические части и места подстановки"""
+
+    def __init__(self, parts: List[str], slots: List[str]):
+        self.parts = parts
+        self.slots = slots
+        # Экранированные заголовок и текст последнего письма: получатели одной рассылки
+        # отличаются только приветствием
+        self._escaped: Tuple[str, str, str, str] = ("", "", "", "")
+
+    def render(self, title: str, content: str, greeting: str) -> str:
+        return self.render_with_greeting_span(title, content, greeting)[0]
+
+    def render_with_greeting_span(self, title: str, content: str, greeting: str) -> Tuple[str, List[int]]:
+        """HTML и позиция [start, end) приветствия в нём (значения экранируются)"""
+        title, content = title or "", content or ""
+        escaped = self._escaped
+        if escaped[0] != title or escaped[1] != content:
+            escaped = (title, content, html.escape(title, quote=False), html.escape(content, quote=False))
+            self._escaped = escaped
+        values = {"title": escaped[2], "content": escaped[3], "greeting": html.escape(greeting, quote=False)}
+        chunks = [self.parts[0]]
+        position = len(self.parts[0])
+        span = [0, 0]
+        for slot, part in zip(self.slots, self.parts[1:]):
+            value = values[slot]
+            if slot == "greeting":
+                span = [position, position + len(value)]
+            chunks.append(value)
+            chunks.append(part)
+            position += len(value) + len(part)
+        return "".join(chunks), span
+
+
+def minify_html(document: str) -> str:
+    """
+    Убирает комментарии, переносы строк с отступами рядом с тегами и пробелы
+    вокруг ":" и ";" в inline стилях. Пробелы внутри строк текста не трогаются.
+    """
+    document = _COMMENT_RE.sub("", document)
+    document = _INDENT_AFTER_TAG_RE.sub(">", document)
+    document = _INDENT_BEFORE_TAG_RE.sub("<", document)
+    return _STYLE_ATTR_RE.sub(
+        lambda match: ' style="' + _STYLE_SEPARATOR_RE.sub(r"\1", match.group(1)) + '"', document
+    )
+
+
+def dedupe_styles(parts: List[str]) -> List[str]:
+    """
+    Inline стили, повторяющиеся в шаблоне, заменяются классами с правилами в <style> в <head>.
+    Теги, у которых уже есть class, не меняются.
+    """
+    counts = {}
+    for part in parts:
+        for tag in _TAG_RE.findall(part):
+            match = _STYLE_ATTR_RE.search(tag)
+            if match and " class=" not in tag:
+                counts[match.group(1)] = counts.get(match.group(1), 0) + 1
+    classes = {}
+    for style, count in counts.items():
+        if count > 1:
+            classes[style] = f"pr{len(classes) + 1}"
+    if not classes:
+        return parts
+
+    def replace_tag(match: re.Match) -> str:
+        tag = match.group(0)
+        style = _STYLE_ATTR_RE.search(tag)
+        if not style or style.group(1) not in classes or " class=" in tag:
+            return tag
+        return tag.replace(style.group(0), f' class="{classes[style.group(1)]}"', 1)
+
+    style_block = "<style>" + "".join(f".{name}{{{style}}}" for style, name in classes.items()) + "</style>"
+    result = []
+    for part in parts:
+        part = _TAG_RE.sub(replace_tag, part)
+        if "</head>" in part:
+            part = part.replace("</head>", style_block + "</head>", 1)
+        result.append(part)
+    return result
+
+
+def compile_email_template(branding: dict = None) -> CompiledEmailTemplate:
+    """Компилирует HTML шаблон письма для брендинга"""
+    document = _render_document(
+        _SLOT_MARK.format("title"),
+        _SLOT_MARK.format("content"),
+        branding or DEFAULT_BRANDING,
+        _SLOT_MARK.format("greeting"),
+    )
+    pieces = _SLOT_RE.split(document)
+    # re.split с группой: [часть, имя слота, часть, имя слота, ..., часть]
+    parts, slots = pieces[0::2], pieces[1::2]
+    if EMAIL_MINIFY_HTML:
+        parts = [minify_html(part) for part in parts]
+    if EMAIL_STYLE_DEDUPE:
+        parts = dedupe_styles(parts)
+    return CompiledEmailTemplate(parts, slots)
+
+
+class _TemplateCache:
+    """LRU скомпилированных шаблонов"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CompiledEmailTemplate]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, branding: dict) -> CompiledEmailTemplate:
+        with self._lock:
+            template = self._entries.get(key)
+            if template is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+        template = compile_email_template(branding)
+        with self._lock:
+            self._entries[key] = template
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return template
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+template_cache = _TemplateCache(TEMPLATE_CACHE_SIZE)
+
+
+def _branding_key(branding: Optional[dict]) -> Hashable:
+    """Ключ кэша по содержимому брендинга (когда нет updated_at)"""
+    if not branding:
+        return ("default",)
+    return ("content",) + tuple(sorted((k, str(v)) for k, v in branding.items()))
+
 
 def generate_email_html(
     press_release_title: str,
     press_release_content: str,
     branding: dict = None,
-    recipient_name: str = None
+    recipient_name: str = None,
+    cache_key: Hashable = None
 ) -> str:
     """
     Генерирует HTML письма с брендингом пользователя
@@ -16,31 +228,76 @@ def generate_email_html(
         press_release_content: Текст пресс-релиза
         branding: Настройки брендинга пользователя
         recipient_name: Имя получателя
+        cache_key: Ключ скомпилированного шаблона, например (user_id, branding.updated_at);
+            должен меняться вместе с брендингом. По умолчанию - содержимое branding
 
     Returns:
         HTML код письма
     """
+    key = ("key", cache_key) if cache_key is not None else _branding_key(branding)
+    template = template_cache.get(key, branding)
+    return template.render(press_release_title, press_release_content, _greeting(recipient_name))
 
-    # Значения по умолчанию
-    if not branding:
-        branding = {
-            'primary_color': '#3B82F6',
-            'secondary_color': '#8B5CF6',
-            'accent_color': '#10B981',
-            'company_name': 'Компания',
-            'contact_email': '',
-            'default_closing': 'С уважением',
-            'show_logo_in_header': True,
-            'show_social_links': True,
-            'logo_url': None,
-            'website': None,
-            'contact_person': None,
-            'email_signature': None,
-            'footer_text': None,
-        }
 
-    # Формируем приветствие
-    greeting = f"Здравствуйте, {recipient_name}!" if recipient_name else "Здравствуйте!"
+def render_email_bodies(
+    press_release_title: str,
+    press_release_content: str,
+    branding: dict = None,
+    cache_key: Hashable = None
+) -> dict:
+    """
+    HTML и текст письма без имени получателя и позиции приветствия в них
+
+    Позиции сохраняются вместе с письмом, чтобы PersonalizedEmail подставлял
+    приветствие получателя без повторного рендера.
+
+    Returns:
+        {"email_html", "email_plain", "greeting_spans": {"html": [start, end], "plain": [start, end]}}
+    """
+    key = ("key", cache_key) if cache_key is not None else _branding_key(branding)
+    greeting = _greeting(None)
+    email_html, html_span = template_cache.get(key, branding).render_with_greeting_span(
+        press_release_title, press_release_content, greeting
+    )
+    email_plain = generate_plain_text_email(press_release_title, press_release_content, branding)
+    # Текстовая версия начинается с приветствия
+    return {
+        "email_html": email_html,
+        "email_plain": email_plain,
+        "greeting_spans": {"html": html_span, "plain": [0, len(greeting)]},
+    }
+
+
+class PersonalizedEmail:
+    """
+    Письмо, отрендеренное один раз, с подстановкой приветствия на каждого получателя
+
+    Части до и после приветствия готовятся один раз; письмо получателя -
+    склейка трёх строк, без рендера шаблона.
+    """
+
+    def __init__(self, email_html: str, email_plain: str, greeting_spans: dict):
+        html_start, html_end = greeting_spans["html"]
+        plain_start, plain_end = greeting_spans["plain"]
+        self._html_parts = (email_html[:html_start], email_html[html_end:])
+        self._plain_parts = (email_plain[:plain_start], email_plain[plain_end:])
+
+    def render(self, recipient_name: Optional[str] = None) -> Tuple[str, str]:
+        """(html, text) письма для получателя"""
+        greeting = _greeting(recipient_name)
+        return (
+            "".join((self._html_parts[0], html.escape(greeting, quote=False), self._html_parts[1])),
+            "".join((self._plain_parts[0], greeting, self._plain_parts[1])),
+        )
+
+
+def _render_document(
+    press_release_title: str,
+    press_release_content: str,
+    branding: dict,
+    greeting: str
+) -> str:
+    """Полный HTML документ письма (используется для компиляции шаблона)"""
 
     # Логотип в шапке
     logo_html = ""
@@ -191,7 +448,7 @@ def generate_plain_text_email(
             'website': None,
         }
 
-    greeting = f"Здравствуйте, {recipient_name}!" if recipient_name else "Здравствуйте!"
+    greeting = _greeting(recipient_name)
 
     text = f"""
 {greeting}
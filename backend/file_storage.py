@@ -0,0 +1,269 @@
+"""
+Сохранение загружаемых файлов на диск потоком
+
+Файл читается из UploadFile частями и пишется во временный файл в папке
+назначения; запись и подсчёт SHA-256 идут в потоке, а не в event loop.
+Превышение лимита размера прерывает загрузку сразу, не дочитывая файл.
+Готовый файл переименовывается в итоговое имя атомарно (os.replace),
+поэтому недописанный файл никогда не виден под итоговым именем.
+
+Содержимое хранится по sha256 (BlobStore): одинаковые файлы, загруженные к
+разным рассылкам, лежат на диске один раз, FileBlob.ref_count считает ссылки
+из DistributionFile, файл удаляется с последней ссылкой.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Tuple
+
+from fastapi import UploadFile
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+try:
+    from database import FileBlob
+except ImportError:
+    from .database import FileBlob
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+class FileTooLargeError(Exception):
+    """Файл больше допустимого размера"""
+
+    def __init__(self, max_size: int):
+        super().__init__(f"Файл больше {max_size} байт")
+        self.max_size = max_size
+
+
+@dataclass
+class StoredFile:
+    path: Path
+    size: int
+    sha256: str
+
+
+async def hash_upload(upload: UploadFile, max_size: int) -> Tuple[str, int]:
+    """
+    SHA-256 и размер загружаемого файла без записи на диск; после вызова файл
+    перематывается в начало для сохранения
+
+    Raises:
+        FileTooLargeError: Размер файла превысил max_size
+    """
+    if upload.size is not None and upload.size > max_size:
+        raise FileTooLargeError(max_size)
+    hasher = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise FileTooLargeError(max_size)
+        await asyncio.to_thread(hasher.update, chunk)
+    await upload.seek(0)
+    return hasher.hexdigest(), size
+
+
+def _write_chunk(handle, hasher, chunk: bytes):
+    handle.write(chunk)
+    hasher.update(chunk)
+
+
+def _finish(handle, temp_path: Path, target_path: Path):
+    handle.flush()
+    os.fsync(handle.fileno())
+    handle.close()
+    os.replace(temp_path, target_path)
+
+
+def _discard(handle, temp_path: Path):
+    handle.close()
+    temp_path.unlink(missing_ok=True)
+
+
+async def save_upload(upload: UploadFile, target_path: Path, max_size: int) -> StoredFile:
+    """
+    Сохраняет загружаемый файл в target_path
+
+    Raises:
+        FileTooLargeError: Размер файла превысил max_size (временный файл удаляется)
+    """
+    # Размер известен заранее, если клиент его передал - отказываем без чтения
+    if upload.size is not None and upload.size > max_size:
+        raise FileTooLargeError(max_size)
+
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    # Временный файл рядом с итоговым: rename в пределах одной файловой системы атомарен
+    temp_path = target_path.with_name(f".{target_path.name}.{uuid.uuid4().hex}.part")
+    handle = await asyncio.to_thread(open, temp_path, "wb")
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise FileTooLargeError(max_size)
+            await asyncio.to_thread(_write_chunk, handle, hasher, chunk)
+        await asyncio.to_thread(_finish, handle, temp_path, target_path)
+    except BaseException:
+        await asyncio.to_thread(_discard, handle, temp_path)
+        raise
+
+    logger.info(f"Файл сохранён: {target_path} ({size} байт, sha256 {hasher.hexdigest()[:12]}...)")
+    return StoredFile(path=target_path, size=size, sha256=hasher.hexdigest())
+
+
+class BlobStore:
+    """
+    Хранилище содержимого файлов по sha256 со счётчиком ссылок в таблице file_blobs
+
+    Счётчик меняется атомарно в SQL (ref_count = ref_count + 1 / - 1), поэтому
+    работает и при нескольких воркерах: UPDATE блокирует строку file_blobs до
+    commit, и acquire/release одного содержимого в разных процессах выполняются
+    по очереди. Commit делает вызывающий - в той же транзакции, что и
+    изменение DistributionFile, и без await между возвратом из метода и commit.
+    Файлы удаляются только после commit (purge), чтобы откат не оставил запись
+    без файла.
+
+    Блокировки процесса (по sha256) не дают корутинам одного воркера ждать
+    блокировку строки друг друга синхронным запросом в event loop.
+    """
+
+    LOCK_STRIPES = 64
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._locks = [asyncio.Lock() for _ in range(self.LOCK_STRIPES)]
+        self.deduplicated = 0
+
+    def path_for(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+
+    def _lock(self, sha256: str) -> asyncio.Lock:
+        return self._locks[int(sha256[:8], 16) % self.LOCK_STRIPES]
+
+    async def _write(self, upload: UploadFile, path: Path, sha256: str, max_size: int):
+        await upload.seek(0)
+        stored = await save_upload(upload, path, max_size)
+        if stored.sha256 != sha256:
+            # Файл изменился между подсчётом хэша и записью - под этим хэшем хранить нельзя
+            await asyncio.to_thread(path.unlink, True)
+            raise ValueError("Содержимое файла изменилось во время загрузки")
+
+    @staticmethod
+    def _increment(db: Session, sha256: str, path: Path, size: int):
+        """+1 ссылка: UPDATE существующей записи или INSERT новой (при конфликте - снова UPDATE)"""
+        blobs = db.query(FileBlob).filter(FileBlob.sha256 == sha256)
+        if blobs.update({FileBlob.ref_count: FileBlob.ref_count + 1}, synchronize_session=False):
+            return
+        try:
+            with db.begin_nested():
+                db.add(FileBlob(sha256=sha256, file_path=str(path), file_size=size, ref_count=1))
+        except IntegrityError:
+            # Запись с тем же sha256 одновременно создал другой воркер
+            if not blobs.update({FileBlob.ref_count: FileBlob.ref_count + 1}, synchronize_session=False):
+                raise
+
+    async def acquire(self, db: Session, upload: UploadFile, max_size: int) -> Tuple[FileBlob, bool]:
+        """
+        Сохраняет загружаемый файл (или находит уже сохранённый) и добавляет ссылку на него.
+        Сначала считается хэш; если такое содержимое уже есть, файл на диск не пишется.
+
+        Ссылка добавляется в текущей транзакции db и фиксируется commit вызывающего.
+        Если файл удалили (release в другом воркере) между записью и блокировкой
+        строки, транзакция откатывается и запись повторяется - поэтому acquire
+        вызывается до других изменений в сессии.
+
+        Returns:
+            (FileBlob, True если содержимое уже было в хранилище)
+
+        Raises:
+            FileTooLargeError: Размер файла превысил max_size
+        """
+        sha256, size = await hash_upload(upload, max_size)
+        path = self.path_for(sha256)
+        async with self._lock(sha256):
+            for _ in range(self.MAX_ATTEMPTS):
+                existed = path.exists()
+                if not existed:
+                    # Пишем до блокировки строки: запись большого файла не держит блокировку в БД
+                    await self._write(upload, path, sha256, max_size)
+                self._increment(db, sha256, path, size)
+                # Строка заблокирована до commit - release в другом воркере файл уже не удалит
+                if path.exists():
+                    break
+                db.rollback()
+            else:
+                raise RuntimeError(f"Не удалось сохранить файл {sha256[:12]}...: удаляется параллельно")
+            blob = db.get(FileBlob, sha256, populate_existing=True)
+
+        if existed:
+            self.deduplicated += 1
+            logger.info(f"Файл {sha256[:12]}... уже в хранилище, ссылок: {blob.ref_count}")
+        return blob, existed
+
+    async def release(self, db: Session, sha256: str) -> bool:
+        """
+        Убирает ссылку на содержимое; с последней ссылкой удаляет запись (в транзакции db)
+
+        Returns:
+            True, если ссылок не осталось: после commit вызывающий удаляет файл через purge
+        """
+        async with self._lock(sha256):
+            blobs = db.query(FileBlob).filter(FileBlob.sha256 == sha256)
+            if not blobs.update({FileBlob.ref_count: FileBlob.ref_count - 1}, synchronize_session=False):
+                return False
+            if db.query(FileBlob.ref_count).filter(FileBlob.sha256 == sha256).scalar() > 0:
+                return False
+            blobs.delete(synchronize_session=False)
+            return True
+
+    async def purge(self, db: Session, sha256: str) -> bool:
+        """
+        Удаляет файл содержимого без записи в file_blobs: после commit release, вернувшего
+        True, или после отката загрузки, записавшей новый файл. Выполняется в своей транзакции.
+
+        На время удаления вставляется временная запись с тем же sha256: acquire в другом
+        воркере дождётся её commit и, не найдя файла, запишет его заново. Если запись уже
+        есть (содержимое загрузили снова), файл остаётся.
+
+        Returns:
+            True, если файл удалён
+        """
+        path = self.path_for(sha256)
+        blobs = FileBlob.__table__
+        async with self._lock(sha256):
+            try:
+                db.execute(blobs.insert().values(sha256=sha256, file_path=str(path), file_size=0, ref_count=0))
+            except IntegrityError:
+                db.rollback()
+                return False
+            except SQLAlchemyError as e:
+                db.rollback()
+                logger.warning(f"Не удалось удалить файл {sha256[:12]}...: {e}")
+                return False
+            try:
+                path.unlink(missing_ok=True)
+                logger.info(f"Файл {sha256[:12]}... удалён из хранилища (нет ссылок)")
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл {path}: {e}")
+            try:
+                db.execute(blobs.delete().where(blobs.c.sha256 == sha256))
+                db.commit()
+            except SQLAlchemyError as e:
+                db.rollback()
+                logger.warning(f"Не удалось снять временную запись {sha256[:12]}...: {e}")
+            return True
@@ -0,0 +1,193 @@
+"""
+Кэш ответов LLM с адресацией по содержимому запроса
+
+Два уровня:
+- LRU в памяти процесса (миллисекунды, без сериализации);
+- опциональный SQLite файл, общий для всех uvicorn воркеров (LLM_CACHE_DB_PATH).
+
+SingleFlight объединяет одновременные одинаковые запросы в один вызов модели.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# TTL (секунды) по типу запроса, 0 - не кэшировать
+CACHE_TTLS = {
+    "press_release": int(os.getenv("LLM_CACHE_TTL_PRESS_RELEASE", "3600")),
+    "improve_text": int(os.getenv("LLM_CACHE_TTL_IMPROVE_TEXT", "3600")),
+    "media_relevance": int(os.getenv("LLM_CACHE_TTL_MEDIA_RELEVANCE", "86400")),
+}
+
+
+def make_cache_key(
+    models: list,
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    max_tokens: int,
+    json_mode: bool,
+    namespace: Optional[str]
+) -> str:
+    """SHA-256 от модели(ей), промптов и всех параметров, влияющих на ответ"""
+    payload = json.dumps(
+        [list(models), system_prompt, user_prompt, round(float(temperature), 3), max_tokens, bool(json_mode), namespace],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    """SQLite хранилище, общее для нескольких процессов"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row and row[1] > time.time():
+            return row
+        return None
+
+    def set(self, key: str, value: str, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            self._writes += 1
+            # Периодически чистим просроченные записи
+            if self._writes % 100 == 0:
+                self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+
+
+class LLMResponseCache:
+    """Двухуровневый кэш ответов модели"""
+
+    def __init__(self, max_entries: int = 512, disk_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._disk = None
+        self.hits = 0
+        self.misses = 0
+
+        if disk_path:
+            try:
+                self._disk = _DiskTier(disk_path)
+                logger.info(f"Дисковый кэш LLM: {disk_path}")
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось открыть дисковый кэш LLM {disk_path}: {e}")
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry:
+            if entry[1] > time.time():
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self._memory[key]
+
+        if self._disk:
+            try:
+                row = await asyncio.to_thread(self._disk.get, key)
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка чтения дискового кэша LLM: {e}")
+                row = None
+            if row:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str, ttl: int):
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self._remember(key, value, expires_at)
+
+        if self._disk:
+            try:
+                await asyncio.to_thread(self._disk.set, key, value, expires_at)
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка записи в дисковый кэш LLM: {e}")
+
+    def clear(self):
+        self._memory.clear()
+        if self._disk:
+            self._disk.clear()
+
+    def stats(self) -> dict:
+        return {
+            "memory_entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "disk_enabled": self._disk is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttls": CACHE_TTLS,
+        }
+
+
+class SingleFlight:
+    """
+    Объединение одновременных запросов с одинаковым ключом.
+
+    Первый вызов запускает задачу, остальные ждут её же результат (или ошибку).
+    Задача защищена от отмены отдельным вызывающим: если один клиент отключился,
+    остальные всё равно получат ответ.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.info(f"Joining in-flight request ({key[:12]})")
+        else:
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Ошибка могла остаться без ожидающих - забираем её, чтобы не было warning'а
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._inflight), "coalesced": self.coalesced}
@@ -0,0 +1,132 @@
+"""
+HTTP транспорт для запросов к OpenRouter
+
+Один httpx.AsyncClient на процесс с настраиваемым пулом соединений, keep-alive
+и HTTP/2 (если установлен пакет h2), таймауты по типу запроса. Через trace
+httpcore считается, сколько запросов ушло по уже открытому соединению, а
+сколько потребовали нового TCP/TLS подключения.
+"""
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class HTTPSettings:
+    """Параметры пула и таймаутов из окружения"""
+
+    def __init__(self):
+        self.max_connections = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+        self.max_keepalive_connections = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+        self.keepalive_expiry = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "90"))
+        self.connect_timeout = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "5"))
+        self.pool_timeout = float(os.getenv("LLM_HTTP_POOL_TIMEOUT", "5"))
+        self.write_timeout = float(os.getenv("LLM_HTTP_WRITE_TIMEOUT", "10"))
+
+        self.http2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+        if self.http2 and not _http2_available():
+            logger.info("HTTP/2 для OpenRouter недоступен (не установлен пакет h2), используется HTTP/1.1")
+            self.http2 = False
+
+        # Таймаут чтения по типу запроса: время ожидания ответа модели
+        # (для потоков - максимальная пауза между фрагментами)
+        self.read_timeouts: Dict[str, float] = {
+            "press_release": float(os.getenv("LLM_READ_TIMEOUT_PRESS_RELEASE", "45")),
+            "improve_text": float(os.getenv("LLM_READ_TIMEOUT_IMPROVE_TEXT", "30")),
+            "media_relevance": float(os.getenv("LLM_READ_TIMEOUT_MEDIA_RELEVANCE", "20")),
+            "stream": float(os.getenv("LLM_READ_TIMEOUT_STREAM", "20")),
+        }
+        self.default_read_timeout = float(os.getenv("LLM_READ_TIMEOUT", "30"))
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout(self, kind: Optional[str] = None) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeouts.get(kind, self.default_read_timeout),
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+    def snapshot(self) -> dict:
+        return {
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self.max_keepalive_connections,
+            "keepalive_expiry": self.keepalive_expiry,
+            "http2": self.http2,
+            "connect_timeout": self.connect_timeout,
+            "read_timeouts": self.read_timeouts,
+        }
+
+
+class ConnectionStats:
+    """Счётчики запросов и новых соединений по событиям httpcore"""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.connect_time_total = 0.0
+        self.http_versions: Dict[str, int] = {}
+        self.started_at = time.time()
+
+    async def on_request(self, request: httpx.Request):
+        self.requests += 1
+        connect_started = {}
+
+        async def trace(event_name: str, info: dict):
+            if event_name == "connection.connect_tcp.started":
+                connect_started["at"] = time.monotonic()
+            elif event_name == "connection.connect_tcp.complete":
+                self.new_connections += 1
+                if "at" in connect_started:
+                    self.connect_time_total += time.monotonic() - connect_started["at"]
+            elif event_name == "connection.start_tls.complete":
+                self.tls_handshakes += 1
+
+        request.extensions["trace"] = trace
+
+    async def on_response(self, response: httpx.Response):
+        version = response.http_version
+        self.http_versions[version] = self.http_versions.get(version, 0) + 1
+
+    def snapshot(self) -> dict:
+        reused = max(0, self.requests - self.new_connections)
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "tls_handshakes": self.tls_handshakes,
+            "reused_connections": reused,
+            "reuse_ratio": round(reused / self.requests, 3) if self.requests else None,
+            "avg_connect_seconds": (
+                round(self.connect_time_total / self.new_connections, 3) if self.new_connections else None
+            ),
+            "http_versions": dict(self.http_versions),
+        }
+
+
+def build_http_client(settings: HTTPSettings, stats: ConnectionStats) -> httpx.AsyncClient:
+    """Общий httpx клиент для AsyncOpenAI"""
+    return httpx.AsyncClient(
+        limits=settings.limits(),
+        timeout=settings.timeout(),
+        http2=settings.http2,
+        event_hooks={"request": [stats.on_request], "response": [stats.on_response]},
+    )
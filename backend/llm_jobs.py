@@ -0,0 +1,265 @@
+"""
+Фоновые задачи генерации
+
+Долгая генерация (медленные модели, резервные модели после ошибок) не должна
+зависеть от таймаутов клиента и nginx: запрос ставит задачу и сразу получает
+job_id, генерация идёт в отдельной asyncio задаче, результат хранится JOB_TTL
+секунд и забирается опросом или через SSE.
+
+Одинаковые запросы, отправленные повторно (ретраи клиента), пока задача не
+завершилась, получают ту же задачу. Задача видна только пользователю, который
+её поставил (анонимная - только анонимным запросам).
+При нескольких uvicorn воркерах состояние задач дублируется в SQLite
+(LLM_JOBS_DB_PATH), чтобы опрос, попавший в другой воркер, нашёл задачу.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobLimitError(Exception):
+    """Слишком много незавершённых задач"""
+
+
+class Job:
+    def __init__(self, job_id: str, kind: str, fingerprint: Optional[str] = None, user_id: Optional[str] = None):
+        self.id = job_id
+        self.kind = kind
+        self.fingerprint = fingerprint
+        self.user_id = user_id
+        self.status = PENDING
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.finished = asyncio.Event()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self) -> dict:
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == DONE:
+            data["result"] = self.result
+        if self.status == FAILED:
+            data["error"] = self.error
+        return data
+
+
+class _JobStore:
+    """SQLite копия состояния задач, общая для воркеров"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_jobs ("
+            "id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def save(self, job_data: dict, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_jobs (id, data, expires_at) VALUES (?, ?, ?)",
+                (job_data["job_id"], json.dumps(job_data, ensure_ascii=False, default=str), expires_at),
+            )
+
+    def load(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, expires_at FROM llm_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row and row[1] > time.time():
+            return json.loads(row[0])
+        return None
+
+    def purge(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_jobs WHERE expires_at < ?", (time.time(),))
+
+
+class JobManager:
+    """Очередь фоновых задач генерации с TTL результатов"""
+
+    def __init__(self, ttl: int = 3600, max_pending: int = 100, db_path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self._jobs: Dict[str, Job] = {}
+        self._by_fingerprint: Dict[str, str] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._store = None
+        self.deduplicated = 0
+        if db_path:
+            try:
+                self._store = _JobStore(db_path)
+                logger.info(f"Хранилище фоновых задач: {db_path}")
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось открыть хранилище задач {db_path}: {e}")
+
+    @staticmethod
+    def fingerprint(kind: str, payload: dict, user_id: Optional[str] = None) -> str:
+        raw = json.dumps([kind, user_id, payload], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.is_finished and job.finished_at + self.ttl < now
+        ]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if job.fingerprint and self._by_fingerprint.get(job.fingerprint) == job_id:
+                del self._by_fingerprint[job.fingerprint]
+
+    async def _persist(self, job: Job):
+        if not self._store:
+            return
+        try:
+            data = {**job.to_dict(), "user_id": job.user_id}
+            await asyncio.to_thread(self._store.save, data, time.time() + self.ttl)
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка записи задачи {job.id}: {e}")
+
+    def submit(
+        self,
+        kind: str,
+        fn: Callable[[], Awaitable[dict]],
+        fingerprint: Optional[str] = None,
+        user_id: Optional[str] = None
+    ) -> Job:
+        """
+        Ставит задачу от имени user_id; повторный запрос с тем же fingerprint, пока
+        задача ещё выполняется, возвращает её. Завершённая задача не переиспользуется:
+        повторный запрос - новая генерация.
+
+        Raises:
+            JobLimitError: Незавершённых задач больше max_pending
+        """
+        self._purge_expired()
+
+        if fingerprint:
+            existing = self._jobs.get(self._by_fingerprint.get(fingerprint, ""))
+            if existing and not existing.is_finished:
+                self.deduplicated += 1
+                return existing
+
+        pending = sum(1 for job in self._jobs.values() if not job.is_finished)
+        if pending >= self.max_pending:
+            raise JobLimitError(f"Слишком много задач в очереди ({pending})")
+
+        job = Job(uuid.uuid4().hex, kind, fingerprint, user_id)
+        self._jobs[job.id] = job
+        if fingerprint:
+            self._by_fingerprint[fingerprint] = job.id
+        task = asyncio.create_task(self._run(job, fn))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        return job
+
+    async def _run(self, job: Job, fn: Callable[[], Awaitable[dict]]):
+        job.status = RUNNING
+        job.started_at = time.time()
+        await self._persist(job)
+        try:
+            job.result = await fn()
+            job.status = DONE
+        except asyncio.CancelledError:
+            job.status = FAILED
+            job.error = "Задача отменена"
+            raise
+        except Exception as e:
+            logger.error(f"Фоновая задача {job.id} ({job.kind}) завершилась ошибкой: {str(e)}")
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            job.finished.set()
+            logger.info(f"Фоновая задача {job.id} ({job.kind}): {job.status} "
+                        f"за {job.finished_at - job.started_at:.1f}с")
+            await self._persist(job)
+
+    async def get(self, job_id: str, user_id: Optional[str] = None) -> Optional[dict]:
+        """
+        Состояние задачи (из памяти или общего хранилища), None если нет, истекла
+        или поставлена другим пользователем
+        """
+        job = self._jobs.get(job_id)
+        if job:
+            return job.to_dict() if job.user_id == user_id else None
+        if self._store:
+            try:
+                data = await asyncio.to_thread(self._store.load, job_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка чтения задачи {job_id}: {e}")
+                return None
+            if data and data.pop("user_id", None) == user_id:
+                return data
+        return None
+
+    async def wait(
+        self, job_id: str, timeout: float, user_id: Optional[str] = None, poll_interval: float = 1.0
+    ) -> Optional[dict]:
+        """Ждёт завершения задачи не дольше timeout и возвращает её состояние (как get)"""
+        job = self._jobs.get(job_id)
+        if job:
+            if job.user_id != user_id:
+                return None
+            try:
+                await asyncio.wait_for(job.finished.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return job.to_dict()
+
+        # Задача другого воркера - опрашиваем общее хранилище
+        deadline = time.monotonic() + timeout
+        while True:
+            data = await self.get(job_id, user_id)
+            if data is None or data["status"] in (DONE, FAILED) or time.monotonic() >= deadline:
+                return data
+            await asyncio.sleep(poll_interval)
+
+    async def shutdown(self):
+        """Отменяет незавершённые задачи при остановке приложения"""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        if self._store:
+            self._store.purge()
+
+    def stats(self) -> dict:
+        statuses = {}
+        for job in self._jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "jobs": len(self._jobs),
+            "by_status": statuses,
+            "deduplicated": self.deduplicated,
+            "ttl": self.ttl,
+            "max_pending": self.max_pending,
+            "shared_store": self._store is not None,
+        }
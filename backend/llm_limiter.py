@@ -0,0 +1,171 @@
+"""
+Контроль допуска запросов к LLM
+
+Ограничивает число одновременных вызовов модели в процессе, держит ограниченную
+очередь ожидания и быстро отказывает (LLMOverloadedError -> HTTP 503), когда
+очередь заполнена или ожидание слишком долгое. Опционально ограничивает общее
+число вызовов всех uvicorn воркеров через файловые блокировки.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class LLMOverloadedError(Exception):
+    """Нет свободного слота для вызова модели"""
+
+
+class _GlobalSlots:
+    """Общие для всех процессов слоты: N lock-файлов, слот занят, пока держим flock"""
+
+    def __init__(self, directory: str, slots: int, poll_interval: float = 0.05):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.paths = [self.directory / f"slot-{i}.lock" for i in range(slots)]
+        self.poll_interval = poll_interval
+
+    def _try_acquire(self) -> Optional[int]:
+        for path in self.paths:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    async def acquire(self, deadline: float) -> int:
+        while True:
+            fd = self._try_acquire()
+            if fd is not None:
+                return fd
+            if time.monotonic() >= deadline:
+                raise LLMOverloadedError("Все слоты LLM заняты другими процессами")
+            await asyncio.sleep(self.poll_interval)
+
+    @staticmethod
+    def release(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class AdmissionController:
+    """Семафор с ограниченной очередью и метриками ожидания"""
+
+    def __init__(
+        self,
+        max_concurrent: int = 8,
+        max_queue: int = 32,
+        queue_timeout: float = 10.0,
+        global_slots: int = 0,
+        global_slots_dir: Optional[str] = None,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._global = None
+        if global_slots > 0 and global_slots_dir:
+            if fcntl is None:
+                logger.warning("Межпроцессные слоты LLM недоступны на этой платформе")
+            else:
+                self._global = _GlobalSlots(global_slots_dir, global_slots)
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._queue_times = deque(maxlen=500)
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_concurrent=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "32")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "10")),
+            global_slots=int(os.getenv("LLM_GLOBAL_SLOTS", "0")),
+            global_slots_dir=os.getenv("LLM_GLOBAL_SLOTS_DIR", "/tmp/pressreach-llm-slots"),
+        )
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Занимает слот на время вызова модели.
+
+        Raises:
+            LLMOverloadedError: Очередь заполнена или слот не освободился за queue_timeout
+        """
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+
+        if not self._semaphore.locked():
+            # Свободный слот есть - acquire завершается без переключения задач
+            await self._semaphore.acquire()
+        else:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise LLMOverloadedError("Очередь запросов к LLM заполнена")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise LLMOverloadedError("Превышено время ожидания свободного слота LLM")
+            finally:
+                self.waiting -= 1
+
+        global_fd = None
+        try:
+            if self._global:
+                try:
+                    global_fd = await self._global.acquire(deadline)
+                except LLMOverloadedError:
+                    self.timed_out += 1
+                    raise
+
+            self._queue_times.append(time.monotonic() - started)
+            self.admitted += 1
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+        finally:
+            if global_fd is not None:
+                self._global.release(global_fd)
+            self._semaphore.release()
+
+    def _queue_percentile(self, q: float) -> Optional[float]:
+        if not self._queue_times:
+            return None
+        ordered = sorted(self._queue_times)
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 4)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "global_slots": len(self._global.paths) if self._global else 0,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "queue_time_p50": self._queue_percentile(0.5),
+            "queue_time_p95": self._queue_percentile(0.95),
+            "queue_time_max": round(max(self._queue_times), 4) if self._queue_times else None,
+        }
@@ -0,0 +1,241 @@
+"""
+Учёт вызовов LLM: латентность, токены, стоимость
+
+Каждая попытка вызова модели (успешная, ошибочная или отменённая) попадает в
+агрегаты по модели: счётчики исходов, гистограммы латентности и токенов,
+суммарная стоимость. Стоимость берётся из usage.cost (если провайдер его
+вернул) или считается по ценам из LLM_MODEL_PRICES.
+
+Пользователь, от имени которого идёт вызов, задаётся через set_llm_user();
+клиент LLM читает его один раз в контексте запроса и передаёт в LLMCallRecord.
+При наличии sink каждая запись дополнительно сохраняется (например, в БД для
+квот), sink выполняется в пуле потоков, чтобы не блокировать event loop.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (верхние, включительно)
+LATENCY_BUCKETS = [0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60]
+TOKEN_BUCKETS = [100, 250, 500, 1000, 2000, 4000, 8000, 16000]
+
+_current_user: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_user", default=None)
+
+
+def set_llm_user(user_id: Optional[str]):
+    """Привязывает последующие вызовы LLM в текущем контексте запроса к пользователю"""
+    _current_user.set(user_id)
+
+
+def current_llm_user() -> Optional[str]:
+    return _current_user.get()
+
+
+def load_model_prices() -> Dict[str, tuple]:
+    """
+    Цены моделей из LLM_MODEL_PRICES: JSON {"model": [input, output]} в долларах за 1M токенов
+    """
+    raw = os.getenv("LLM_MODEL_PRICES", "")
+    if not raw:
+        return {}
+    try:
+        return {model: (float(p[0]), float(p[1])) for model, p in json.loads(raw).items()}
+    except (ValueError, TypeError, IndexError) as e:
+        logger.error(f"Некорректный LLM_MODEL_PRICES: {e}")
+        return {}
+
+
+@dataclass
+class LLMCallRecord:
+    """Одна попытка вызова модели"""
+    model: str
+    outcome: str  # success, error, cancelled, coalesced (доля участника общего вызова)
+    latency: float
+    attempt: int = 0
+    namespace: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: Optional[float] = None
+    streamed: bool = False
+    user_id: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (последняя корзина - "больше максимума")"""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return self.buckets[i] if i < len(self.buckets) else float(self.buckets[-1])
+        return float(self.buckets[-1])
+
+    def snapshot(self) -> dict:
+        labels = [f"le_{b}" for b in self.buckets] + ["inf"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.count,
+            "avg": round(self.total / self.count, 3) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+        }
+
+
+class _ModelStats:
+    def __init__(self):
+        self.outcomes: Dict[str, int] = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.prompt_tokens = Histogram(TOKEN_BUCKETS)
+        self.completion_tokens = Histogram(TOKEN_BUCKETS)
+        self.total_prompt_tokens = 0
+        self.total_completion_tokens = 0
+        self.cost = 0.0
+        self.first_attempt_wins = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": sum(self.outcomes.values()),
+            "outcomes": dict(self.outcomes),
+            "first_attempt_wins": self.first_attempt_wins,
+            "latency_seconds": self.latency.snapshot(),
+            "prompt_tokens": self.prompt_tokens.snapshot(),
+            "completion_tokens": self.completion_tokens.snapshot(),
+            "total_prompt_tokens": self.total_prompt_tokens,
+            "total_completion_tokens": self.total_completion_tokens,
+            "cost_usd": round(self.cost, 6),
+        }
+
+
+class LLMMetrics:
+    """Агрегаты по моделям и неймспейсам + опциональный sink для сохранения записей"""
+
+    def __init__(self, prices: Optional[Dict[str, tuple]] = None):
+        self.prices = prices if prices is not None else load_model_prices()
+        self.sink: Optional[Callable[[LLMCallRecord], None]] = None
+        self.started_at = time.time()
+        self._models: Dict[str, _ModelStats] = {}
+        self._namespaces: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def estimate_cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+        price = self.prices.get(model)
+        if not price:
+            return None
+        return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+    def record(self, record: LLMCallRecord, persist: bool = True):
+        """
+        Учитывает запись в агрегатах; persist=False - без передачи в sink
+        (запись сохранит вызывающий через persist(), например по одной на каждого
+        участника общего вызова)
+        """
+        if record.cost is None and record.total_tokens:
+            record.cost = self.estimate_cost(record.model, record.prompt_tokens, record.completion_tokens)
+
+        with self._lock:
+            stats = self._models.setdefault(record.model, _ModelStats())
+            stats.outcomes[record.outcome] = stats.outcomes.get(record.outcome, 0) + 1
+            if record.outcome == "success":
+                stats.latency.observe(record.latency)
+                stats.prompt_tokens.observe(record.prompt_tokens)
+                stats.completion_tokens.observe(record.completion_tokens)
+                if record.attempt == 0:
+                    stats.first_attempt_wins += 1
+            stats.total_prompt_tokens += record.prompt_tokens
+            stats.total_completion_tokens += record.completion_tokens
+            stats.cost += record.cost or 0.0
+
+            namespace = self._namespaces.setdefault(
+                record.namespace or "other", {"calls": 0, "tokens": 0, "cost_usd": 0.0}
+            )
+            namespace["calls"] += 1
+            namespace["tokens"] += record.total_tokens
+            namespace["cost_usd"] += record.cost or 0.0
+
+        if persist:
+            self.persist(record)
+
+    def persist(self, record: LLMCallRecord):
+        """Передаёт запись в sink (если задан), не меняя агрегаты"""
+        if self.sink:
+            self._submit(record)
+
+    def _submit(self, record: LLMCallRecord):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        def run():
+            try:
+                self.sink(record)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить учёт вызова LLM: {e}")
+
+        if loop:
+            loop.run_in_executor(None, run)
+        else:
+            run()
+
+    def model_stats(self, model: str) -> Optional[dict]:
+        with self._lock:
+            stats = self._models.get(model)
+            return stats.snapshot() if stats else None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "since": self.started_at,
+                "models": {model: stats.snapshot() for model, stats in self._models.items()},
+                "namespaces": {
+                    name: {**values, "cost_usd": round(values["cost_usd"], 6)}
+                    for name, values in self._namespaces.items()
+                },
+                "total_cost_usd": round(sum(s.cost for s in self._models.values()), 6),
+                "prices_configured": sorted(self.prices),
+            }
+
+
+def usage_from_completion(usage) -> dict:
+    """Токены и стоимость из объекта usage ответа OpenAI/OpenRouter"""
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "cost": None}
+    cost = getattr(usage, "cost", None)
+    if cost is None and getattr(usage, "model_extra", None):
+        cost = usage.model_extra.get("cost")
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "cost": float(cost) if cost is not None else None,
+    }
+
@@ -0,0 +1,337 @@
+"""
+Локальный OpenAI-совместимый сервер для работы с LLM без ключа OpenRouter
+
+Режимы:
+- replay (по умолчанию): отвечает записанными ответами из fixtures (JSONL).
+  Запрос ищется по хэшу сообщений; если записи нет, отдаётся детерминированный
+  синтетический ответ по типу промпта (пресс-релиз, корректура, переписывание,
+  подбор СМИ), чтобы все эндпоинты работали сразу.
+- record: проксирует запросы в настоящий OpenRouter и дописывает ответы в fixtures.
+
+Задержка и ошибки задаются распределениями; случайность детерминирована
+(--seed + хэш запроса), поэтому прогоны воспроизводимы. Поддерживаются
+потоковые ответы (stream=true, stream_options.include_usage) и параметр n.
+
+Запуск:
+    python llm_mock_server.py --port 8100 --latency lognormal:1.5,0.4 --error-rate 0.05
+    python llm_mock_server.py --record --fixtures fixtures/llm.jsonl   # нужен DEEPSEEK_API_KEY
+
+Backend направляется на сервер через окружение:
+    OPENROUTER_BASE_URL=http://127.0.0.1:8100/api/v1
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPSTREAM = "https://openrouter.ai/api/v1"
+
+
+def request_key(messages: list) -> str:
+    """Ключ записи: хэш ролей и текстов сообщений (модель и температура не учитываются)"""
+    payload = json.dumps([[m.get("role"), m.get("content")] for m in messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LatencyModel:
+    """
+    Распределение задержки ответа, секунды:
+    fixed:0.5 | uniform:0.2,1.5 | lognormal:<медиана>,<sigma>
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p] if params else []
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.params[0] if self.params else 0.0
+        if self.kind == "uniform":
+            return rng.uniform(self.params[0], self.params[1])
+        median, sigma = self.params
+        return rng.lognormvariate(math.log(median), sigma)
+
+
+class FixtureStore:
+    """JSONL файл с записанными ответами: {"key", "model", "messages", "content", "usage"}"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = Path(path) if path else None
+        self._entries = {}
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            with self.path.open(encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]] = entry
+            logger.info(f"Загружено записей: {len(self._entries)} из {self.path}")
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._entries.get(key)
+
+    def add(self, entry: dict):
+        with self._lock:
+            self._entries[entry["key"]] = entry
+            if self.path:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with self.path.open("a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# ==================== СИНТЕТИЧЕСКИЕ ОТВЕТЫ ====================
+
+_FENCED_RE = re.compile(r"```\s*\n(.*?)\n\s*```", re.DOTALL)
+_CATEGORY_RE = re.compile(r"^\s*-\s*([^:\n]+):", re.MULTILINE)
+_COMPANY_RE = re.compile(r"Компания:\s*(.+)")
+
+
+def synthetic_response(messages: list) -> str:
+    """Детерминированный ответ в формате, который ожидает эндпоинт"""
+    prompt = messages[-1].get("content", "") if messages else ""
+    fenced = _FENCED_RE.search(prompt)
+    source_text = fenced.group(1).strip() if fenced else ""
+
+    if '"improved_text"' in prompt:
+        return json.dumps({
+            "original_text": source_text,
+            "improved_text": source_text,
+            "errors_found": [],
+            "summary": "Ошибок не найдено (mock)"
+        }, ensure_ascii=False)
+
+    if '"rewritten_text"' in prompt:
+        return json.dumps({
+            "original_text": source_text,
+            "rewritten_text": source_text,
+            "style_applied": "mock",
+            "key_changes": [],
+            "summary": "Текст возвращён без изменений (mock)"
+        }, ensure_ascii=False)
+
+    if '"selected_categories"' in prompt:
+        categories_block = prompt.split("ДОСТУПНЫЕ КАТЕГОРИИ СМИ:", 1)[-1]
+        names = [name.strip() for name in _CATEGORY_RE.findall(categories_block)][:2]
+        return json.dumps({
+            "selected_categories": [
+                {"category_name": name, "relevance_score": 8 - i, "reasoning": "mock"}
+                for i, name in enumerate(names)
+            ],
+            "text_summary": source_text[:200],
+            "target_audience": "Журналисты (mock)"
+        }, ensure_ascii=False)
+
+    company = _COMPANY_RE.search(prompt)
+    company_name = company.group(1).strip() if company else "Компания"
+    return json.dumps({
+        "headline": f"{company_name} объявляет о важной новости",
+        "subheadline": "Подзаголовок (mock)",
+        "lead_paragraph": f"{company_name} сообщает о событии. Это синтетический ответ mock-сервера.",
+        "body_text": "Основной текст пресс-релиза (mock).",
+        "quotes": [{"text": "Мы рады поделиться новостью.", "author": "Представитель компании"}],
+        "contact_info": "press@example.com",
+        "boilerplate": f"{company_name} - компания (mock)."
+    }, ensure_ascii=False)
+
+
+def _usage(messages: list, content: str) -> dict:
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 3
+    completion_tokens = len(content) // 3
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+# ==================== ПРИЛОЖЕНИЕ ====================
+
+def create_app(
+    fixtures: FixtureStore,
+    latency: LatencyModel,
+    error_rate: float = 0.0,
+    error_status: int = 500,
+    chunk_delay: float = 0.02,
+    seed: int = 0,
+    record: bool = False,
+    upstream: str = DEFAULT_UPSTREAM,
+    api_key: str = "",
+) -> FastAPI:
+    app = FastAPI(title="LLM mock server")
+    stats = {"requests": 0, "replayed": 0, "synthetic": 0, "recorded": 0, "errors_injected": 0}
+    attempts = {}
+
+    def rng_for(model: str, key: str) -> random.Random:
+        # Зерно зависит только от содержимого запроса и номера его повтора, а не от порядка
+        # прихода других запросов: параллельные прогоны дают те же задержки и ошибки
+        attempt = attempts.get((model, key), 0)
+        attempts[(model, key)] = attempt + 1
+        return random.Random(f"{seed}:{model}:{key}:{attempt}")
+
+    async def record_upstream(body: dict, key: str) -> dict:
+        headers = {"Authorization": f"Bearer {api_key}"}
+        request_body = {**body, "stream": False}
+        request_body.pop("stream_options", None)
+        async with httpx.AsyncClient(timeout=120) as client:
+            response = await client.post(f"{upstream}/chat/completions", json=request_body, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        contents = [choice["message"]["content"] for choice in data.get("choices", [])]
+        fixtures.add({
+            "key": key,
+            "model": body.get("model"),
+            "messages": body.get("messages"),
+            "content": contents[0] if contents else "",
+            "choices": contents,
+            "usage": data.get("usage"),
+            "recorded_at": time.time()
+        })
+        stats["recorded"] += 1
+        return data
+
+    @app.get("/api/v1/models")
+    async def list_models():
+        return {"data": [{"id": "mock/model", "object": "model"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return {**stats, "fixtures": len(fixtures), "latency": latency.spec, "error_rate": error_rate}
+
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        messages = body.get("messages", [])
+        model = body.get("model", "mock/model")
+        key = request_key(messages)
+        rng = rng_for(model, key)
+        n = int(body.get("n") or 1)
+
+        if record:
+            data = await record_upstream(body, key)
+            contents = [choice["message"]["content"] for choice in data.get("choices", [])]
+            usage = data.get("usage") or _usage(messages, contents[0] if contents else "")
+        else:
+            await asyncio.sleep(latency.sample(rng))
+            if rng.random() < error_rate:
+                stats["errors_injected"] += 1
+                return JSONResponse(status_code=error_status, content={
+                    "error": {"message": "Injected error (mock)", "type": "server_error", "code": error_status}
+                })
+            entry = fixtures.get(key)
+            if entry:
+                stats["replayed"] += 1
+                contents = entry.get("choices") or [entry["content"]]
+                usage = entry.get("usage") or _usage(messages, contents[0])
+            else:
+                stats["synthetic"] += 1
+                contents = [synthetic_response(messages)]
+                usage = _usage(messages, contents[0])
+            contents = (contents * n)[:n]
+
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                    for i, content in enumerate(contents)
+                ],
+                "usage": usage
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def event_stream():
+            content = contents[0]
+            for start in range(0, len(content), 40):
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": content[start:start + 40]}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(chunk_delay)
+            final = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            if include_usage:
+                usage_chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [], "usage": usage
+                }
+                yield f"data: {json.dumps(usage_chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--fixtures", default=os.getenv("LLM_MOCK_FIXTURES", "fixtures/llm.jsonl"))
+    parser.add_argument("--latency", default="lognormal:1.0,0.3", help="fixed:S | uniform:A,B | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="Пауза между фрагментами потока")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record", action="store_true", help="Проксировать в OpenRouter и записывать ответы")
+    parser.add_argument("--upstream", default=DEFAULT_UPSTREAM)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    api_key = os.getenv("DEEPSEEK_API_KEY", "")
+    if args.record and not api_key:
+        parser.error("Для режима записи нужен DEEPSEEK_API_KEY")
+
+    app = create_app(
+        FixtureStore(args.fixtures),
+        LatencyModel(args.latency),
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        chunk_delay=args.chunk_delay,
+        seed=args.seed,
+        record=args.record,
+        upstream=args.upstream,
+        api_key=api_key,
+    )
+    mode = "record" if args.record else "replay"
+    logger.info(f"LLM mock server ({mode}) на http://{args.host}:{args.port}/api/v1")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
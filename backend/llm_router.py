@@ -0,0 +1,252 @@
+"""
+Маршрутизация запросов между моделями OpenRouter по наблюдаемой латентности
+
+Выбор модели пользователя - предпочтение, а не жёсткая привязка: если
+предпочтительная модель недоступна (circuit breaker открыт), часто ошибается
+или заметно медленнее другой модели из пула на запросах того же типа и
+размера, первым пробуется более быстрый кандидат. Остальные модели идут
+резервом в порядке оценки. Решение и его причина возвращаются вызывающему.
+"""
+import json
+import logging
+import os
+import random
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Ключи моделей из API -> модели OpenRouter, отдельно для каждого эндпоинта: один и тот
+# же ключ исторически означает разные модели (ключ не из таблицы -> модель по умолчанию).
+# "deepseek" исторически ключ по умолчанию во фронтенде и указывает на модель по умолчанию.
+PRESS_RELEASE_MODEL_ALIASES = {
+    "deepseek": "google/gemini-3-flash-preview",
+    "gemini": "google/gemini-3-flash-preview",
+    "gpt5": "anthropic/claude-sonnet-4",
+    "claude4": "anthropic/claude-sonnet-4",
+}
+IMPROVE_TEXT_MODEL_ALIASES = {
+    "deepseek": "google/gemini-3-flash-preview",
+    "gemini": "google/gemini-3-flash-preview",
+    "gpt4": "openai/gpt-4-turbo-preview",
+    "gpt35": "openai/gpt-3.5-turbo",
+    "claude": "anthropic/claude-2",
+}
+# Полные имена, на которые указывают ключи любого эндпоинта
+ALIASED_MODELS = frozenset(PRESS_RELEASE_MODEL_ALIASES.values()) | frozenset(IMPROVE_TEXT_MODEL_ALIASES.values())
+
+# Граница "длинного" промпта: латентность считается отдельно для коротких и длинных
+LONG_PROMPT_TOKENS = 1500
+
+
+def resolve_model(
+    key: Optional[str],
+    default: str,
+    allowed: Iterable[str] = (),
+    aliases: Mapping[str, str] = PRESS_RELEASE_MODEL_ALIASES
+) -> str:
+    """
+    Ключ модели из таблицы эндпоинта (aliases) или полное имя OpenRouter (provider/model) -> имя модели
+
+    Полное имя принимается, только если это модель из таблиц ключей или из allowed
+    (настроенные резервные модели и пул роутера): модель выбирает клиент, а платит
+    сервер, и каждое новое имя заводит свою статистику. Остальное -> default.
+    """
+    if not key:
+        return default
+    if key in aliases:
+        return aliases[key]
+    if key == default or key in allowed or key in ALIASED_MODELS:
+        return key
+    logger.warning(f"Неизвестная модель {key!r}, используется {default}")
+    return default
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class ModelRouter:
+    """Порядок моделей для запроса по скользящей статистике (тип запроса x размер промпта)"""
+
+    def __init__(
+        self,
+        breakers,
+        pool: Optional[List[str]] = None,
+        min_samples: int = 10,
+        window: int = 100,
+        switch_margin: float = 0.3,
+        max_error_rate: float = 0.3,
+        explore_rate: float = 0.0,
+        max_prompt_tokens: Optional[Dict[str, int]] = None,
+    ):
+        """
+        Args:
+            breakers: CircuitBreakerRegistry клиента
+            pool: Дополнительные модели-кандидаты (кроме запрошенных и резервных)
+            switch_margin: Насколько (доля) другая модель должна быть быстрее предпочтительной
+            max_error_rate: Доля ошибок, при которой предпочтительная модель уступает первенство
+            explore_rate: Доля запросов, отдаваемых модели без статистики (для сбора данных)
+            max_prompt_tokens: Ограничения размера промпта по моделям
+        """
+        self.breakers = breakers
+        self.pool = pool or []
+        self.min_samples = min_samples
+        self.window = window
+        self.switch_margin = switch_margin
+        self.max_error_rate = max_error_rate
+        self.explore_rate = explore_rate
+        self.max_prompt_tokens = max_prompt_tokens or {}
+        self._samples: Dict[tuple, deque] = {}  # (model, namespace, size) -> (latency, ok)
+        self._lock = threading.Lock()
+        self.decisions: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls, breakers) -> "ModelRouter":
+        limits = {}
+        raw_limits = os.getenv("LLM_ROUTER_MAX_PROMPT_TOKENS", "")
+        if raw_limits:
+            try:
+                limits = {model: int(value) for model, value in json.loads(raw_limits).items()}
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.error(f"Некорректный LLM_ROUTER_MAX_PROMPT_TOKENS: {e}")
+        return cls(
+            breakers,
+            pool=[m.strip() for m in os.getenv("LLM_ROUTER_MODELS", "").split(",") if m.strip()],
+            min_samples=int(os.getenv("LLM_ROUTER_MIN_SAMPLES", "10")),
+            switch_margin=float(os.getenv("LLM_ROUTER_SWITCH_MARGIN", "0.3")),
+            max_error_rate=float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.3")),
+            explore_rate=float(os.getenv("LLM_ROUTER_EXPLORE_RATE", "0.02")),
+            max_prompt_tokens=limits,
+        )
+
+    @staticmethod
+    def _size(prompt_tokens: int) -> str:
+        return "long" if prompt_tokens >= LONG_PROMPT_TOKENS else "short"
+
+    def record(self, model: str, namespace: Optional[str], prompt_tokens: int, latency: float, ok: bool):
+        key = (model, namespace or "other", self._size(prompt_tokens))
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append((latency, ok))
+
+    def stats(self, model: str, namespace: Optional[str], prompt_tokens: int) -> Optional[dict]:
+        """p50/p95 успешных вызовов и доля ошибок, None при недостатке данных"""
+        with self._lock:
+            samples = list(self._samples.get((model, namespace or "other", self._size(prompt_tokens)), ()))
+        if len(samples) < self.min_samples:
+            return None
+        latencies = sorted(latency for latency, ok in samples if ok)
+        error_rate = sum(1 for _, ok in samples if not ok) / len(samples)
+        if not latencies:
+            return {"p50": None, "p95": None, "error_rate": error_rate, "samples": len(samples)}
+        return {
+            "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95),
+            "error_rate": error_rate,
+            "samples": len(samples),
+        }
+
+    @staticmethod
+    def _expected_latency(stats: dict) -> float:
+        """Ожидаемое время до ответа: p50 плюс штраф за ошибки (повтор на другой модели ~ p95)"""
+        if stats["p50"] is None:
+            return float("inf")
+        return stats["p50"] + stats["error_rate"] * stats["p95"]
+
+    def _fits(self, model: str, prompt_tokens: int) -> bool:
+        limit = self.max_prompt_tokens.get(model)
+        return limit is None or prompt_tokens <= limit
+
+    def plan(self, models: List[str], namespace: Optional[str], prompt_tokens: int) -> Tuple[List[str], dict]:
+        """
+        Порядок моделей для запроса.
+
+        Args:
+            models: Запрошенные модели (первая - предпочтение пользователя) с резервными
+            namespace: Тип запроса (press_release, improve_text, media_relevance)
+            prompt_tokens: Оценка размера промпта
+
+        Returns:
+            (модели в порядке попыток, {"preferred", "model", "reason"})
+        """
+        preferred = models[0]
+        candidates = list(dict.fromkeys(models + self.pool))
+        fitting = [m for m in candidates if self._fits(m, prompt_tokens)] or candidates
+        available = [m for m in fitting if self.breakers.get(m).state.value != "open"] or fitting
+
+        scored = {m: self.stats(m, namespace, prompt_tokens) for m in available}
+        expected = {m: self._expected_latency(s) if s else None for m, s in scored.items()}
+
+        def sort_key(model: str):
+            # Сначала модели со статистикой по ожидаемой латентности, затем без неё в исходном порядке
+            value = expected[model]
+            return (value is None, value if value is not None else 0, candidates.index(model))
+
+        ranked = sorted(available, key=sort_key)
+        best = ranked[0]
+        decision = {"preferred": preferred, "model": preferred, "reason": "preferred"}
+
+        if preferred not in fitting:
+            decision.update(model=best, reason=f"prompt too long for {preferred} ({prompt_tokens} tokens)")
+        elif preferred not in available:
+            decision.update(model=best, reason=f"{preferred} circuit open")
+        else:
+            preferred_stats = scored[preferred]
+            best_stats = scored[best]
+            if preferred_stats and preferred_stats["error_rate"] >= self.max_error_rate and best != preferred:
+                decision.update(
+                    model=best,
+                    reason=f"{preferred} error rate {preferred_stats['error_rate']:.0%}"
+                )
+            elif (
+                best != preferred and preferred_stats and best_stats
+                and expected[best] < expected[preferred] * (1 - self.switch_margin)
+            ):
+                decision.update(
+                    model=best,
+                    reason=(
+                        f"{best} p50 {best_stats['p50']:.2f}s vs {preferred} p50 "
+                        f"{preferred_stats['p50']:.2f}s for {namespace or 'other'}/{self._size(prompt_tokens)}"
+                    )
+                )
+            else:
+                unexplored = [m for m in available if scored[m] is None and m != preferred]
+                if unexplored and random.random() < self.explore_rate:
+                    decision.update(model=unexplored[0], reason="exploration (no latency data yet)")
+
+        chosen = decision["model"]
+        order = [chosen] + [m for m in ranked if m != chosen]
+        # Кандидаты пула, не подходящие по размеру или с открытым breaker, в конец не добавляем,
+        # но запрошенные пользователем модели остаются последним резервом
+        order += [m for m in models if m not in order]
+
+        outcome = "preferred" if chosen == preferred else "rerouted"
+        with self._lock:
+            self.decisions[outcome] = self.decisions.get(outcome, 0) + 1
+        if chosen != preferred:
+            logger.info(f"Router: {preferred} -> {chosen} ({decision['reason']})")
+        return order, decision
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            keys = list(self._samples)
+            decisions = dict(self.decisions)
+        table = []
+        for model, namespace, size in sorted(keys):
+            stats = self.stats(model, namespace, LONG_PROMPT_TOKENS if size == "long" else 0)
+            table.append({
+                "model": model,
+                "namespace": namespace,
+                "prompt_size": size,
+                "samples": len(self._samples[(model, namespace, size)]),
+                **({k: round(v, 3) if v is not None else None for k, v in stats.items() if k != "samples"}
+                   if stats else {}),
+            })
+        return {
+            "pool": self.pool,
+            "min_samples": self.min_samples,
+            "switch_margin": self.switch_margin,
+            "decisions": decisions,
+            "latency": table,
+        }
@@ -0,0 +1,257 @@
+"""
+Схемы ответов LLM и локальное восстановление JSON
+
+Модель иногда отвечает почти-JSON: с markdown-обёрткой, висячими запятыми,
+неэкранированными кавычками внутри строк или обрезанным по max_tokens концом.
+Вместо повторной генерации ответ чинится локально и проверяется pydantic-схемой.
+"""
+import json
+import logging
+import re
+from typing import List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+logger = logging.getLogger(__name__)
+
+
+class LLMOutputError(Exception):
+    """Ответ модели не удалось разобрать или он не соответствует схеме"""
+
+    def __init__(self, message: str, raw_response: str):
+        super().__init__(message)
+        self.raw_response = raw_response
+
+
+# ==================== СХЕМЫ ====================
+
+class _LLMOutput(BaseModel):
+    # Лишние поля модели не теряем, отсутствующие необязательные заполняем по умолчанию
+    model_config = ConfigDict(extra="allow")
+
+
+class PressReleaseQuote(_LLMOutput):
+    text: str
+    author: str = ""
+
+
+class PressReleaseOutput(_LLMOutput):
+    headline: str
+    subheadline: str = ""
+    lead_paragraph: str
+    body_text: str
+    quotes: List[PressReleaseQuote] = Field(default_factory=list)
+    contact_info: str = ""
+    boilerplate: str = ""
+
+
+class GrammarError(_LLMOutput):
+    type: str = ""
+    original: str = ""
+    corrected: str = ""
+    explanation: str = ""
+
+
+class GrammarOutput(_LLMOutput):
+    original_text: str = ""
+    improved_text: str
+    errors_found: List[GrammarError] = Field(default_factory=list)
+    summary: str = ""
+
+
+class RewriteOutput(_LLMOutput):
+    original_text: str = ""
+    rewritten_text: str
+    style_applied: Optional[str] = None
+    key_changes: List[str] = Field(default_factory=list)
+    summary: str = ""
+
+
+class SelectedCategory(_LLMOutput):
+    category_name: str
+    relevance_score: int = 5
+    reasoning: str = ""
+
+    @field_validator("relevance_score", mode="before")
+    @classmethod
+    def _clamp_score(cls, value):
+        try:
+            return max(1, min(10, round(float(value))))
+        except (TypeError, ValueError):
+            return 5
+
+
+class MediaSelectionOutput(_LLMOutput):
+    selected_categories: List[SelectedCategory]
+    text_summary: str = ""
+    target_audience: str = ""
+
+
+# ==================== ИЗВЛЕЧЕНИЕ И ВОССТАНОВЛЕНИЕ ====================
+
+_FENCE_RE = re.compile(r"```[a-zA-Z]*")
+_DANGLING_KEY_RE = re.compile(r',?\s*"(?:[^"\\]|\\.)*"\s*:\s*$')
+
+# Счётчики исхода разбора (для /api/llm/metrics)
+PARSE_STATS = {"parsed": 0, "repaired": 0, "failed": 0}
+
+
+def extract_json(text: str) -> str:
+    """
+    Извлекает первый JSON-объект или массив из текста, удаляя markdown и лишние символы.
+
+    Объект вырезается по балансу скобок (с учётом строк), а не жадным регулярным
+    выражением, поэтому текст после JSON не попадает в результат. Если JSON не
+    закрыт (ответ обрезан), возвращается всё от открывающей скобки до конца.
+    """
+    if not text:
+        return ""
+    text = _FENCE_RE.sub("", text).strip()
+    start = next((i for i, ch in enumerate(text) if ch in "{["), None)
+    if start is None:
+        return text
+
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def _skip_whitespace(text: str, index: int) -> int:
+    while index < len(text) and text[index] in " \t\r\n":
+        index += 1
+    return index
+
+
+def _closes_string(text: str, index: int) -> bool:
+    """Закрывает ли кавычка text[index] строку: за ней должна идти структура JSON"""
+    after = _skip_whitespace(text, index + 1)
+    if after >= len(text) or text[after] in ":}]":
+        return True
+    if text[after] != ",":
+        return False
+    # После запятой - следующий ключ или значение, а не продолжение фразы
+    value = _skip_whitespace(text, after + 1)
+    return value >= len(text) or text[value] in '"{[}]-0123456789tfn'
+
+
+def repair_json(text: str) -> str:
+    """
+    Чинит типичные дефекты JSON от модели:
+    - висячие запятые перед } и ];
+    - неэкранированные кавычки и переводы строк внутри строк;
+    - обрезанный конец: незакрытая строка, ключ без значения, незакрытые скобки.
+    """
+    out = []
+    closers = []
+    in_string = False
+    escaped = False
+
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+                out.append(ch)
+            elif ch == "\\":
+                escaped = True
+                out.append(ch)
+            elif ch == '"':
+                # Кавычка закрывает строку, только если за ней идёт структура JSON
+                if _closes_string(text, i):
+                    in_string = False
+                    out.append(ch)
+                else:
+                    out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            elif ch == "\r":
+                continue
+            elif ch == "\t":
+                out.append("\\t")
+            else:
+                out.append(ch)
+            continue
+
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            # Висячая запятая перед закрывающей скобкой
+            while out and out[-1] in " \t\r\n":
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if closers:
+                closers.pop()
+            out.append(ch)
+            if not closers:
+                break
+        else:
+            out.append(ch)
+
+    repaired = "".join(out)
+    if in_string:
+        if escaped:
+            repaired = repaired[:-1]
+        repaired += '"'
+    if closers:
+        repaired = repaired.rstrip()
+        # Обрезано после ключа ("key": ) или после запятой
+        repaired = _DANGLING_KEY_RE.sub("", repaired).rstrip().rstrip(",")
+        repaired += "".join(reversed(closers))
+    return repaired
+
+
+def parse_llm_json(text: str, schema: Type[BaseModel]) -> Tuple[dict, bool]:
+    """
+    Разбирает ответ модели и проверяет его схемой.
+
+    Returns:
+        (данные по схеме, был ли ответ восстановлен локально)
+
+    Raises:
+        LLMOutputError: JSON не удалось восстановить или он не соответствует схеме
+    """
+    cleaned = extract_json(text)
+    repaired = False
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Ответ модели не является корректным JSON ({e}), пробуем восстановить")
+        try:
+            data = json.loads(repair_json(cleaned))
+            repaired = True
+        except json.JSONDecodeError as repair_error:
+            PARSE_STATS["failed"] += 1
+            raise LLMOutputError(f"Ошибка парсинга JSON: {repair_error}", cleaned)
+
+    try:
+        result = schema.model_validate(data).model_dump()
+    except ValidationError as e:
+        PARSE_STATS["failed"] += 1
+        raise LLMOutputError(f"Ответ не соответствует схеме {schema.__name__}: {e.error_count()} ошибок", cleaned)
+
+    PARSE_STATS["repaired" if repaired else "parsed"] += 1
+    if repaired:
+        logger.info(f"JSON ответа модели восстановлен локально ({schema.__name__})")
+    return result, repaired
@@ -0,0 +1,104 @@
+"""
+Потоковая отдача ответов LLM: инкрементальный разбор JSON и формат Server-Sent Events
+"""
+import json
+from typing import Any, List, Tuple
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Форматирует одно SSE событие с JSON данными"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class JSONFieldStreamParser:
+    """
+    Инкрементальный парсер JSON объекта верхнего уровня.
+
+    Получает текст кусками по мере генерации и возвращает пары (ключ, значение)
+    для полей верхнего уровня, как только значение поля полностью получено.
+    Текст до первой "{" (например ```json) пропускается.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.done = False
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._expect_key = True
+        self._key = None
+        self._value_start = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Добавляет кусок текста, возвращает завершённые поля"""
+        self.buffer += chunk
+        completed = []
+
+        while self._pos < len(self.buffer) and not self.done:
+            i = self._pos
+            ch = self.buffer[i]
+            self._pos += 1
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        raw = self.buffer[self._string_start:i + 1]
+                        if self._expect_key:
+                            self._key = json.loads(raw)
+                        else:
+                            self._emit(raw, completed)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._string_start = i
+            elif ch in "{[":
+                if self._depth == 1 and not self._expect_key:
+                    self._value_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._value_start is not None:
+                    self._emit(self.buffer[self._value_start:i + 1], completed)
+                elif self._depth == 0:
+                    self._flush_primitive(i, completed)
+                    self.done = True
+            elif self._depth == 1:
+                if ch == ":":
+                    self._expect_key = False
+                elif ch == ",":
+                    self._flush_primitive(i, completed)
+                    self._expect_key = True
+                elif not ch.isspace() and not self._expect_key and self._value_start is None:
+                    # Число, true/false/null
+                    self._value_start = i
+
+        return completed
+
+    def _flush_primitive(self, end: int, completed: list):
+        if self._value_start is not None and self._key is not None:
+            self._emit(self.buffer[self._value_start:end].strip(), completed)
+
+    def _emit(self, raw: str, completed: list):
+        try:
+            completed.append((self._key, json.loads(raw)))
+        except json.JSONDecodeError:
+            pass
+        self._key = None
+        self._value_start = None
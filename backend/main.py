@@ -1,20 +1,23 @@
 import asyncio
+import hashlib
 import json
 import logging
 import os
-import re
 import sys
+import time
 import uuid
 import shutil
+from contextlib import asynccontextmanager
 from pathlib import Path
 from datetime import datetime
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Depends, Body, UploadFile, File, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 # Добавляем текущую папку в путь для импортов
@@ -22,35 +25,45 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 try:
     from open_router_client import OpenRouterClient
-    from prompts import build_prompt_for_press_release, build_prompt_for_media_selection
-    from database import SessionLocal, MediaOutlet, Category, Distribution, DeliveryLog, MediaType, ContactType, User, PlanType, UserBranding, DistributionFile
-    from clerk_auth import get_current_user, get_current_user_optional
-    from email_template import generate_email_html, generate_plain_text_email
-    from press_email_service import press_email_service
+    from prompts import build_prompt_for_press_release, build_prompt_for_media_selection, PromptBudgetError
+    from database import SessionLocal, MediaOutlet, Category, Distribution, DeliveryLog, MediaType, ContactType, User, PlanType, UserBranding, DistributionFile, media_categories, distribution_media
+    from clerk_auth import get_current_user, get_current_user_optional, close_http_client
+    from email_template import generate_email_html, render_email_bodies, PersonalizedEmail, render_options_key
+    from press_email_service import press_email_service, estimate_message_size, InvalidHeaderError
+    from llm_streaming import JSONFieldStreamParser, sse_event
+    from text_chunking import split_into_chunks, merge_chunks, locate
+    from file_storage import BlobStore, FileTooLargeError
+    from prompts import estimate_tokens
+    from category_classifier import CategoryClassifier, collect_learned_texts
+    from llm_limiter import LLMOverloadedError
+    from llm_metrics import LLMCallRecord, set_llm_user, current_llm_user
+    from llm_jobs import JobManager, JobLimitError, DONE as JOB_DONE, FAILED as JOB_FAILED
+    from database import LLMUsage
+    from llm_schemas import (
+        LLMOutputError, PARSE_STATS, PressReleaseOutput, GrammarOutput, RewriteOutput,
+        MediaSelectionOutput, parse_llm_json
+    )
 except ImportError:
     # Альтернативный импорт для запуска из корневой папки
     from backend.open_router_client import OpenRouterClient
-    from backend.prompts import build_prompt_for_press_release, build_prompt_for_media_selection
-    from backend.database import SessionLocal, MediaOutlet, Category, Distribution, DeliveryLog, MediaType, ContactType, User, PlanType, UserBranding, DistributionFile
-    from backend.clerk_auth import get_current_user, get_current_user_optional
-    from backend.email_template import generate_email_html, generate_plain_text_email
-    from backend.press_email_service import press_email_service
-
-
-def extract_json(text: str) -> str:
-    """
-    Извлекает первый JSON-объект или массив из текста, удаляя markdown и лишние символы.
-    """
-    if not text:
-        return ""
-    # Удаляем markdown-обёртки
-    text = re.sub(r"```[jJ][sS][oO][nN]?", "", text)
-    text = text.replace("```", "").strip()
-    # Ищем первый {...} или [...]
-    match = re.search(r'(\{.*}|\[.*])', text, re.DOTALL)
-    if match:
-        return match.group(1)
-    return text  # fallback: если не нашли, возвращаем как есть
+    from backend.prompts import build_prompt_for_press_release, build_prompt_for_media_selection, PromptBudgetError
+    from backend.database import SessionLocal, MediaOutlet, Category, Distribution, DeliveryLog, MediaType, ContactType, User, PlanType, UserBranding, DistributionFile, media_categories, distribution_media
+    from backend.clerk_auth import get_current_user, get_current_user_optional, close_http_client
+    from backend.email_template import generate_email_html, render_email_bodies, PersonalizedEmail, render_options_key
+    from backend.press_email_service import press_email_service, estimate_message_size, InvalidHeaderError
+    from backend.llm_streaming import JSONFieldStreamParser, sse_event
+    from backend.text_chunking import split_into_chunks, merge_chunks, locate
+    from backend.file_storage import BlobStore, FileTooLargeError
+    from backend.prompts import estimate_tokens
+    from backend.category_classifier import CategoryClassifier, collect_learned_texts
+    from backend.llm_limiter import LLMOverloadedError
+    from backend.llm_metrics import LLMCallRecord, set_llm_user, current_llm_user
+    from backend.llm_jobs import JobManager, JobLimitError, DONE as JOB_DONE, FAILED as JOB_FAILED
+    from backend.database import LLMUsage
+    from backend.llm_schemas import (
+        LLMOutputError, PARSE_STATS, PressReleaseOutput, GrammarOutput, RewriteOutput,
+        MediaSelectionOutput, parse_llm_json
+    )
 
 
 # Настройка логирования
@@ -59,7 +72,18 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-app = FastAPI(title="PressReach API", description="AI-powered press release generation service")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск и остановка приложения: открываем и закрываем общие HTTP клиенты"""
+    await open_router_client.start()
+    yield
+    await generation_jobs.shutdown()
+    await open_router_client.aclose()
+    await close_http_client()
+
+
+app = FastAPI(title="PressReach API", description="AI-powered press release generation service", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -68,6 +92,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(LLMOverloadedError)
+async def llm_overloaded_handler(request, exc: LLMOverloadedError):
+    """Нет свободного слота для вызова LLM - быстрый отказ вместо долгого ожидания"""
+    logger.warning(f"Запрос к LLM отклонён: {str(exc)}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Сервис генерации перегружен, повторите попытку позже ({str(exc)})"},
+        headers={"Retry-After": "5"}
+    )
+
+
 # Монтируем статические файлы (для фронтенда)
 # app.mount("/static", StaticFiles(directory="../build/static"), name="static")
 
@@ -76,6 +111,8 @@ open_router_client = OpenRouterClient()
 # Настройки для загрузки файлов
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
+# Содержимое файлов хранится по sha256 (одинаковые файлы разных рассылок - один раз на диске)
+blob_store = BlobStore(UPLOAD_DIR / "blobs")
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100 MB
 ALLOWED_EXTENSIONS = {
     'pdf', 'doc', 'docx', 'ppt', 'pptx', 'xls', 'xlsx',
@@ -84,6 +121,74 @@ ALLOWED_EXTENSIONS = {
     'txt', 'csv'
 }
 
+# Фоновые задачи генерации (?background=true): TTL результатов, лимит незавершённых задач,
+# общее SQLite хранилище для нескольких воркеров
+generation_jobs = JobManager(
+    ttl=int(os.getenv("LLM_JOB_TTL", "3600")),
+    max_pending=int(os.getenv("LLM_JOB_MAX_PENDING", "100")),
+    db_path=os.getenv("LLM_JOBS_DB_PATH") or None
+)
+LLM_JOB_EVENTS_TIMEOUT = float(os.getenv("LLM_JOB_EVENTS_TIMEOUT", "300"))
+
+# Сохранение учёта вызовов LLM в таблицу llm_usage (для квот пользователей)
+LLM_USAGE_PERSIST = os.getenv("LLM_USAGE_PERSIST", "false").lower() == "true"
+
+
+def persist_llm_usage(record: LLMCallRecord):
+    """Sink для open_router_client.metrics: пишет запись в llm_usage (выполняется в пуле потоков)"""
+    db = SessionLocal()
+    try:
+        db.add(LLMUsage(
+            clerk_user_id=record.user_id,
+            model=record.model,
+            namespace=record.namespace,
+            outcome=record.outcome,
+            attempt=record.attempt,
+            streamed=record.streamed,
+            prompt_tokens=record.prompt_tokens,
+            completion_tokens=record.completion_tokens,
+            cost=record.cost,
+            latency=record.latency,
+            created_at=datetime.utcfromtimestamp(record.created_at)
+        ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if LLM_USAGE_PERSIST:
+    open_router_client.metrics.sink = persist_llm_usage
+
+
+async def attribute_llm_usage(user_data: Optional[dict] = Depends(get_current_user_optional)):
+    """Привязывает вызовы LLM в рамках запроса к пользователю (если передан токен)"""
+    set_llm_user(user_data.get("sub") if user_data else None)
+
+
+# Пакетное улучшение текста: лимит элементов и одновременных вызовов модели на процесс
+IMPROVE_TEXT_BATCH_MAX_ITEMS = int(os.getenv("IMPROVE_TEXT_BATCH_MAX_ITEMS", "20"))
+IMPROVE_TEXT_BATCH_CONCURRENCY = int(os.getenv("IMPROVE_TEXT_BATCH_CONCURRENCY", "4"))
+improve_text_batch_semaphore = asyncio.Semaphore(IMPROVE_TEXT_BATCH_CONCURRENCY)
+
+# Приветствие с названием СМИ в письмах рассылки ("Здравствуйте, редакция ...!")
+DISTRIBUTION_PERSONALIZE_GREETING = os.getenv("DISTRIBUTION_PERSONALIZE_GREETING", "true").lower() == "true"
+
+# Максимум вариантов пресс-релиза за один запрос
+PRESS_RELEASE_MAX_VARIANTS = int(os.getenv("PRESS_RELEASE_MAX_VARIANTS", "4"))
+
+# Корректура по частям: бюджет токенов на часть; текст длиннее порога делится автоматически
+IMPROVE_TEXT_CHUNK_TOKENS = int(os.getenv("IMPROVE_TEXT_CHUNK_TOKENS", "700"))
+IMPROVE_TEXT_AUTO_CHUNK_TOKENS = int(os.getenv("IMPROVE_TEXT_AUTO_CHUNK_TOKENS", "1200"))
+# Одновременные вызовы модели по частям одного текста (лимит на процесс - LLM_MAX_CONCURRENCY)
+IMPROVE_TEXT_CHUNK_CONCURRENCY = int(os.getenv("IMPROVE_TEXT_CHUNK_CONCURRENCY", "4"))
+
+# Бюджеты промптов (оценка в токенах): длинные поля запроса сокращаются, 0 - без ограничения
+PRESS_RELEASE_PROMPT_MAX_TOKENS = int(os.getenv("PRESS_RELEASE_PROMPT_MAX_TOKENS", "3000"))
+MEDIA_SELECTION_PROMPT_MAX_TOKENS = int(os.getenv("MEDIA_SELECTION_PROMPT_MAX_TOKENS", "4000"))
+
 
 # Dependency для получения DB сессии
 def get_db():
@@ -105,6 +210,7 @@ class PressReleaseRequest(BaseModel):
     contact_person: str = ""
     additional_info: str = ""
     model: str = "deepseek"
+    variants: int = 1  # Сколько вариантов сгенерировать одновременно (до PRESS_RELEASE_MAX_VARIANTS)
 
 
 class TextImprovementRequest(BaseModel):
@@ -112,6 +218,7 @@ class TextImprovementRequest(BaseModel):
     mode: str = "grammar"  # "grammar" или "rewrite"
     style: Optional[str] = None  # Для mode="rewrite": "formal", "business", "casual", etc.
     model: Optional[str] = "deepseek"
+    chunked: Optional[bool] = None  # None - автоматически для длинных текстов
 
 
 class CreateDistributionRequest(BaseModel):
@@ -198,145 +305,605 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
 
-@app.post("/api/generate-press-release")
-async def generate_press_release(request: PressReleaseRequest):
+def build_press_release_prompt(request: PressReleaseRequest, report: dict = None) -> str:
+    """
+    Промпт генерации пресс-релиза по данным запроса (report заполняется размером промпта)
+
+    Raises:
+        HTTPException: 400, если данные запроса не укладываются в PRESS_RELEASE_PROMPT_MAX_TOKENS
+    """
+    press_release_data = {
+        "company_name": request.company_name,
+        "news_summary": request.news_summary,
+        "type": request.type,
+        "target_audience": request.target_audience,
+        "key_messages": request.key_messages,
+        "quotes": request.quotes,
+        "contact_person": request.contact_person,
+        "additional_info": request.additional_info
+    }
+    try:
+        return build_prompt_for_press_release(
+            press_release_data,
+            max_tokens=PRESS_RELEASE_PROMPT_MAX_TOKENS,
+            report=report
+        )
+    except PromptBudgetError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def run_press_release_generation(request: PressReleaseRequest) -> dict:
+    """
+    Генерирует пресс-релиз и возвращает данные ответа /api/generate-press-release
+
+    Raises:
+        Exception: Ошибка вызова модели
+    """
+    if request.variants > 1:
+        return await run_press_release_variants(request)
+
+    prompt_report = {}
+    press_release_prompt = build_press_release_prompt(request, prompt_report)
+
+    # Генерируем пресс-релиз (request.model - предпочтение, роутер может выбрать модель быстрее)
+    route = {}
+    press_release_text = await open_router_client.generate_press_release(
+        user_prompt=press_release_prompt,
+        model=request.model,
+        route=route
+    )
+    logger.info("Пресс-релиз успешно сгенерирован")
+
+    try:
+        # Парсим JSON (с локальным восстановлением) и проверяем схему
+        parsed_press_release, repaired = parse_llm_json(press_release_text, PressReleaseOutput)
+    except LLMOutputError as e:
+        logger.error(f"Ошибка парсинга JSON пресс-релиза: {str(e)}")
+        # Возвращаем сырой текст, если не удалось распарсить JSON
+        return {
+            "success": False,
+            "error": "Ошибка парсинга ответа ИИ",
+            "raw_response": e.raw_response
+        }
+
+    return {
+        "success": True,
+        "press_release": parsed_press_release,
+        "repaired": repaired,
+        "routing": route,
+        "prompt": prompt_report,
+        "generated_at": datetime.now().isoformat(),
+        "company_name": request.company_name,
+        "type": request.type
+    }
+
+
+async def run_press_release_variants(request: PressReleaseRequest) -> dict:
+    """
+    Несколько вариантов пресс-релиза за время одной генерации
+
+    press_release - первый успешный вариант (совместимость с обычным ответом),
+    variants - все варианты с метаданными (модель, время, подача, ошибка).
+
+    Raises:
+        Exception: Не удалось сгенерировать ни одного варианта
+    """
+    started = time.monotonic()
+    prompt_report = {}
+    raw_variants = await open_router_client.generate_press_release_variants(
+        user_prompt=build_press_release_prompt(request, prompt_report),
+        n=request.variants,
+        model=request.model
+    )
+
+    variants = []
+    for index, raw in enumerate(raw_variants):
+        variant = {
+            "index": index,
+            "routing": raw["routing"],
+            "latency_seconds": raw["latency"],
+            "method": raw["method"],
+            "angle": raw["angle"]
+        }
+        if raw["error"]:
+            variants.append({**variant, "success": False, "error": raw["error"]})
+            continue
+        try:
+            parsed, repaired = parse_llm_json(raw["text"], PressReleaseOutput)
+            variants.append({**variant, "success": True, "press_release": parsed, "repaired": repaired})
+        except LLMOutputError as e:
+            logger.error(f"Ошибка парсинга JSON варианта {index}: {str(e)}")
+            variants.append({
+                **variant,
+                "success": False,
+                "error": "Ошибка парсинга ответа ИИ",
+                "raw_response": e.raw_response
+            })
+
+    succeeded = [v for v in variants if v["success"]]
+    logger.info(f"Сгенерировано вариантов пресс-релиза: {len(succeeded)}/{len(variants)} "
+                f"за {time.monotonic() - started:.1f}с")
+    if not succeeded:
+        return {
+            "success": False,
+            "error": "Не удалось получить ни одного корректного варианта",
+            "variants": variants
+        }
+
+    return {
+        "success": True,
+        "press_release": succeeded[0]["press_release"],
+        "variants": variants,
+        "prompt": prompt_report,
+        "generated_at": datetime.now().isoformat(),
+        "company_name": request.company_name,
+        "type": request.type
+    }
+
+
+def submit_generation_job(kind: str, request: BaseModel, run) -> JSONResponse:
+    """Ставит фоновую задачу генерации и отвечает 202 с job_id"""
+    user_id = current_llm_user()
+    fingerprint = generation_jobs.fingerprint(kind, request.model_dump(), user_id)
+    try:
+        job = generation_jobs.submit(kind, lambda: run(request), fingerprint=fingerprint, user_id=user_id)
+    except JobLimitError as e:
+        raise LLMOverloadedError(str(e))
+
+    return JSONResponse(status_code=202, content={
+        "job_id": job.id,
+        "status": job.status,
+        "poll_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events"
+    })
+
+
+@app.post("/api/generate-press-release", dependencies=[Depends(attribute_llm_usage)])
+async def generate_press_release(request: PressReleaseRequest, background: bool = False):
     """
     Генерация пресс-релиза на основе входных данных
+
+    С ?background=true генерация выполняется фоновой задачей: ответ 202 с job_id,
+    результат - через GET /api/jobs/{job_id} или SSE /api/jobs/{job_id}/events.
     """
     logger.info(f"Получен запрос на генерацию пресс-релиза для компании: {request.company_name}")
 
+    if not 1 <= request.variants <= PRESS_RELEASE_MAX_VARIANTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Количество вариантов должно быть от 1 до {PRESS_RELEASE_MAX_VARIANTS}"
+        )
+
+    if background:
+        # Слишком большой запрос отклоняем сразу (400), а не ошибкой фоновой задачи
+        build_press_release_prompt(request)
+        return submit_generation_job("press_release", request, run_press_release_generation)
+
     try:
-        # Собираем данные для промпта
-        press_release_data = {
-            "company_name": request.company_name,
-            "news_summary": request.news_summary,
-            "type": request.type,
-            "target_audience": request.target_audience,
-            "key_messages": request.key_messages,
-            "quotes": request.quotes,
-            "contact_person": request.contact_person,
-            "additional_info": request.additional_info
-        }
+        return JSONResponse(content=await run_press_release_generation(request))
+
+    except (HTTPException, LLMOverloadedError):
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка генерации пресс-релиза: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Ошибка API: {str(e)}")
 
-        # Создаем промпт
-        press_release_prompt = build_prompt_for_press_release(press_release_data)
 
+@app.post("/api/generate-press-release/stream", dependencies=[Depends(attribute_llm_usage)])
+async def generate_press_release_stream(request: PressReleaseRequest):
+    """
+    Потоковая генерация пресс-релиза через Server-Sent Events
+
+    События:
+    - token: очередной фрагмент текста модели {"text": ...}
+    - field: поле пресс-релиза готово {"name": "headline", "value": ...}
+    - done: итоговый результат в формате /api/generate-press-release
+    - error: ошибка генерации {"error": ...}
+    """
+    logger.info(f"Получен запрос на потоковую генерацию пресс-релиза для компании: {request.company_name}")
+
+    prompt_report = {}
+    press_release_prompt = build_press_release_prompt(request, prompt_report)
+
+    async def event_stream():
+        parser = JSONFieldStreamParser()
+        route = {}
         try:
-            # Генерируем пресс-релиз
-            press_release_text = await open_router_client.generate_press_release(
+            async for delta in open_router_client.stream_press_release(
                 user_prompt=press_release_prompt,
-                model=request.model
-            )
+                model=request.model,
+                route=route
+            ):
+                yield sse_event("token", {"text": delta})
+                for name, value in parser.feed(delta):
+                    yield sse_event("field", {"name": name, "value": value})
         except Exception as e:
-            logger.error(f"Ошибка генерации пресс-релиза: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Ошибка API: {str(e)}")
-
-        # Извлекаем JSON из ответа
-        cleaned_press_release = extract_json(press_release_text)
-        logger.info("Пресс-релиз успешно сгенерирован")
+            logger.error(f"Ошибка потоковой генерации пресс-релиза: {str(e)}")
+            yield sse_event("error", {"error": f"Ошибка API: {str(e)}"})
+            return
 
         try:
-            # Парсим JSON
-            parsed_press_release = json.loads(cleaned_press_release)
-
-            # Добавляем метаданные
-            response_data = {
-                "success": True,
-                "press_release": parsed_press_release,
-                "generated_at": datetime.now().isoformat(),
-                "company_name": request.company_name,
-                "type": request.type
-            }
-
-            return JSONResponse(content=response_data)
-
-        except json.JSONDecodeError as e:
+            parsed_press_release, repaired = parse_llm_json(parser.buffer, PressReleaseOutput)
+        except LLMOutputError as e:
             logger.error(f"Ошибка парсинга JSON пресс-релиза: {str(e)}")
-            # Возвращаем сырой текст, если не удалось распарсить JSON
-            return JSONResponse(content={
+            yield sse_event("done", {
                 "success": False,
                 "error": "Ошибка парсинга ответа ИИ",
-                "raw_response": cleaned_press_release
+                "raw_response": e.raw_response
             })
+            return
+
+        logger.info("Пресс-релиз успешно сгенерирован (stream)")
+        yield sse_event("done", {
+            "success": True,
+            "press_release": parsed_press_release,
+            "repaired": repaired,
+            "routing": route,
+            "prompt": prompt_report,
+            "generated_at": datetime.now().isoformat(),
+            "company_name": request.company_name,
+            "type": request.type
+        })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # nginx не должен буферизовать поток
+        }
+    )
 
-    except Exception as e:
-        logger.error(f"Неожиданная ошибка: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Неожиданная ошибка: {str(e)}")
 
+def text_improvement_spans(request: TextImprovementRequest) -> Optional[list]:
+    """Границы частей для корректуры по частям или None, если текст обрабатывается целиком"""
+    chunked = request.chunked
+    if chunked is None:
+        chunked = estimate_tokens(request.text) > IMPROVE_TEXT_AUTO_CHUNK_TOKENS
+    if chunked:
+        spans = split_into_chunks(request.text, IMPROVE_TEXT_CHUNK_TOKENS)
+        if len(spans) > 1:
+            return spans
+    return None
 
-@app.post("/api/improve-text")
+
+async def run_text_improvement(request: TextImprovementRequest) -> dict:
+    """
+    Улучшает один текст и возвращает данные ответа /api/improve-text
+
+    Длинные тексты (или chunked=True) обрабатываются по частям параллельно.
+
+    Raises:
+        ValueError: Неизвестный режим улучшения
+        Exception: Ошибка вызова модели
+    """
+    spans = text_improvement_spans(request)
+    if spans:
+        return await run_chunked_text_improvement(request, spans)
+
+    # Импортируем функцию для создания промпта
+    try:
+        from prompts import build_prompt_for_text_improvement
+    except ImportError:
+        from backend.prompts import build_prompt_for_text_improvement
+
+    # Создаем промпт
+    prompt_report = {}
+    user_prompt = build_prompt_for_text_improvement(
+        text=request.text,
+        mode=request.mode,
+        style=request.style,
+        report=prompt_report
+    )
+
+    # Вызываем AI для улучшения текста
+    logger.info("Отправляем запрос к AI для улучшения текста")
+    route = {}
+    ai_response = await open_router_client.improve_text(
+        user_prompt=user_prompt,
+        model=request.model,
+        json_mode=True,
+        route=route
+    )
+    logger.info(f"Получен ответ от AI: {ai_response[:200]}...")
+
+    # Парсим JSON (с локальным восстановлением) и проверяем схему режима
+    schema = RewriteOutput if request.mode == "rewrite" else GrammarOutput
+    try:
+        result_data, repaired = parse_llm_json(ai_response, schema)
+    except LLMOutputError as e:
+        logger.error(f"Ошибка парсинга JSON результата: {str(e)}")
+        return {
+            "success": False,
+            "error": "Ошибка парсинга ответа ИИ",
+            "raw_response": e.raw_response
+        }
+
+    return {
+        "success": True,
+        "mode": request.mode,
+        "style": request.style if request.mode == "rewrite" else None,
+        "result": result_data,
+        "repaired": repaired,
+        "routing": route,
+        "prompt": prompt_report,
+        "generated_at": datetime.now().isoformat()
+    }
+
+
+async def run_chunked_text_improvement(request: TextImprovementRequest, spans: list) -> dict:
+    """
+    Корректура длинного текста: части обрабатываются параллельно, результат собирается
+    обратно с исходными разделителями, смещения ошибок пересчитываются на весь документ.
+
+    Часть, которую не удалось обработать, остаётся без изменений и попадает в failed_chunks.
+    Одновременно обрабатывается не больше IMPROVE_TEXT_CHUNK_CONCURRENCY частей этого текста.
+    """
+    logger.info(f"Улучшение текста по частям: {len(spans)} частей")
+    text_key = "rewritten_text" if request.mode == "rewrite" else "improved_text"
+    chunk_semaphore = asyncio.Semaphore(IMPROVE_TEXT_CHUNK_CONCURRENCY)
+
+    async def run_chunk(start: int, end: int) -> dict:
+        chunk_request = request.model_copy(update={"text": request.text[start:end], "chunked": False})
+        async with chunk_semaphore:
+            return await run_text_improvement(chunk_request)
+
+    chunk_results = await asyncio.gather(
+        *(run_chunk(start, end) for start, end in spans),
+        return_exceptions=True
+    )
+
+    chunk_texts = []
+    failed_chunks = []
+    for index, ((start, end), chunk_result) in enumerate(zip(spans, chunk_results)):
+        improved = None
+        if isinstance(chunk_result, BaseException):
+            logger.error(f"Ошибка улучшения части {index}: {str(chunk_result)}")
+            failed_chunks.append({"index": index, "error": str(chunk_result)})
+        elif not chunk_result["success"]:
+            failed_chunks.append({"index": index, "error": chunk_result["error"]})
+        else:
+            improved = chunk_result["result"].get(text_key)
+            if not isinstance(improved, str):
+                failed_chunks.append({"index": index, "error": f"В ответе нет {text_key}"})
+                improved = None
+        chunk_texts.append(improved if improved is not None else request.text[start:end])
+
+    if len(failed_chunks) == len(spans):
+        return {
+            "success": False,
+            "error": "Не удалось обработать ни одну часть текста",
+            "failed_chunks": failed_chunks
+        }
+
+    merged_text, merged_offsets = merge_chunks(request.text, spans, chunk_texts)
+    failed_indexes = {f["index"] for f in failed_chunks}
+
+    summaries = []
+    errors_found = []
+    key_changes = []
+    for index, chunk_result in enumerate(chunk_results):
+        if index in failed_indexes:
+            continue
+        result = chunk_result["result"]
+        start, end = spans[index]
+        if result.get("summary"):
+            summaries.append(result["summary"])
+        key_changes.extend(result.get("key_changes") or [])
+        for error in result.get("errors_found") or []:
+            if not isinstance(error, dict):
+                continue
+            errors_found.append({
+                **error,
+                "chunk": index,
+                "offset": locate(error.get("original"), request.text[start:end], start),
+                "corrected_offset": locate(error.get("corrected"), chunk_texts[index], merged_offsets[index])
+            })
+
+    result_data = {
+        "original_text": request.text,
+        text_key: merged_text,
+        "summary": " ".join(summaries)
+    }
+    if request.mode == "rewrite":
+        result_data["style_applied"] = request.style
+        result_data["key_changes"] = key_changes
+    else:
+        result_data["errors_found"] = errors_found
+
+    return {
+        "success": True,
+        "mode": request.mode,
+        "style": request.style if request.mode == "rewrite" else None,
+        "result": result_data,
+        "chunks": len(spans),
+        "failed_chunks": failed_chunks,
+        "generated_at": datetime.now().isoformat()
+    }
+
+
+@app.post("/api/improve-text", dependencies=[Depends(attribute_llm_usage)])
 async def improve_text(
-    request: TextImprovementRequest
+    request: TextImprovementRequest,
+    background: bool = False
 ):
     """
     Улучшение текста: проверка грамматики или переписывание в определённом стиле
+
+    С ?background=true выполняется фоновой задачей (см. /api/generate-press-release).
     """
     logger.info(f"Получен запрос на улучшение текста, режим: {request.mode}")
 
+    if background:
+        return submit_generation_job("improve_text", request, run_text_improvement)
+
     try:
-        # Импортируем функцию для создания промпта
-        try:
-            from prompts import build_prompt_for_text_improvement
-        except ImportError:
-            from backend.prompts import build_prompt_for_text_improvement
+        return JSONResponse(content=await run_text_improvement(request))
 
-        # Создаем промпт
-        user_prompt = build_prompt_for_text_improvement(
-            text=request.text,
-            mode=request.mode,
-            style=request.style
-        )
+    except LLMOverloadedError:
+        raise
+    except Exception as e:
+        logger.error(f"Неожиданная ошибка при улучшении текста: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Неожиданная ошибка: {str(e)}")
 
-        # Вызываем AI для улучшения текста
-        logger.info("Отправляем запрос к AI для улучшения текста")
-        ai_response = await open_router_client.improve_text(
-            user_prompt=user_prompt,
-            model=request.model
+
+class BatchTextImprovementRequest(BaseModel):
+    items: List[TextImprovementRequest]
+
+
+@app.post("/api/improve-text/batch", dependencies=[Depends(attribute_llm_usage)])
+async def improve_text_batch(request: BatchTextImprovementRequest):
+    """
+    Пакетное улучшение текстов (заголовок, лид, основной текст, цитаты) одним запросом
+
+    Элементы обрабатываются параллельно, общее число одновременных вызовов
+    модели ограничено IMPROVE_TEXT_BATCH_CONCURRENCY на процесс (длинные
+    элементы по частям - IMPROVE_TEXT_CHUNK_CONCURRENCY частей на элемент).
+    Ошибка одного элемента не прерывает остальные.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Список текстов пуст")
+    if len(request.items) > IMPROVE_TEXT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много текстов. Максимум: {IMPROVE_TEXT_BATCH_MAX_ITEMS}"
         )
 
-        # Извлекаем JSON из ответа
-        cleaned_response = extract_json(ai_response)
-        logger.info(f"Получен ответ от AI: {cleaned_response[:200]}...")
+    logger.info(f"Получен пакетный запрос на улучшение текста: {len(request.items)} элементов")
 
-        # Парсим JSON
+    async def run_item(index: int, item: TextImprovementRequest) -> dict:
         try:
-            result_data = json.loads(cleaned_response)
-
-            response_data = {
-                "success": True,
-                "mode": request.mode,
-                "style": request.style if request.mode == "rewrite" else None,
-                "result": result_data,
-                "generated_at": datetime.now().isoformat()
-            }
+            spans = text_improvement_spans(item)
+            if spans:
+                # Части ограничены внутри элемента, общий лимит вызовов - у клиента LLM
+                result = await run_chunked_text_improvement(item, spans)
+            else:
+                async with improve_text_batch_semaphore:
+                    result = await run_text_improvement(item)
+        except Exception as e:
+            logger.error(f"Ошибка улучшения текста (элемент {index}): {str(e)}")
+            result = {"success": False, "error": str(e)}
+        return {"index": index, **result}
 
-            return JSONResponse(content=response_data)
+    results = await asyncio.gather(*(
+        run_item(index, item) for index, item in enumerate(request.items)
+    ))
+    succeeded = sum(1 for r in results if r["success"])
 
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка парсинга JSON результата: {str(e)}")
-            return JSONResponse(content={
-                "success": False,
-                "error": "Ошибка парсинга ответа ИИ",
-                "raw_response": cleaned_response
-            })
-
-    except Exception as e:
-        logger.error(f"Неожиданная ошибка при улучшении текста: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Неожиданная ошибка: {str(e)}")
+    return JSONResponse(content={
+        "success": succeeded == len(results),
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results,
+        "generated_at": datetime.now().isoformat()
+    })
 
 
 class MediaSelectionRequest(BaseModel):
     text: str
     model: str = "deepseek"
-
-
-@app.post("/api/analyze-media-relevance")
+    use_local_classifier: bool = True  # False - всегда спрашивать LLM
+
+
+# Локальный классификатор категорий: пересобирается раз в CATEGORY_CLASSIFIER_TTL секунд
+# или при изменении списка категорий
+LOCAL_CLASSIFIER_ENABLED = os.getenv("LOCAL_CLASSIFIER_ENABLED", "true").lower() == "true"
+CATEGORY_CLASSIFIER_TTL = int(os.getenv("CATEGORY_CLASSIFIER_TTL", "600"))
+CATEGORY_CLASSIFIER_MIN_SCORE = float(os.getenv("CATEGORY_CLASSIFIER_MIN_SCORE", "3.0"))
+CATEGORY_CLASSIFIER_MIN_MARGIN = float(os.getenv("CATEGORY_CLASSIFIER_MIN_MARGIN", "0.25"))
+_category_classifier_state = {"signature": None, "built_at": 0.0, "classifier": None}
+
+
+def get_category_classifier(db: Session, available_categories: list) -> CategoryClassifier:
+    """Возвращает классификатор категорий, при необходимости пересобирая его"""
+    signature = tuple((c["id"], c["name"], c["description"]) for c in available_categories)
+    state = _category_classifier_state
+    now = time.monotonic()
+    if (
+        state["classifier"] is not None
+        and state["signature"] == signature
+        and now - state["built_at"] < CATEGORY_CLASSIFIER_TTL
+    ):
+        return state["classifier"]
+
+    # Тексты прошлых рассылок по категориям СМИ, в которые они отправлялись
+    rows = db.query(
+        media_categories.c.category_id,
+        Distribution.press_release_title,
+        Distribution.press_release_content,
+        Distribution.created_at
+    ).join(
+        distribution_media, distribution_media.c.distribution_id == Distribution.id
+    ).join(
+        media_categories, media_categories.c.media_id == distribution_media.c.media_id
+    ).distinct().order_by(
+        Distribution.created_at.desc()
+    ).limit(2000).all()
+
+    learned_texts = collect_learned_texts(
+        (category_id, f"{title}\n{(content or '')[:3000]}") for category_id, title, content, _ in rows
+    )
+    classifier = CategoryClassifier(available_categories, learned_texts)
+    state.update(signature=signature, built_at=now, classifier=classifier)
+    logger.info(f"Классификатор категорий собран: {len(available_categories)} категорий, "
+                f"{sum(len(t) for t in learned_texts.values())} примеров")
+    return classifier
+
+
+def build_media_relevance_response(db: Session, categories: list, result_data: dict) -> dict:
+    """Подбирает СМИ по выбранным категориям и формирует ответ /api/analyze-media-relevance"""
+    # Получаем медиа для выбранных категорий
+    selected_category_names = [
+        cat["category_name"] for cat in result_data.get("selected_categories", [])
+    ]
+
+    # Находим ID категорий по именам
+    category_ids = []
+    for cat in categories:
+        if cat.name in selected_category_names:
+            category_ids.append(cat.id)
+
+    # Получаем СМИ для этих категорий (many-to-many связь)
+    media_outlets = db.query(MediaOutlet).join(
+        MediaOutlet.categories
+    ).filter(
+        Category.id.in_(category_ids),
+        MediaOutlet.is_active == True
+    ).distinct().all()
+
+    # Формируем список СМИ без контактов
+    selected_media = [{
+        "id": media.id,
+        "name": media.name,
+        "categories": [{"id": cat.id, "name": cat.name} for cat in media.categories],
+        "is_premium": media.is_premium,
+        "audience_size": media.audience_size,
+        "monthly_reach": media.monthly_reach,
+        "rating": media.rating,
+        "website": media.website
+    } for media in media_outlets]
+
+    return {
+        "success": True,
+        "analysis": result_data,
+        "recommended_media": selected_media,
+        "total_media_count": len(selected_media),
+        "selected_category_ids": category_ids,
+        "generated_at": datetime.now().isoformat()
+    }
+
+
+@app.post("/api/analyze-media-relevance", dependencies=[Depends(attribute_llm_usage)])
 async def analyze_media_relevance(
     request: MediaSelectionRequest,
     db: Session = Depends(get_db)
 ):
     """
     Анализирует текст пресс-релиза и подбирает релевантные категории СМИ
+
+    Сначала пробует локальный классификатор; LLM вызывается, только если
+    лучшие категории не отделяются от остальных однозначно.
     """
     logger.info("Получен запрос на анализ текста для подбора СМИ")
 
@@ -355,87 +922,166 @@ async def analyze_media_relevance(
                 "error": "В базе данных нет доступных категорий СМИ"
             })
 
+        if LOCAL_CLASSIFIER_ENABLED and request.use_local_classifier:
+            classifier = get_category_classifier(db, available_categories)
+            local_result = classifier.classify(
+                request.text,
+                min_score=CATEGORY_CLASSIFIER_MIN_SCORE,
+                min_margin=CATEGORY_CLASSIFIER_MIN_MARGIN
+            )
+            if local_result:
+                logger.info("Категории подобраны локальным классификатором, LLM не вызывается")
+                return JSONResponse(content=build_media_relevance_response(db, categories, local_result))
+            logger.info("Локальный классификатор не уверен, обращаемся к LLM")
+
         # Импортируем функцию для создания промпта
         try:
             from prompts import build_prompt_for_media_selection
         except ImportError:
             from backend.prompts import build_prompt_for_media_selection
 
-        # Создаем промпт для анализа
+        # Создаем промпт для анализа (длинный текст сокращается под бюджет)
+        prompt_report = {}
         user_prompt = build_prompt_for_media_selection(
             text=request.text,
-            available_categories=available_categories
+            available_categories=available_categories,
+            max_tokens=MEDIA_SELECTION_PROMPT_MAX_TOKENS,
+            report=prompt_report
         )
 
         # Вызываем AI для анализа
         logger.info("Отправляем запрос к AI для подбора релевантных СМИ")
+        route = {}
         ai_response = await open_router_client.improve_text(
             user_prompt=user_prompt,
-            model=request.model
+            model=request.model,
+            cache_namespace="media_relevance",
+            json_mode=True,
+            route=route
         )
-
-        # Извлекаем JSON из ответа
-        cleaned_response = extract_json(ai_response)
-        logger.info(f"Получен ответ от AI: {cleaned_response[:200]}...")
+        logger.info(f"Получен ответ от AI: {ai_response[:200]}...")
 
         try:
-            result_data = json.loads(cleaned_response)
-
-            # Получаем медиа для выбранных категорий
-            selected_category_names = [
-                cat["category_name"] for cat in result_data.get("selected_categories", [])
-            ]
+            result_data, _ = parse_llm_json(ai_response, MediaSelectionOutput)
+            result_data["source"] = "llm"
+            result_data["routing"] = route
+            result_data["prompt"] = prompt_report
 
-            # Находим ID категорий по именам
-            category_ids = []
-            for cat in categories:
-                if cat.name in selected_category_names:
-                    category_ids.append(cat.id)
+            return JSONResponse(content=build_media_relevance_response(db, categories, result_data))
 
-            # Получаем СМИ для этих категорий (many-to-many связь)
-            media_outlets = db.query(MediaOutlet).join(
-                MediaOutlet.categories
-            ).filter(
-                Category.id.in_(category_ids),
-                MediaOutlet.is_active == True
-            ).distinct().all()
-
-            # Формируем список СМИ без контактов
-            selected_media = [{
-                "id": media.id,
-                "name": media.name,
-                "categories": [{"id": cat.id, "name": cat.name} for cat in media.categories],
-                "is_premium": media.is_premium,
-                "audience_size": media.audience_size,
-                "monthly_reach": media.monthly_reach,
-                "rating": media.rating,
-                "website": media.website
-            } for media in media_outlets]
-
-            response_data = {
-                "success": True,
-                "analysis": result_data,
-                "recommended_media": selected_media,
-                "total_media_count": len(selected_media),
-                "selected_category_ids": category_ids,
-                "generated_at": datetime.now().isoformat()
-            }
-
-            return JSONResponse(content=response_data)
-
-        except json.JSONDecodeError as e:
+        except LLMOutputError as e:
             logger.error(f"Ошибка парсинга JSON результата: {str(e)}")
             return JSONResponse(content={
                 "success": False,
                 "error": "Ошибка парсинга ответа ИИ",
-                "raw_response": cleaned_response
+                "raw_response": e.raw_response
             })
 
+    except LLMOverloadedError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при анализе текста для подбора СМИ: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/jobs/{job_id}")
+async def get_generation_job(
+    job_id: str,
+    wait: float = 0,
+    user_data: Optional[dict] = Depends(get_current_user_optional)
+):
+    """
+    Состояние фоновой задачи генерации; result появляется при status=done
+
+    wait - сколько секунд (до 30) ждать завершения перед ответом (long polling).
+    Задача другого пользователя - 404, как и несуществующая.
+    """
+    user_id = user_data.get("sub") if user_data else None
+    if wait > 0:
+        job = await generation_jobs.wait(job_id, timeout=min(wait, 30), user_id=user_id)
+    else:
+        job = await generation_jobs.get(job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена или срок хранения результата истёк")
+    return job
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_generation_job(job_id: str, user_data: Optional[dict] = Depends(get_current_user_optional)):
+    """
+    SSE поток состояния фоновой задачи (только для пользователя, который её поставил)
+
+    События:
+    - status: текущее состояние задачи (каждые 15 секунд, пока она выполняется)
+    - done: итоговое состояние с result или error
+    """
+    user_id = user_data.get("sub") if user_data else None
+    job = await generation_jobs.get(job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена или срок хранения результата истёк")
+
+    async def event_stream():
+        deadline = time.monotonic() + LLM_JOB_EVENTS_TIMEOUT
+        state = job
+        while state["status"] not in (JOB_DONE, JOB_FAILED):
+            yield sse_event("status", {"job_id": job_id, "status": state["status"]})
+            if time.monotonic() >= deadline:
+                return
+            state = await generation_jobs.wait(job_id, timeout=15, user_id=user_id)
+            if state is None:
+                yield sse_event("error", {"error": "Задача не найдена"})
+                return
+        yield sse_event("done", state)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+@app.get("/api/llm/status")
+async def get_llm_status():
+    """
+    Состояние circuit breaker'ов и латентность по моделям OpenRouter
+    """
+    return {
+        "models": open_router_client.breaker_status(),
+        "hedging_enabled": open_router_client.hedging_enabled,
+        "fallback_models": open_router_client.fallback_models,
+        "singleflight": open_router_client.singleflight.stats() if open_router_client.singleflight else None,
+        "admission": open_router_client.limiter.stats(),
+        "router": open_router_client.router.snapshot() if open_router_client.router else None,
+        "transport": open_router_client.transport_status(),
+        "jobs": generation_jobs.stats()
+    }
+
+
+@app.get("/api/llm/metrics")
+async def get_llm_metrics():
+    """
+    Учёт вызовов LLM по моделям: исходы, гистограммы латентности и токенов, стоимость
+    """
+    return {
+        "persist_enabled": LLM_USAGE_PERSIST,
+        "json_output": dict(PARSE_STATS),
+        **open_router_client.metrics.snapshot()
+    }
+
+
+@app.get("/api/llm/cache")
+async def get_llm_cache_stats():
+    """
+    Статистика кэша ответов LLM (попадания, размер, TTL)
+    """
+    if not open_router_client.cache:
+        return {"enabled": False}
+    return {"enabled": True, **open_router_client.cache.stats()}
+
+
 # ==================== USER ENDPOINTS ====================
 
 @app.post("/api/user/sync")
@@ -529,6 +1175,20 @@ async def get_user_stats(
 
         plan_info = plan_config.get(user.plan_type, plan_config[PlanType.FREE])
 
+        # Расход LLM за текущий месяц (если учёт сохраняется в БД)
+        llm_usage = None
+        if LLM_USAGE_PERSIST:
+            month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            calls, tokens, cost = db.query(
+                func.count(LLMUsage.id),
+                func.coalesce(func.sum(LLMUsage.prompt_tokens + LLMUsage.completion_tokens), 0),
+                func.coalesce(func.sum(LLMUsage.cost), 0.0)
+            ).filter(
+                LLMUsage.clerk_user_id == clerk_user_id,
+                LLMUsage.created_at >= month_start
+            ).one()
+            llm_usage = {"calls": calls, "tokens": int(tokens), "cost_usd": round(float(cost), 4)}
+
         return {
             "user_id": user.id,
             "email": user.email,
@@ -542,6 +1202,7 @@ async def get_user_stats(
             "used_credits": plan_info["credits"] - user.credits,
             "remaining_credits": user.credits,
             "media_count": total_media_count,
+            "llm_usage_this_month": llm_usage,
             "recent_releases": [
                 {
                     "id": d.id,
@@ -697,6 +1358,136 @@ async def calculate_price(request: CalculatePriceRequest, db: Session = Depends(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def load_press_release_data(raw: Optional[str]) -> dict:
+    """press_release_data рассылки (JSON строка) -> dict; некорректное значение -> пустой dict"""
+    if not raw:
+        return {}
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def build_branding_dict(
+    branding: Optional[UserBranding],
+    company_name: Optional[str],
+    contact_email: Optional[str],
+    contact_phone: Optional[str]
+) -> dict:
+    """Брендинг письма рассылки; без настроек брендинга - значения по умолчанию и контакты рассылки"""
+    return {
+        'primary_color': branding.primary_color if branding else '#3B82F6',
+        'secondary_color': branding.secondary_color if branding else '#8B5CF6',
+        'accent_color': branding.accent_color if branding else '#10B981',
+        'company_name': branding.company_name if branding and branding.company_name else company_name,
+        'contact_email': branding.contact_email if branding and branding.contact_email else contact_email,
+        'contact_phone': branding.contact_phone if branding and branding.contact_phone else contact_phone,
+        'contact_person': branding.contact_person if branding else '',
+        'website': branding.website if branding else '',
+        'default_closing': branding.default_closing if branding else 'С уважением',
+        'show_logo_in_header': branding.show_logo_in_header if branding else True,
+        'show_social_links': branding.show_social_links if branding else True,
+        'logo_url': branding.logo_url if branding else None,
+        'email_signature': branding.email_signature if branding else None,
+        'footer_text': branding.footer_text if branding else None,
+        'linkedin_url': branding.linkedin_url if branding else None,
+        'twitter_url': branding.twitter_url if branding else None,
+        'facebook_url': branding.facebook_url if branding else None,
+        'instagram_url': branding.instagram_url if branding else None,
+        'youtube_url': branding.youtube_url if branding else None,
+        'telegram_url': branding.telegram_url if branding else None,
+    }
+
+
+def render_distribution_email(
+    user: User,
+    branding: Optional[UserBranding],
+    title: str,
+    content: str,
+    company_name: Optional[str],
+    contact_email: Optional[str],
+    contact_phone: Optional[str],
+    stored: Optional[dict] = None
+) -> dict:
+    """
+    HTML и текст письма рассылки с повторным использованием сохранённого рендера
+
+    Рендер хранится в press_release_data рассылки вместе с render_key - версией
+    брендинга (updated_at), хэшем заголовка, текста и контактов и параметрами
+    рендера (версия шаблона, минификация, приветствие). Создание,
+    предпросмотр и отправка используют один результат, пока не изменились
+    текст рассылки или брендинг пользователя.
+
+    Returns:
+        {"email_html", "email_plain", "greeting_spans", "render_key", "branding", "reused"}
+    """
+    branding_version = branding.updated_at.isoformat() if branding and branding.updated_at else "default"
+    content_hash = hashlib.sha256(
+        json.dumps([title, content, company_name, contact_email, contact_phone], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:16]
+    # Параметры рендера тоже в ключе: после смены флагов сохранённые письма перерендериваются
+    render_options = f"{render_options_key()}:greeting={int(DISTRIBUTION_PERSONALIZE_GREETING)}"
+    render_key = f"{branding_version}:{content_hash}:{render_options}"
+
+    branding_dict = build_branding_dict(branding, company_name, contact_email, contact_phone)
+    stored = stored or {}
+    if (
+        stored.get("render_key") == render_key
+        and stored.get("email_html") and stored.get("email_plain") and stored.get("greeting_spans")
+    ):
+        return {
+            "email_html": stored["email_html"],
+            "email_plain": stored["email_plain"],
+            "greeting_spans": stored["greeting_spans"],
+            "render_key": render_key,
+            "branding": branding_dict,
+            "reused": True
+        }
+
+    # Письмо без имени получателя; приветствие подставляется при отправке (PersonalizedEmail)
+    bodies = render_email_bodies(
+        press_release_title=title,
+        press_release_content=content,
+        branding=branding_dict,
+        cache_key=(user.id, branding_version, company_name, contact_email, contact_phone)
+    )
+    return {
+        **bodies,
+        "render_key": render_key,
+        "branding": branding_dict,
+        "reused": False
+    }
+
+
+def get_distribution_email(distribution: Distribution, user: User, branding: Optional[UserBranding]) -> dict:
+    """
+    Письмо рассылки из сохранённого рендера; при изменении текста или брендинга
+    рендер обновляется в press_release_data (коммит - на стороне вызывающего)
+    """
+    stored = load_press_release_data(distribution.press_release_data)
+    rendered = render_distribution_email(
+        user, branding,
+        distribution.press_release_title,
+        distribution.press_release_content,
+        distribution.company_name,
+        distribution.contact_email,
+        distribution.contact_phone,
+        stored=stored
+    )
+    if not rendered["reused"]:
+        logger.info(f"Письмо рассылки {distribution.id} перерендерено ({rendered['render_key']})")
+        distribution.press_release_data = json.dumps({
+            **stored,
+            'email_html': rendered["email_html"],
+            'email_plain': rendered["email_plain"],
+            'greeting_spans': rendered["greeting_spans"],
+            'render_key': rendered["render_key"],
+            'branding_used': branding is not None
+        })
+    return rendered
+
+
 @app.post("/api/distributions")
 async def create_distribution(
     request: CreateDistributionRequest,
@@ -742,43 +1533,14 @@ async def create_distribution(
         # Получаем настройки брендинга пользователя
         branding = db.query(UserBranding).filter(UserBranding.user_id == user.id).first()
 
-        branding_dict = None
-        if branding:
-            branding_dict = {
-                'primary_color': branding.primary_color,
-                'secondary_color': branding.secondary_color,
-                'accent_color': branding.accent_color,
-                'company_name': branding.company_name or user.email.split('@')[0],
-                'company_tagline': branding.company_tagline,
-                'contact_person': branding.contact_person,
-                'contact_email': branding.contact_email or user.email,
-                'contact_phone': branding.contact_phone,
-                'website': branding.website,
-                'logo_url': branding.logo_url,
-                'linkedin_url': branding.linkedin_url,
-                'twitter_url': branding.twitter_url,
-                'facebook_url': branding.facebook_url,
-                'instagram_url': branding.instagram_url,
-                'youtube_url': branding.youtube_url,
-                'telegram_url': branding.telegram_url,
-                'email_signature': branding.email_signature,
-                'default_closing': branding.default_closing,
-                'show_logo_in_header': branding.show_logo_in_header,
-                'show_social_links': branding.show_social_links,
-                'footer_text': branding.footer_text,
-            }
-
-        # Генерируем HTML и plain text версии письма
-        email_html = generate_email_html(
-            press_release_title=request.press_release_title,
-            press_release_content=request.press_release_content,
-            branding=branding_dict
-        )
-
-        email_plain = generate_plain_text_email(
-            press_release_title=request.press_release_title,
-            press_release_content=request.press_release_content,
-            branding=branding_dict
+        # Рендерим письмо один раз: предпросмотр и отправка используют сохранённый результат
+        rendered = render_distribution_email(
+            user, branding,
+            request.press_release_title,
+            request.press_release_content,
+            request.company_name,
+            request.contact_email,
+            request.contact_phone
         )
 
         # Рассчитываем общую стоимость
@@ -786,10 +1548,12 @@ async def create_distribution(
 
         # Подготавливаем данные пресс-релиза (конвертируем в JSON string)
         press_release_data_dict = {
-            **(request.press_release_data or {}),
-            'email_html': email_html,
-            'email_plain': email_plain,
-            'branding_used': branding_dict is not None
+            **load_press_release_data(request.press_release_data),
+            'email_html': rendered["email_html"],
+            'email_plain': rendered["email_plain"],
+            'greeting_spans': rendered["greeting_spans"],
+            'render_key': rendered["render_key"],
+            'branding_used': branding is not None
         }
 
         # Создаём дистрибуцию
@@ -1130,48 +1894,46 @@ async def upload_distribution_file(
         if not is_valid:
             raise HTTPException(status_code=400, detail=error_message)
 
-        # Читаем содержимое файла
-        contents = await file.read()
-        file_size = len(contents)
-
-        # Проверка размера
-        if file_size > MAX_FILE_SIZE:
+        # Сначала считаем SHA-256; если такое содержимое уже загружено, файл не пишется повторно
+        try:
+            blob, deduplicated = await blob_store.acquire(db, file, MAX_FILE_SIZE)
+        except FileTooLargeError:
             raise HTTPException(
                 status_code=400,
                 detail=f"Файл слишком большой. Максимальный размер: {MAX_FILE_SIZE // (1024*1024)} MB"
             )
 
-        # Генерируем уникальное имя файла
-        file_ext = file.filename.split('.')[-1].lower()
-        unique_filename = f"{uuid.uuid4()}.{file_ext}"
-        file_path = UPLOAD_DIR / str(distribution_id) / unique_filename
-
-        # Создаём папку для рассылки
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-
-        # Сохраняем файл
-        with open(file_path, "wb") as f:
-            f.write(contents)
-
-        # Сохраняем информацию в БД
-        db_file = DistributionFile(
-            distribution_id=distribution_id,
-            file_name=file.filename,
-            file_path=str(file_path),
-            file_size=file_size,
-            file_type=file.content_type
-        )
-        db.add(db_file)
-        db.commit()
+        # Сохраняем информацию в БД - в одной транзакции со ссылкой на содержимое
+        sha256 = blob.sha256
+        try:
+            db_file = DistributionFile(
+                distribution_id=distribution_id,
+                file_name=file.filename,
+                file_path=blob.file_path,
+                file_size=blob.file_size,
+                file_type=file.content_type,
+                sha256=sha256
+            )
+            db.add(db_file)
+            db.commit()
+        except Exception:
+            db.rollback()
+            if not deduplicated:
+                # Файл записал этот запрос, а ссылка на него откатилась
+                await blob_store.purge(db, sha256)
+            raise
         db.refresh(db_file)
 
-        logger.info(f"Файл {file.filename} загружен для рассылки {distribution_id}")
+        logger.info(f"Файл {file.filename} загружен для рассылки {distribution_id}"
+                    f"{' (уже был в хранилище)' if deduplicated else ''}")
 
         return {
             "id": db_file.id,
             "file_name": db_file.file_name,
             "file_size": db_file.file_size,
             "file_type": db_file.file_type,
+            "sha256": db_file.sha256,
+            "deduplicated": deduplicated,
             "uploaded_at": db_file.uploaded_at.isoformat()
         }
 
@@ -1217,6 +1979,7 @@ async def get_distribution_files(
             "file_name": f.file_name,
             "file_size": f.file_size,
             "file_type": f.file_type,
+            "sha256": f.sha256,
             "uploaded_at": f.uploaded_at.isoformat()
         } for f in files]
 
@@ -1262,17 +2025,35 @@ async def delete_distribution_file(
         if not db_file:
             raise HTTPException(status_code=404, detail="Файл не найден")
 
-        # Удаляем физический файл
-        try:
-            file_path = Path(db_file.file_path)
-            if file_path.exists():
-                file_path.unlink()
-        except Exception as e:
-            logger.warning(f"Не удалось удалить физический файл: {e}")
+        sha256 = db_file.sha256
+        file_path = Path(db_file.file_path)
+        in_blob_store = bool(sha256) and file_path == blob_store.path_for(sha256)
 
-        # Удаляем запись из БД
-        db.delete(db_file)
-        db.commit()
+        # Удаляем запись из БД и убираем ссылку на содержимое одной транзакцией. Ссылка
+        # убирается, только если запись удалил этот запрос, - повторное удаление того же
+        # файла не уменьшит счётчик дважды
+        released = False
+        try:
+            deleted = db.query(DistributionFile).filter(
+                DistributionFile.id == file_id
+            ).delete(synchronize_session=False)
+            if deleted and in_blob_store:
+                released = await blob_store.release(db, sha256)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        # Физический файл удаляем только после commit: содержимое - если на него больше никто
+        # не ссылается, файлы, загруженные до хранилища по sha256, лежат отдельно
+        if released:
+            await blob_store.purge(db, sha256)
+        elif deleted and not in_blob_store:
+            try:
+                if file_path.exists():
+                    file_path.unlink()
+            except Exception as e:
+                logger.warning(f"Не удалось удалить физический файл: {e}")
 
         logger.info(f"Файл {file_id} удалён из рассылки {distribution_id}")
 
@@ -1365,7 +2146,6 @@ async def preview_distribution_email(
         # Используем поля из distribution напрямую
         press_release_title = distribution.press_release_title
         press_release_content = distribution.press_release_content
-        company_name = distribution.company_name
 
         if not press_release_title or not press_release_content:
             raise HTTPException(status_code=400, detail="Пресс-релиз не найден")
@@ -1373,36 +2153,12 @@ async def preview_distribution_email(
         # Получаем брендинг пользователя
         branding = db.query(UserBranding).filter(UserBranding.user_id == user.id).first()
 
-        branding_dict = {
-            'primary_color': branding.primary_color if branding else '#3B82F6',
-            'secondary_color': branding.secondary_color if branding else '#8B5CF6',
-            'accent_color': branding.accent_color if branding else '#10B981',
-            'company_name': branding.company_name if branding and branding.company_name else company_name,
-            'contact_email': branding.contact_email if branding and branding.contact_email else distribution.contact_email,
-            'contact_phone': branding.contact_phone if branding and branding.contact_phone else distribution.contact_phone,
-            'contact_person': branding.contact_person if branding else '',
-            'website': branding.website if branding else '',
-            'default_closing': branding.default_closing if branding else 'С уважением',
-            'show_logo_in_header': branding.show_logo_in_header if branding else True,
-            'show_social_links': branding.show_social_links if branding else True,
-            'logo_url': branding.logo_url if branding else None,
-            'email_signature': branding.email_signature if branding else None,
-            'footer_text': branding.footer_text if branding else None,
-            'linkedin_url': branding.linkedin_url if branding else None,
-            'twitter_url': branding.twitter_url if branding else None,
-            'facebook_url': branding.facebook_url if branding else None,
-            'instagram_url': branding.instagram_url if branding else None,
-            'youtube_url': branding.youtube_url if branding else None,
-            'telegram_url': branding.telegram_url if branding else None,
-        }
-
-        # Генерируем HTML preview
-        html_content = generate_email_html(
-            press_release_title=press_release_title,
-            press_release_content=press_release_content,
-            branding=branding_dict,
-            recipient_name=None  # В preview не показываем конкретное имя
-        )
+        # Сохранённый при создании рендер (обновляется, если изменились текст или брендинг)
+        rendered = get_distribution_email(distribution, user, branding)
+        if not rendered["reused"]:
+            db.commit()
+        branding_dict = rendered["branding"]
+        html_content = rendered["email_html"]
 
         # Получаем список выбранных СМИ через relationship
         media_outlets = distribution.media_outlets
@@ -1420,7 +2176,11 @@ async def preview_distribution_email(
             "media_count": len(media_outlets),
             "media_outlets": [{"id": m.id, "name": m.name, "media_type": m.media_type} for m in media_outlets],
             "attachments": [{"name": f.file_name, "size": f.file_size, "type": f.file_type} for f in files],
-            "branding": branding_dict
+            "branding": branding_dict,
+            # Оценка размера письма с вложениями (отправка предупредит о превышении лимита SMTP)
+            "message_size": press_email_service.size_report(estimate_message_size(
+                html_content, rendered["email_plain"], [f.file_size or 0 for f in files]
+            ))
         }
 
     except HTTPException:
@@ -1462,7 +2222,6 @@ async def send_distribution(
         # Используем поля из distribution напрямую
         press_release_title = distribution.press_release_title
         press_release_content = distribution.press_release_content
-        company_name = distribution.company_name
 
         if not press_release_title or not press_release_content:
             raise HTTPException(status_code=400, detail="Пресс-релиз не найден")
@@ -1478,7 +2237,8 @@ async def send_distribution(
             DistributionFile.distribution_id == distribution_id
         ).all()
 
-        attachment_paths = [f.file_path for f in files] if files else []
+        # Путь в хранилище - хэш содержимого, имя вложения берём из загрузки
+        attachment_paths = [(f.file_path, f.file_name) for f in files] if files else []
         logger.info(f"📎 Найдено {len(files)} файлов для рассылки {distribution_id}")
         for f in files:
             logger.info(f"   - {f.file_name} ({f.file_size} bytes) at {f.file_path}")
@@ -1486,41 +2246,15 @@ async def send_distribution(
         # Получаем брендинг пользователя
         branding = db.query(UserBranding).filter(UserBranding.user_id == user.id).first()
 
-        branding_dict = {
-            'primary_color': branding.primary_color if branding else '#3B82F6',
-            'secondary_color': branding.secondary_color if branding else '#8B5CF6',
-            'accent_color': branding.accent_color if branding else '#10B981',
-            'company_name': branding.company_name if branding and branding.company_name else company_name,
-            'contact_email': branding.contact_email if branding and branding.contact_email else distribution.contact_email,
-            'contact_phone': branding.contact_phone if branding and branding.contact_phone else distribution.contact_phone,
-            'contact_person': branding.contact_person if branding else '',
-            'website': branding.website if branding else '',
-            'default_closing': branding.default_closing if branding else 'С уважением',
-            'show_logo_in_header': branding.show_logo_in_header if branding else True,
-            'show_social_links': branding.show_social_links if branding else True,
-            'logo_url': branding.logo_url if branding else None,
-            'email_signature': branding.email_signature if branding else None,
-            'footer_text': branding.footer_text if branding else None,
-            'linkedin_url': branding.linkedin_url if branding else None,
-            'twitter_url': branding.twitter_url if branding else None,
-            'facebook_url': branding.facebook_url if branding else None,
-            'instagram_url': branding.instagram_url if branding else None,
-            'youtube_url': branding.youtube_url if branding else None,
-            'telegram_url': branding.telegram_url if branding else None,
-        }
-
-        # Генерируем HTML и текстовую версию письма
-        html_content = generate_email_html(
-            press_release_title=press_release_title,
-            press_release_content=press_release_content,
-            branding=branding_dict,
-            recipient_name=None
-        )
-        text_content = generate_plain_text_email(
-            press_release_title=press_release_title,
-            press_release_content=press_release_content,
-            branding=branding_dict,
-            recipient_name=None
+        # Письмо из сохранённого рендера (тот же HTML, что в предпросмотре)
+        rendered = get_distribution_email(distribution, user, branding)
+        branding_dict = rendered["branding"]
+        html_content = rendered["email_html"]
+        text_content = rendered["email_plain"]
+        # Обращение к редакции подставляется в готовое письмо без повторного рендера
+        personalized = (
+            PersonalizedEmail(html_content, text_content, rendered["greeting_spans"])
+            if DISTRIBUTION_PERSONALIZE_GREETING else None
         )
 
         # Тема письма (заголовок пресс-релиза)
@@ -1529,6 +2263,21 @@ async def send_distribution(
         # Название компании (для From поля)
         company_name = branding_dict['company_name']
 
+        # Заголовки и вложения кодируются один раз на рассылку, на получателя - только To/Message-ID/Date
+        try:
+            prepared_message = await asyncio.to_thread(
+                press_email_service.prepare_message, subject, attachment_paths, company_name
+            )
+        except InvalidHeaderError as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Заголовок пресс-релиза и название компании не должны содержать переводов строк ({e})"
+            )
+        message_size = press_email_service.size_report(
+            prepared_message.message_size(html_content, text_content)
+        )
+        logger.info(f"📦 Размер письма рассылки {distribution_id}: {message_size['message_size_bytes']} байт")
+
         # Счетчики
         sent_count = 0
         failed_count = 0
@@ -1558,13 +2307,15 @@ async def send_distribution(
                 continue
 
             # Отправляем email
-            success = await press_email_service.send_press_release(
+            if personalized:
+                media_html, media_text = personalized.render(f"редакция {media.name}")
+            else:
+                media_html, media_text = html_content, text_content
+            success = await press_email_service.send_prepared(
+                prepared_message,
                 to_email=media.email,
-                subject=subject,
-                html_content=html_content,
-                text_content=text_content,
-                attachments=attachment_paths,
-                company_name=company_name
+                html_content=media_html,
+                text_content=media_text
             )
 
             if success:
@@ -1617,6 +2368,7 @@ async def send_distribution(
             "sent_count": sent_count,
             "failed_count": failed_count,
             "status": distribution.status,
+            "message_size": message_size,
             "delivery_logs": delivery_logs
         }
 
@@ -1870,7 +2622,8 @@ async def preview_email(
         email_html = generate_email_html(
             press_release_title=request.press_release_title,
             press_release_content=request.press_release_content,
-            branding=branding_dict
+            branding=branding_dict,
+            cache_key=(user.id, user.email, branding.updated_at) if branding else None
         )
 
         return {
@@ -1,8 +1,30 @@
+import asyncio
+import dataclasses
 import logging
 import os
+import time
+from collections import deque
+from typing import AsyncIterator, Optional
 
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, BadRequestError
+
+try:
+    from circuit_breaker import CircuitBreakerRegistry
+    from llm_limiter import AdmissionController, LLMOverloadedError
+    from llm_cache import CACHE_TTLS, LLMResponseCache, SingleFlight, make_cache_key
+    from llm_metrics import LLMCallRecord, LLMMetrics, current_llm_user, usage_from_completion
+    from llm_router import IMPROVE_TEXT_MODEL_ALIASES, ModelRouter, resolve_model
+    from llm_http import ConnectionStats, HTTPSettings, build_http_client
+    from prompts import estimate_tokens
+except ImportError:
+    from .circuit_breaker import CircuitBreakerRegistry
+    from .llm_limiter import AdmissionController, LLMOverloadedError
+    from .llm_cache import CACHE_TTLS, LLMResponseCache, SingleFlight, make_cache_key
+    from .llm_metrics import LLMCallRecord, LLMMetrics, current_llm_user, usage_from_completion
+    from .llm_router import IMPROVE_TEXT_MODEL_ALIASES, ModelRouter, resolve_model
+    from .llm_http import ConnectionStats, HTTPSettings, build_http_client
+    from .prompts import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -12,47 +34,460 @@ load_dotenv()
 class OpenRouterClient:
     def __init__(self):
         self.api_key = os.environ.get("DEEPSEEK_API_KEY", "")
-        self.base_url = "https://openrouter.ai/api/v1"
-        self.client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, timeout=20)
+        # Можно направить на локальный llm_mock_server.py для разработки и нагрузочных тестов
+        self.base_url = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+        # HTTP клиент создаётся при старте приложения (start) или при первом запросе
+        self.http_settings = HTTPSettings()
+        self.connection_stats = ConnectionStats()
+        self._http_client = None
+        self._client = None
         self.default_model = "google/gemini-3-flash-preview"
         self.headers = {
             "HTTP-Referer": "https://obuchai.com",  # Optional: Your site URL
             "X-Title": "Obuchai.com"  # Optional: Your site title
         }
+        self.cache = None
+        if os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true":
+            self.cache = LLMResponseCache(
+                max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "512")),
+                disk_path=os.environ.get("LLM_CACHE_DB_PATH") or None
+            )
+
+        # Резервные модели, добавляемые в конец списка (через запятую)
+        self.fallback_models = [
+            m.strip() for m in os.environ.get("LLM_FALLBACK_MODELS", "").split(",") if m.strip()
+        ]
+        # Hedging: если модель не ответила за hedge-задержку, параллельно запускаем следующую
+        self.hedging_enabled = os.environ.get("LLM_HEDGING_ENABLED", "false").lower() == "true"
+        self.hedge_delay_default = float(os.environ.get("LLM_HEDGE_DELAY", "8"))
+        self.hedge_delay_min = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "1"))
+        self.hedge_percentile = float(os.environ.get("LLM_HEDGE_PERCENTILE", "0.9"))
+        self.hedge_min_samples = 20
+        self._latencies = {}
+        self.breakers = CircuitBreakerRegistry()
+        self.limiter = AdmissionController.from_env()
+        self.metrics = LLMMetrics()
+        # Модели (префиксы), для которых запрашиваем response_format=json_object
+        self.json_mode_models = [
+            m.strip() for m in os.environ.get("LLM_JSON_MODE_MODELS", "google/,openai/,deepseek/").split(",")
+            if m.strip()
+        ]
+        self._json_mode_unsupported = set()
+        # Модели (префиксы), которые возвращают несколько вариантов за один запрос (параметр n)
+        self.n_param_models = [
+            m.strip() for m in os.environ.get("LLM_N_PARAM_MODELS", "openai/").split(",") if m.strip()
+        ]
+        # Выбор модели по наблюдаемой латентности; выбор пользователя - предпочтение
+        self.router = None
+        if os.environ.get("LLM_ROUTER_ENABLED", "true").lower() == "true":
+            self.router = ModelRouter.from_env(self.breakers)
+        self.singleflight = None
+        if os.environ.get("LLM_SINGLEFLIGHT_ENABLED", "true").lower() == "true":
+            self.singleflight = SingleFlight()
+        # Полные имена моделей, которые клиент может запросить кроме моделей из таблиц ключей
+        self.allowed_models = set(self.fallback_models) | set(self.router.pool if self.router else ())
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """AsyncOpenAI over the shared, tuned httpx client (created on first use)"""
+        if self._client is None:
+            self._http_client = build_http_client(self.http_settings, self.connection_stats)
+            self._client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                http_client=self._http_client,
+                timeout=self.http_settings.timeout()
+            )
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    async def start(self):
+        """Creates the HTTP client at application startup"""
+        self.client
+        logger.info(f"OpenRouter HTTP client ready: {self.http_settings.snapshot()}")
+
+    async def aclose(self):
+        """Closes pooled connections at application shutdown"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            self._http_client = None
 
-    async def generate_press_release(self, user_prompt: str, model: str = None, models: list = None) -> str:
+    def transport_status(self) -> dict:
+        """Pool settings and connection reuse counters"""
+        return {**self.http_settings.snapshot(), **self.connection_stats.snapshot()}
+
+    def _with_fallbacks(self, models_to_try: list) -> list:
+        """Appends configured fallback models that are not already in the list"""
+        return models_to_try + [m for m in self.fallback_models if m not in models_to_try]
+
+    def _supports_json_mode(self, model: str) -> bool:
+        if model in self._json_mode_unsupported:
+            return False
+        return any(model.startswith(prefix) for prefix in self.json_mode_models)
+
+    async def _create_completion(
+        self, model: str, json_mode: bool = False, timeout_kind: str = None, **kwargs
+    ):
         """
-        Generate a press release using the OpenAI SDK.
+        chat.completions.create with provider-enforced JSON when the model supports it.
 
-        Args:
-            user_prompt: User prompt for press release generation.
-            model: Model key, e.g., deepseek, gpt5o (deprecated, use models instead).
-            models: List of model keys to try in order.
+        timeout_kind selects the read timeout (request namespace or "stream").
+        """
+        kwargs["timeout"] = self.http_settings.timeout(timeout_kind)
+        if json_mode and self._supports_json_mode(model):
+            try:
+                return await self.client.chat.completions.create(
+                    extra_headers=self.headers,
+                    model=model,
+                    response_format={"type": "json_object"},
+                    **kwargs
+                )
+            except BadRequestError as e:
+                if "response_format" not in str(e):
+                    raise
+                logger.warning(f"{model} rejected JSON mode, retrying without it: {str(e)}")
+                self._json_mode_unsupported.add(model)
+        return await self.client.chat.completions.create(extra_headers=self.headers, model=model, **kwargs)
+
+    @staticmethod
+    def _prompt_tokens(messages: list) -> int:
+        return sum(estimate_tokens(m["content"]) for m in messages)
+
+    def _route(self, models_to_try: list, messages: list, namespace: str):
+        """Attempt order for this request and the routing decision behind it"""
+        if not self.router:
+            return models_to_try, {"preferred": models_to_try[0], "model": models_to_try[0], "reason": "static"}
+        return self.router.plan(models_to_try, namespace, self._prompt_tokens(messages))
+
+    def _record_route_sample(self, model: str, namespace: str, messages: list, latency: float, ok: bool):
+        if self.router:
+            self.router.record(model, namespace, self._prompt_tokens(messages), latency, ok)
+
+    @staticmethod
+    def _route_info(decision: dict, answered_by: Optional[str]) -> dict:
+        """Which model answered and why, for API responses"""
+        reason = decision["reason"]
+        if answered_by and answered_by != decision["model"]:
+            reason = f"{reason}; {decision['model']} failed, answered by fallback"
+        return {"model": answered_by, "preferred": decision["preferred"], "reason": reason}
+
+    def _record_latency(self, model: str, seconds: float):
+        self._latencies.setdefault(model, deque(maxlen=200)).append(seconds)
+
+    def latency_percentile(self, model: str, q: float) -> Optional[float]:
+        """Observed latency percentile of successful calls, None without enough samples"""
+        samples = self._latencies.get(model)
+        if not samples or len(samples) < self.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def _hedge_delay(self, model: str) -> float:
+        """How long to wait for model before firing the next one in parallel"""
+        observed = self.latency_percentile(model, self.hedge_percentile)
+        delay = observed if observed is not None else self.hedge_delay_default
+        return max(delay, self.hedge_delay_min)
+
+    async def _call_model(
+        self,
+        model: str,
+        messages: list,
+        temperature: float,
+        max_tokens: int,
+        attempt: int,
+        total: int,
+        namespace: str = None,
+        json_mode: bool = False,
+        n: int = 1,
+        user_id: str = None,
+        records: list = None
+    ):
+        """
+        Single completion attempt against one model (breaker slot already acquired).
+
+        Returns the answer text, or a list of texts when n > 1 (provider's n parameter).
+        The usage record is attributed to user_id; when records is given, it is appended
+        there instead of being persisted (the caller persists it).
+        """
+        logger.info(f"Trying model {attempt+1}/{total}: {model}")
+        breaker = self.breakers.get(model)
+        started = time.monotonic()
+
+        try:
+            async with self.limiter.slot():
+                started = time.monotonic()
+                completion = await self._create_completion(
+                    model,
+                    json_mode=json_mode,
+                    timeout_kind=namespace,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    **({"n": n} if n > 1 else {})
+                )
+
+            contents = [
+                choice.message.content.strip() for choice in (completion.choices or [])
+                if choice.message.content and choice.message.content.strip()
+            ]
+            if not contents:
+                raise Exception("Empty response")
+        except LLMOverloadedError:
+            # Модель не виновата: запрос не дождался слота
+            breaker.release()
+            raise
+        except asyncio.CancelledError:
+            breaker.release()
+            self._record_call(LLMCallRecord(
+                model=model, outcome="cancelled", latency=time.monotonic() - started,
+                attempt=attempt, namespace=namespace, user_id=user_id
+            ), records)
+            raise
+        except Exception:
+            latency = time.monotonic() - started
+            breaker.record_failure(latency)
+            self._record_route_sample(model, namespace, messages, latency, ok=False)
+            self._record_call(LLMCallRecord(
+                model=model, outcome="error", latency=latency, attempt=attempt, namespace=namespace,
+                user_id=user_id
+            ), records)
+            raise
+
+        latency = time.monotonic() - started
+        breaker.record_success(latency)
+        self._record_latency(model, latency)
+        self._record_route_sample(model, namespace, messages, latency, ok=True)
+        usage = usage_from_completion(getattr(completion, "usage", None))
+        self._record_call(LLMCallRecord(
+            model=model, outcome="success", latency=latency, attempt=attempt, namespace=namespace,
+            user_id=user_id, **usage
+        ), records)
+        logger.info(
+            f"Successfully received response from {model} in {latency:.2f}s "
+            f"({usage['prompt_tokens']}+{usage['completion_tokens']} tokens)"
+        )
+        return contents if n > 1 else contents[0]
+
+    def _record_call(self, record: LLMCallRecord, records: list = None):
+        if records is None:
+            self.metrics.record(record)
+        else:
+            self.metrics.record(record, persist=False)
+            records.append(record)
+
+    def breaker_status(self) -> list:
+        """Circuit breaker state and latency percentiles per upstream model"""
+        status = []
+        for snapshot in self.breakers.snapshot():
+            snapshot["latency_p50"] = self.latency_percentile(snapshot["model"], 0.5)
+            snapshot["latency_p90"] = self.latency_percentile(snapshot["model"], 0.9)
+            status.append(snapshot)
+        return status
+
+    async def _run_models(
+        self,
+        messages: list,
+        models_to_try: list,
+        temperature: float,
+        max_tokens: int,
+        hedge: bool,
+        namespace: str = None,
+        json_mode: bool = False,
+        n: int = 1,
+        user_id: str = None,
+        records: list = None
+    ) -> tuple:
+        """
+        Tries models_to_try until one returns a valid answer.
 
         Returns:
-            str: Generated press release text.
+            (text, model that answered); text is a list of choices when n > 1
+
+        A failed attempt immediately starts the next model. With hedge=True the next
+        model is also started when the newest attempt has not answered within its
+        hedge delay (observed p90 latency); the first valid answer wins and the
+        remaining attempts are cancelled. Models whose circuit breaker is open are
+        skipped.
+
+        An attempt that got no admission slot is treated as never started: the other
+        attempts keep running, and the overload is raised only when none is left.
 
         Raises:
-            Exception: If the model fails.
+            LLMOverloadedError: No admission slot freed up in time (not retried).
+            Exception: If all models fail.
         """
-        model_mapping = {
-            "deepseek": "google/gemini-3-flash-preview",
-            "gemini": "google/gemini-3-flash-preview",
-            "gpt5": "anthropic/claude-sonnet-4",
-            "claude4": "anthropic/claude-sonnet-4"
-        }
+        pending = {}
+        started = set()
+        next_index = 0
+        last_error = None
+        last_launched = None
+
+        async def attempt_model(model: str, attempt: int):
+            # Задача, отменённая до первого шага, не выполняет тело _call_model и не
+            # освобождает слот breaker'а - такие задачи освобождает finally ниже
+            started.add(asyncio.current_task())
+            return await self._call_model(
+                model, messages, temperature, max_tokens, attempt, len(models_to_try),
+                namespace, json_mode, n, user_id, records
+            )
+
+        def launch():
+            nonlocal next_index, last_launched
+            while next_index < len(models_to_try):
+                model = models_to_try[next_index]
+                attempt = next_index
+                next_index += 1
+                if not self.breakers.get(model).allow_request():
+                    logger.warning(f"Skipping {model}: circuit breaker is open")
+                    continue
+                task = asyncio.create_task(attempt_model(model, attempt))
+                pending[task] = model
+                last_launched = model
+                return
+
+        launch()
+        if not pending:
+            raise Exception(f"Model failed: all models unavailable (circuit open): {', '.join(models_to_try)}")
+
+        try:
+            while pending:
+                timeout = None
+                if hedge and next_index < len(models_to_try):
+                    timeout = self._hedge_delay(last_launched)
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    logger.info(f"Hedging: {last_launched} has not answered in {timeout:.1f}s, starting next model")
+                    launch()
+                    continue
+
+                overloaded = None
+                for task in done:
+                    model = pending.pop(task)
+                    try:
+                        return task.result(), model
+                    except LLMOverloadedError as e:
+                        logger.warning(f"No admission slot for {model}: {str(e)}")
+                        overloaded = e
+                    except Exception as e:
+                        logger.error(f"Error with model {model}: {str(e)}")
+                        last_error = e
+                        launch()
+                if overloaded and not pending:
+                    raise overloaded
+        finally:
+            for task, model in pending.items():
+                task.cancel()
+                if task not in started:
+                    self.breakers.get(model).release()
+
+        # If we get here, all models failed
+        logger.error(f"All models failed. Last error: {str(last_error)}")
+        raise Exception(f"Model failed: {str(last_error)}")
+
+    async def _complete(
+        self,
+        messages: list,
+        models_to_try: list,
+        temperature: float,
+        max_tokens: int,
+        cache_namespace: str = None,
+        json_mode: bool = False
+    ) -> tuple:
+        """
+        Runs the completion against models_to_try (plus configured fallbacks), returning the first answer.
+
+        The first model is the caller's preference; the router may try a faster or
+        healthier candidate first. json_mode asks models that support it
+        (LLM_JSON_MODE_MODELS) for a JSON object response.
+
+        Returns:
+            (text, route info: {"model", "preferred", "reason"})
+
+        When cache_namespace is set, identical requests (same models, prompts,
+        temperature, max_tokens, json_mode and namespace) are served from the response
+        cache for that namespace's TTL. Concurrent identical requests share a single
+        upstream call; its usage records are persisted once per caller (see below).
+        """
+        models_to_try = self._with_fallbacks(models_to_try)
+        user_id = current_llm_user()
+        cache_key = make_cache_key(
+            models_to_try, messages[0]["content"], messages[-1]["content"], temperature,
+            max_tokens, json_mode, cache_namespace
+        )
+        ttl = CACHE_TTLS.get(cache_namespace, 0) if self.cache else 0
+        if ttl > 0:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Cache hit for {cache_namespace} ({cache_key[:12]})")
+                return cached, {"model": None, "preferred": models_to_try[0], "reason": "cache"}
+
+        if not self.singleflight:
+            order, decision = self._route(models_to_try, messages, cache_namespace)
+            generated_text, answered_by = await self._run_models(
+                messages, order, temperature, max_tokens,
+                hedge=self.hedging_enabled, namespace=cache_namespace, json_mode=json_mode,
+                user_id=user_id
+            )
+            if ttl > 0:
+                await self.cache.set(cache_key, generated_text, ttl)
+            return generated_text, self._route_info(decision, answered_by)
+
+        produced = []
+
+        async def produce() -> tuple:
+            # Общая задача для всех одновременных вызывающих: записи попыток не сохраняются
+            # здесь (контекст первого вызывающего), а возвращаются каждому из них
+            produced.append(True)
+            records = []
+            order, decision = self._route(models_to_try, messages, cache_namespace)
+            try:
+                generated_text, answered_by = await self._run_models(
+                    messages, order, temperature, max_tokens,
+                    hedge=self.hedging_enabled, namespace=cache_namespace, json_mode=json_mode,
+                    records=records
+                )
+            except Exception as e:
+                e.llm_records = records
+                raise
+            if ttl > 0:
+                await self.cache.set(cache_key, generated_text, ttl)
+            return generated_text, self._route_info(decision, answered_by), records
+
+        try:
+            generated_text, info, records = await self.singleflight.do(cache_key, produce)
+        except Exception as e:
+            self._persist_shared(getattr(e, "llm_records", []), user_id, joined=not produced)
+            raise
+        self._persist_shared(records, user_id, joined=not produced)
+        return generated_text, info
+
+    def _persist_shared(self, records: list, user_id: Optional[str], joined: bool):
+        """
+        Сохраняет записи общего вызова от имени одного вызывающего.
 
+        Тот, чья задача выполнила вызов, получает записи как есть; присоединившиеся -
+        копии с outcome="coalesced" (токены те же, но провайдеру они не оплачивались).
+        """
+        for record in records:
+            self.metrics.persist(dataclasses.replace(
+                record,
+                user_id=user_id,
+                outcome="coalesced" if joined else record.outcome
+            ))
+
+    def _press_release_request(self, user_prompt: str, model: str = None, models: list = None):
+        """Builds (messages, models_to_try) for press release generation"""
         # Determine which models to try
         if models and isinstance(models, list):
-            models_to_try = []
-            for m in models:
-                mapped_model = model_mapping.get(m, m)
-                models_to_try.append(mapped_model)
-        elif model:
-            primary_model = model_mapping.get(model, self.default_model)
-            models_to_try = [primary_model]
+            models_to_try = [resolve_model(m, self.default_model, self.allowed_models) for m in models]
         else:
-            models_to_try = [self.default_model]
+            models_to_try = [resolve_model(model, self.default_model, self.allowed_models)]
 
         try:
             from prompts import SYSTEM_PROMPT
@@ -62,56 +497,275 @@ class OpenRouterClient:
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt}
         ]
+        return messages, models_to_try
+
+    async def generate_press_release(
+        self, user_prompt: str, model: str = None, models: list = None, route: dict = None
+    ) -> str:
+        """
+        Generate a press release using the OpenAI SDK.
+
+        Args:
+            user_prompt: User prompt for press release generation.
+            model: Model key, e.g., deepseek, gpt5o (deprecated, use models instead).
+            models: List of model keys to try in order (the first one is a preference).
+            route: Optional dict filled with the model that answered and the routing reason.
+
+        Returns:
+            str: Generated press release text.
+
+        Raises:
+            Exception: If the model fails.
+        """
+        messages, models_to_try = self._press_release_request(user_prompt, model, models)
+
+        text, info = await self._complete(
+            messages,
+            models_to_try,
+            temperature=0.7,
+            max_tokens=2000,  # Увеличено для пресс-релизов
+            cache_namespace="press_release",
+            json_mode=True
+        )
+        if route is not None:
+            route.update(info)
+        return text
+
+    async def generate_press_release_variants(
+        self, user_prompt: str, n: int, model: str = None, models: list = None
+    ) -> list:
+        """
+        Generates n press release candidates at once.
+
+        Models that support the provider's n parameter (LLM_N_PARAM_MODELS) return all
+        candidates from a single request. Otherwise, and for any candidates the
+        provider did not return, variants run concurrently: the first uses the plain
+        prompt (shared cache with generate_press_release), the others add a
+        different angle so the candidates actually differ.
+
+        Returns:
+            [{"text", "routing", "latency", "method", "angle", "error"}] in variant order
+
+        Raises:
+            Exception: If every variant failed.
+        """
+        try:
+            from prompts import PRESS_RELEASE_VARIANT_ANGLES, build_variant_prompt
+        except ImportError:
+            from .prompts import PRESS_RELEASE_VARIANT_ANGLES, build_variant_prompt
+
+        messages, models_to_try = self._press_release_request(user_prompt, model, models)
+        models_to_try = self._with_fallbacks(models_to_try)
+        user_id = current_llm_user()
+        variants = []
+
+        order, decision = self._route(models_to_try, messages, "press_release")
+        if n > 1 and any(order[0].startswith(prefix) for prefix in self.n_param_models):
+            started = time.monotonic()
+            try:
+                # Один промпт на все варианты - разнообразие за счёт более высокой температуры
+                texts, answered_by = await self._run_models(
+                    messages, order, temperature=0.9, max_tokens=2000, hedge=False,
+                    namespace="press_release", json_mode=True, n=n, user_id=user_id
+                )
+                if isinstance(texts, str):
+                    texts = [texts]
+                latency = round(time.monotonic() - started, 3)
+                variants = [{
+                    "text": text,
+                    "routing": self._route_info(decision, answered_by),
+                    "latency": latency,
+                    "method": "n_parameter",
+                    "angle": None,
+                    "error": None
+                } for text in texts[:n]]
+            except LLMOverloadedError:
+                raise
+            except Exception as e:
+                logger.warning(f"Variants via n parameter failed, generating concurrently: {str(e)}")
+
+        async def generate_variant(index: int) -> dict:
+            angle = PRESS_RELEASE_VARIANT_ANGLES[(index - 1) % len(PRESS_RELEASE_VARIANT_ANGLES)] if index else None
+            route = {}
+            started = time.monotonic()
+            text = await self.generate_press_release(
+                build_variant_prompt(user_prompt, angle) if angle else user_prompt,
+                models=models_to_try,
+                route=route
+            )
+            return {
+                "text": text,
+                "routing": route,
+                "latency": round(time.monotonic() - started, 3),
+                "method": "concurrent",
+                "angle": angle,
+                "error": None
+            }
+
+        missing = range(len(variants), n)
+        results = await asyncio.gather(*(generate_variant(i) for i in missing), return_exceptions=True)
+        errors = []
+        for result in results:
+            if isinstance(result, BaseException):
+                errors.append(result)
+                variants.append({
+                    "text": None, "routing": None, "latency": None,
+                    "method": "concurrent", "angle": None, "error": str(result)
+                })
+            else:
+                variants.append(result)
+
+        if errors and len(errors) == len(variants):
+            raise errors[0]
+        return variants
+
+    async def stream_press_release(
+        self, user_prompt: str, model: str = None, models: list = None, route: dict = None
+    ) -> AsyncIterator[str]:
+        """
+        Streaming variant of generate_press_release: yields text deltas as the provider sends them.
+
+        route (if given) is filled with the routing decision before the first delta
+        and updated with the model that actually streamed the answer.
+
+        Falls back to the next model only if the current one fails before the first
+        token; a failure mid-stream is raised to the caller. The full text is stored
+        in the response cache, and a cache hit is yielded as a single chunk.
+
+        Raises:
+            LLMOverloadedError: No admission slot freed up in time.
+            Exception: If all models fail.
+        """
+        messages, models_to_try = self._press_release_request(user_prompt, model, models)
+        models_to_try = self._with_fallbacks(models_to_try)
+        user_id = current_llm_user()
+        temperature = 0.7
+
+        cache_key = None
+        ttl = CACHE_TTLS.get("press_release", 0) if self.cache else 0
+        if ttl > 0:
+            # Те же параметры, что у generate_press_release: поток и обычный запрос делят кэш
+            cache_key = make_cache_key(
+                models_to_try, messages[0]["content"], messages[-1]["content"], temperature,
+                2000, True, "press_release"
+            )
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Cache hit for press_release stream ({cache_key[:12]})")
+                if route is not None:
+                    route.update({"model": None, "preferred": models_to_try[0], "reason": "cache"})
+                yield cached
+                return
 
         last_error = None
+        order, decision = self._route(models_to_try, messages, "press_release")
 
-        for i, model_to_try in enumerate(models_to_try):
+        for i, model_to_try in enumerate(order):
+            received = []
+            usage = None
+            breaker = self.breakers.get(model_to_try)
+            if not breaker.allow_request():
+                logger.warning(f"Skipping {model_to_try}: circuit breaker is open")
+                continue
+            started = time.monotonic()
             try:
-                logger.info(f"Trying model {i+1}/{len(models_to_try)}: {model_to_try}")
+                logger.info(f"Streaming from model {i+1}/{len(order)}: {model_to_try}")
+                if route is not None:
+                    route.update(self._route_info(decision, model_to_try))
 
-                completion = await self.client.chat.completions.create(
-                    extra_headers=self.headers,
-                    model=model_to_try,
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=2000  # Увеличено для пресс-релизов
-                )
+                async with self.limiter.slot():
+                    started = time.monotonic()
+                    stream = await self._create_completion(
+                        model_to_try,
+                        json_mode=True,
+                        timeout_kind="stream",
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=2000,
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+
+                    async for chunk in stream:
+                        if chunk.usage:
+                            usage = chunk.usage
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            received.append(delta)
+                            yield delta
 
-                generated_text = completion.choices[0].message.content.strip()
-                logger.info(f"Successfully received response from {model_to_try}")
+                generated_text = "".join(received).strip()
+                latency = time.monotonic() - started
+                breaker.record_success(latency)
+                self._record_route_sample(model_to_try, "press_release", messages, latency, ok=True)
+                self.metrics.record(LLMCallRecord(
+                    model=model_to_try, outcome="success", latency=latency, attempt=i,
+                    namespace="press_release", streamed=True, user_id=user_id,
+                    **usage_from_completion(usage)
+                ))
+                logger.info(f"Stream from {model_to_try} completed ({len(generated_text)} chars)")
 
-                return generated_text
+                if cache_key and generated_text:
+                    await self.cache.set(cache_key, generated_text, ttl)
+                return
 
+            except LLMOverloadedError:
+                breaker.release()
+                raise
             except Exception as e:
-                logger.error(f"Error with model {model_to_try}: {str(e)}")
+                latency = time.monotonic() - started
+                breaker.record_failure(latency)
+                self._record_route_sample(model_to_try, "press_release", messages, latency, ok=False)
+                self.metrics.record(LLMCallRecord(
+                    model=model_to_try, outcome="error", latency=latency, attempt=i,
+                    namespace="press_release", streamed=True, user_id=user_id,
+                    **usage_from_completion(usage)
+                ))
+                logger.error(f"Error streaming from model {model_to_try}: {str(e)}")
+                if received:
+                    raise
                 last_error = e
+            except BaseException:
+                # Клиент закрыл поток - результат модели неизвестен
+                breaker.release()
+                self.metrics.record(LLMCallRecord(
+                    model=model_to_try, outcome="cancelled", latency=time.monotonic() - started,
+                    attempt=i, namespace="press_release", streamed=True, user_id=user_id,
+                    **usage_from_completion(usage)
+                ))
+                raise
 
-        # If we get here, all models failed
+        if last_error is None:
+            raise Exception(f"Model failed: all models unavailable (circuit open): {', '.join(models_to_try)}")
         logger.error(f"All models failed. Last error: {str(last_error)}")
         raise Exception(f"Model failed: {str(last_error)}")
 
-    async def improve_text(self, user_prompt: str, system_prompt: str = None, model: str = None):
+    async def improve_text(
+        self,
+        user_prompt: str,
+        system_prompt: str = None,
+        model: str = None,
+        cache_namespace: str = "improve_text",
+        json_mode: bool = False,
+        route: dict = None
+    ):
         """
         Улучшает текст (проверка грамматики или переписывание)
-        """
-        model_mapping = {
-            "deepseek": "google/gemini-3-flash-preview",
-            "gemini": "google/gemini-3-flash-preview",
-            "gpt4": "openai/gpt-4-turbo-preview",
-            "gpt35": "openai/gpt-3.5-turbo",
-            "claude": "anthropic/claude-2",
-        }
 
-        models_to_try = []
+        cache_namespace задаёт TTL кэша ответов (improve_text, media_relevance).
+        json_mode запрашивает у модели ответ строго в формате JSON.
+        route (если передан) заполняется моделью, которая ответила, и причиной выбора.
+        """
         if isinstance(model, list):
-            for m in model:
-                mapped_model = model_mapping.get(m, m)
-                models_to_try.append(mapped_model)
-        elif model:
-            primary_model = model_mapping.get(model, self.default_model)
-            models_to_try = [primary_model]
+            models_to_try = [
+                resolve_model(m, self.default_model, self.allowed_models, IMPROVE_TEXT_MODEL_ALIASES) for m in model
+            ]
         else:
-            models_to_try = [self.default_model]
+            models_to_try = [
+                resolve_model(model, self.default_model, self.allowed_models, IMPROVE_TEXT_MODEL_ALIASES)
+            ]
 
         # Используем специальный системный промпт для улучшения текста
         if system_prompt is None:
@@ -127,29 +781,14 @@ class OpenRouterClient:
             {"role": "user", "content": user_prompt}
         ]
 
-        last_error = None
-
-        for i, model_to_try in enumerate(models_to_try):
-            try:
-                logger.info(f"Trying model {i+1}/{len(models_to_try)}: {model_to_try}")
-
-                completion = await self.client.chat.completions.create(
-                    extra_headers=self.headers,
-                    model=model_to_try,
-                    messages=messages,
-                    temperature=0.3,  # Более низкая температура для точности
-                    max_tokens=3000
-                )
-
-                generated_text = completion.choices[0].message.content.strip()
-                logger.info(f"Successfully received response from {model_to_try}")
-
-                return generated_text
-
-            except Exception as e:
-                logger.error(f"Error with model {model_to_try}: {str(e)}")
-                last_error = e
-
-        # If we get here, all models failed
-        logger.error(f"All models failed. Last error: {str(last_error)}")
-        raise Exception(f"Model failed: {str(last_error)}")
+        text, info = await self._complete(
+            messages,
+            models_to_try,
+            temperature=0.3,  # Более низкая температура для точности
+            max_tokens=3000,
+            cache_namespace=cache_namespace,
+            json_mode=json_mode
+        )
+        if route is not None:
+            route.update(info)
+        return text
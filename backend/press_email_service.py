@@ -2,19 +2,246 @@
 Сервис для отправки пресс-релизов по email через SMTP
 """
 import os
+import base64
 import logging
+import mimetypes
+import threading
 import aiosmtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from typing import Optional, List
+from collections import OrderedDict
+from email import policy
+from email.message import MIMEPart
+from email.utils import formatdate, make_msgid
+from typing import Optional, List, Tuple, Union
 from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Письма сериализуются с CRLF и кодированием заголовков по RFC 2047/2231
+SMTP_POLICY = policy.SMTP
+
+
+class InvalidHeaderError(ValueError):
+    """Значение заголовка письма содержит перевод строки (подстановка заголовков)"""
+
+
+def _fold_headers(headers: List[Tuple[str, str]]) -> bytes:
+    """
+    Заголовки в байты (не-ASCII значения кодируются, длинные строки переносятся)
+
+    Raises:
+        InvalidHeaderError: В значении есть CR или LF - иначе, например, тема письма
+            из заголовка пресс-релиза могла бы добавить в письмо свои заголовки
+    """
+    folded = []
+    for name, value in headers:
+        if "\r" in value or "\n" in value:
+            raise InvalidHeaderError(f"Недопустимый перевод строки в заголовке {name}")
+        if value.isascii() and len(name) + len(value) < 76:
+            # Короткие ASCII заголовки (To, Message-ID, Date) пишутся как есть
+            folded.append(f"{name}: {value}\r\n".encode("ascii"))
+        else:
+            folded.append(SMTP_POLICY.header_factory(name, value).fold(policy=SMTP_POLICY).encode("ascii"))
+    return b"".join(folded)
+
+
+def _base64_body(text: str) -> bytes:
+    """UTF-8 текст в base64 строками по 76 символов с CRLF"""
+    return base64.encodebytes(text.encode("utf-8")).replace(b"\n", b"\r\n")
+
+
+def estimate_message_size(html_content: str, text_content: str, attachment_sizes: Optional[List[int]] = None) -> int:
+    """
+    Оценка размера письма в байтах без чтения вложений: base64 увеличивает данные
+    в 4/3 раза плюс CRLF на каждые 76 символов, ~1 КБ на заголовки и разделители
+    """
+    def encoded(size: int) -> int:
+        base64_size = (size + 2) // 3 * 4
+        return base64_size + base64_size // 76 * 2
+
+    size = 1024
+    size += encoded(len(html_content.encode("utf-8"))) + encoded(len(text_content.encode("utf-8")))
+    for attachment_size in attachment_sizes or []:
+        size += encoded(attachment_size) + 256
+    return size
+
+
+class _AttachmentCache:
+    """
+    LRU кэш закодированных MIME частей вложений с лимитом по байтам
+
+    Файлы хранятся по sha256, поэтому одно вложение в нескольких рассылках -
+    один и тот же путь; ключ (путь, имя, размер, mtime) кодирует его один раз.
+    Подготовка писем идёт в потоках (asyncio.to_thread) - доступ под блокировкой.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        with self._lock:
+            part = self._entries.get(key)
+            if part is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return part
+
+    def put(self, key: tuple, part: bytes):
+        if len(part) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = part
+            self._size += len(part)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+attachment_cache = _AttachmentCache(int(os.getenv("ATTACHMENT_CACHE_BYTES", str(64 * 1024 * 1024))))
+
+
+def _encode_attachment(file_path_obj: Path, filename: str) -> Tuple[bytes, int]:
+    """MIME часть вложения в байтах (из кэша или с чтением файла) и размер файла"""
+    stat = file_path_obj.stat()
+    key = (str(file_path_obj), filename, stat.st_size, stat.st_mtime_ns)
+    part_bytes = attachment_cache.get(key)
+    if part_bytes is None:
+        part = MIMEPart(policy=SMTP_POLICY)
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        maintype, subtype = content_type.split("/", 1)
+        part.set_content(file_path_obj.read_bytes(), maintype=maintype, subtype=subtype, filename=filename)
+        part_bytes = part.as_bytes(policy=SMTP_POLICY)
+        attachment_cache.put(key, part_bytes)
+    return part_bytes, stat.st_size
+
+
+def _boundary(kind: str) -> str:
+    return make_msgid(domain=kind).strip("<>").replace("@", "=_")
+
+
+class PreparedMessage:
+    """
+    Письмо рассылки, собранное один раз для всех получателей
+
+    Общие заголовки (From, Subject, Reply-To) и вложения кодируются в байты
+    при подготовке. Письмо получателя - склейка готовых байтов с его заголовками
+    (To, Message-ID, Date) и частью multipart/alternative; она кодируется
+    заново только если HTML/текст отличаются от предыдущего получателя.
+
+    Структура: multipart/mixed (alternative: text + html, затем вложения),
+    без вложений - multipart/alternative.
+
+    Вложение - путь к файлу или пара (путь, имя файла в письме); закодированные
+    вложения берутся из attachment_cache и общие для рассылок.
+    """
+
+    def __init__(
+            self,
+            subject: str,
+            from_header: str,
+            reply_to: str,
+            attachments: Optional[List[Union[str, Tuple[str, str]]]] = None
+    ):
+        self.from_domain = reply_to.rsplit("@", 1)[-1]
+        self.attachment_names: List[str] = []
+        self.attachments_size = 0
+        self._alternative: Optional[Tuple[str, str, bytes]] = None
+
+        attachment_parts = []
+        for attachment in attachments or []:
+            file_path, filename = attachment if isinstance(attachment, tuple) else (attachment, None)
+            file_path_obj = Path(file_path)
+            if not file_path_obj.is_file():
+                continue
+            filename = filename or file_path_obj.name
+            try:
+                part_bytes, size = _encode_attachment(file_path_obj, filename)
+                attachment_parts.append(part_bytes)
+                self.attachment_names.append(filename)
+                self.attachments_size += size
+                logger.info(f"📎 Прикреплен файл: {filename}")
+            except Exception as e:
+                logger.error(f"❌ Ошибка прикрепления файла {file_path}: {str(e)}")
+
+        common_headers = [
+            ("Subject", subject),
+            ("From", from_header),
+            ("Reply-To", reply_to),
+            ("MIME-Version", "1.0"),
+        ]
+        # Заголовки и разделители части alternative одинаковы для всех получателей
+        alternative_boundary = _boundary("alternative")
+        self._alternative_head = (
+            f'Content-Type: multipart/alternative; boundary="{alternative_boundary}"\r\n\r\n'
+            f'--{alternative_boundary}\r\n'
+            'Content-Type: text/plain; charset="utf-8"\r\n'
+            'Content-Transfer-Encoding: base64\r\n\r\n'
+        ).encode("ascii")
+        self._alternative_middle = (
+            f'\r\n--{alternative_boundary}\r\n'
+            'Content-Type: text/html; charset="utf-8"\r\n'
+            'Content-Transfer-Encoding: base64\r\n\r\n'
+        ).encode("ascii")
+        self._alternative_end = f"\r\n--{alternative_boundary}--\r\n".encode("ascii")
+
+        if attachment_parts:
+            self._boundary = _boundary("mixed")
+            common_headers.append(("Content-Type", f'multipart/mixed; boundary="{self._boundary}"'))
+            delimiter = f"\r\n--{self._boundary}\r\n".encode("ascii")
+            self._attachments_bytes = delimiter + delimiter.join(attachment_parts)
+            self._closing = f"\r\n--{self._boundary}--\r\n".encode("ascii")
+        else:
+            self._boundary = None
+        self._common_head = _fold_headers(common_headers)
+
+    def _alternative_bytes(self, html_content: str, text_content: str) -> bytes:
+        cached = self._alternative
+        if cached and cached[0] == html_content and cached[1] == text_content:
+            return cached[2]
+        data = b"".join((
+            self._alternative_head, _base64_body(text_content),
+            self._alternative_middle, _base64_body(html_content),
+            self._alternative_end,
+        ))
+        self._alternative = (html_content, text_content, data)
+        return data
+
+    def message_size(self, html_content: str, text_content: str) -> int:
+        """Точный размер письма (для получателя с типичным адресом)"""
+        return len(self.render("recipient@example.com", html_content, text_content))
+
+    def render(self, to_email: str, html_content: str, text_content: str) -> bytes:
+        """Байты письма для получателя"""
+        recipient_head = _fold_headers([
+            ("To", to_email),
+            ("Message-ID", make_msgid(domain=self.from_domain)),
+            ("Date", formatdate(localtime=True)),
+        ])
+        alternative = self._alternative_bytes(html_content, text_content)
+        if self._boundary is None:
+            # Заголовки части alternative становятся заголовками письма
+            return b"".join((self._common_head, recipient_head, alternative))
+        return b"".join((
+            self._common_head, recipient_head, b"\r\n",
+            f"--{self._boundary}\r\n".encode("ascii"), alternative,
+            self._attachments_bytes, self._closing,
+        ))
+
 
 class PressReleaseEmailService:
     """Сервис для отправки пресс-релизов по email"""
@@ -27,6 +254,8 @@ class PressReleaseEmailService:
         self.smtp_password = os.getenv("SMTP_PASSWORD", "danmyj-winHoq-6nagby")
         self.from_email = os.getenv("FROM_EMAIL", "info@pressreach.ru")
         self.from_name = os.getenv("FROM_NAME", "PressReach")
+        # Лимит размера письма на relay (SIZE в EHLO), по умолчанию 25 МБ
+        self.max_message_size = int(os.getenv("SMTP_MAX_MESSAGE_SIZE", str(25 * 1024 * 1024)))
 
     async def send_press_release(
             self,
@@ -45,53 +274,51 @@ class PressReleaseEmailService:
             subject: Тема письма (заголовок пресс-релиза)
             html_content: HTML версия пресс-релиза
             text_content: Текстовая версия пресс-релиза
-            attachments: Список путей к файлам для прикрепления
+            attachments: Список путей к файлам (или пар путь, имя файла) для прикрепления
             company_name: Название компании (для красивого отображения From)
 
         Returns:
             bool: True если отправка успешна, False если ошибка
         """
         try:
-            # Создаем сообщение
-            message = MIMEMultipart("alternative")
-            message["Subject"] = subject
-
-            # Устанавливаем красивое имя отправителя
-            if company_name:
-                message["From"] = f"{company_name} <{self.from_email}>"
-            else:
-                message["From"] = f"{self.from_name} <{self.from_email}>"
-
-            message["To"] = to_email
-            message["Reply-To"] = self.from_email
-
-            # Добавляем текстовую версию
-            text_part = MIMEText(text_content, "plain", "utf-8")
-            message.attach(text_part)
-
-            # Добавляем HTML версию
-            html_part = MIMEText(html_content, "html", "utf-8")
-            message.attach(html_part)
-
-            # Добавляем вложения (файлы пресс-релиза)
-            if attachments:
-                for file_path in attachments:
-                    file_path_obj = Path(file_path)
-                    if file_path_obj.is_file():
-                        try:
-                            with open(file_path, "rb") as attachment_file:
-                                part = MIMEBase("application", "octet-stream")
-                                part.set_payload(attachment_file.read())
-
-                            encoders.encode_base64(part)
-                            part.add_header(
-                                "Content-Disposition",
-                                f"attachment; filename={file_path_obj.name}",
-                            )
-                            message.attach(part)
-                            logger.info(f"📎 Прикреплен файл: {file_path_obj.name}")
-                        except Exception as e:
-                            logger.error(f"❌ Ошибка прикрепления файла {file_path}: {str(e)}")
+            prepared = self.prepare_message(subject, attachments, company_name)
+        except Exception as e:
+            logger.error(f"❌ Ошибка подготовки письма для {to_email}: {str(e)}")
+            return False
+        return await self.send_prepared(prepared, to_email, html_content, text_content)
+
+    def prepare_message(
+            self,
+            subject: str,
+            attachments: Optional[List[Union[str, Tuple[str, str]]]] = None,
+            company_name: Optional[str] = None
+    ) -> PreparedMessage:
+        """
+        Готовит письмо рассылки: общие заголовки и вложения кодируются один раз.
+        Читает файлы вложений - из async кода вызывать через asyncio.to_thread.
+
+        Raises:
+            InvalidHeaderError: Тема или имя отправителя содержат перевод строки
+        """
+        # Устанавливаем красивое имя отправителя
+        from_header = f"{company_name or self.from_name} <{self.from_email}>"
+        return PreparedMessage(subject, from_header, self.from_email, attachments)
+
+    async def send_prepared(
+            self,
+            prepared: PreparedMessage,
+            to_email: str,
+            html_content: str,
+            text_content: str
+    ) -> bool:
+        """
+        Отправка подготовленного письма одному получателю
+
+        Returns:
+            bool: True если отправка успешна, False если ошибка
+        """
+        try:
+            message = prepared.render(to_email, html_content, text_content)
 
             # Отправляем email
             # Для порта 465 используем use_tls=True (SSL)
@@ -101,6 +328,8 @@ class PressReleaseEmailService:
 
             await aiosmtplib.send(
                 message,
+                sender=self.from_email,
+                recipients=[to_email],
                 hostname=self.smtp_server,
                 port=self.smtp_port,
                 use_tls=use_tls,
@@ -120,6 +349,20 @@ class PressReleaseEmailService:
             logger.error(f"❌ Ошибка отправки пресс-релиза на {to_email}: {str(e)}")
             return False
 
+    def size_report(self, message_size: int) -> dict:
+        """Размер письма рассылки и предупреждение о превышении лимита relay"""
+        report = {
+            "message_size_bytes": message_size,
+            "max_message_size_bytes": self.max_message_size,
+            "exceeds_limit": message_size > self.max_message_size,
+        }
+        if report["exceeds_limit"]:
+            logger.warning(
+                f"⚠️ Размер письма {message_size / 1024 / 1024:.1f} МБ превышает лимит SMTP "
+                f"{self.max_message_size / 1024 / 1024:.1f} МБ"
+            )
+        return report
+
     async def test_connection(self) -> bool:
         """
         Проверка подключения к SMTP серверу
@@ -1,5 +1,8 @@
 from enum import Enum
+from functools import lru_cache
 import logging
+import re
+import textwrap
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +26,21 @@ TEXT_IMPROVEMENT_SYSTEM_PROMPT = """
 Твоя задача - улучшать тексты, сохраняя их смысл и авторский стиль, но делая их более профессиональными.
 """
 
+_CYRILLIC_RE = re.compile(r"[\u0400-\u04FF]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая локальная оценка числа токенов без токенизатора модели.
+    Кириллица в BPE-токенизаторах занимает примерно 1 токен на 2.5 символа,
+    латиница и прочее - около 1 токена на 4 символа.
+    """
+    if not text:
+        return 0
+    cyrillic = len(_CYRILLIC_RE.findall(text))
+    return int(cyrillic / 2.5 + (len(text) - cyrillic) / 4) + 1
+
+
 class PressReleaseType(Enum):
     PRODUCT_LAUNCH = "product_launch"
     COMPANY_NEWS = "company_news"
@@ -48,67 +66,54 @@ class WritingStyle(Enum):
     CONCISE = "concise"  # Краткий и лаконичный
 
 
-def build_prompt_for_press_release(press_release_data: dict) -> str:
-    """
-    Создает промпт для генерации пресс-релиза на основе входных данных
-    """
-    logger.info(f"Сборка промпта для пресс-релиза: {press_release_data.get('type')}")
-
-    release_type = press_release_data.get('type', PressReleaseType.COMPANY_NEWS.value)
-    company_name = press_release_data.get('company_name', '')
-    news_summary = press_release_data.get('news_summary', '')
-    target_audience = press_release_data.get('target_audience', 'Широкая аудитория')
-    key_messages = press_release_data.get('key_messages', [])
-    quotes = press_release_data.get('quotes', [])
-    contact_person = press_release_data.get('contact_person', '')
-    additional_info = press_release_data.get('additional_info', '')
+# ==================== СТАТИЧЕСКИЕ ФРАГМЕНТЫ ====================
+# Собираются один раз при импорте; на запрос подставляются только данные пользователя.
 
-    base_prompt = f"""
+_PRESS_RELEASE_HEADER = textwrap.dedent("""
     Создай профессиональный пресс-релиз со следующими параметрами:
     - Компания: {company_name}
     - Тип новости: {release_type}
     - Краткое описание новости: {news_summary}
     - Целевая аудитория: {target_audience}
-    - Ключевые сообщения: {', '.join(key_messages) if key_messages else 'Не указаны'}
+    - Ключевые сообщения: {key_messages}
     - Дополнительная информация: {additional_info}
 
     Пресс-релиз должен быть структурированным, привлекательным для журналистов и содержать всю необходимую информацию.
-    """
+""")
 
-    if release_type == PressReleaseType.PRODUCT_LAUNCH.value:
-        specific_prompt = """
+_PRESS_RELEASE_TYPE_INSTRUCTIONS = {
+    PressReleaseType.PRODUCT_LAUNCH.value: textwrap.dedent("""
         Это пресс-релиз о запуске нового продукта. Обязательно включи:
         - Описание продукта и его уникальных характеристик
         - Преимущества для пользователей
         - Информацию о доступности и ценах (если указана)
         - Цитату представителя компании о значимости запуска (если есть в запросе)
-        """
-    elif release_type == PressReleaseType.FUNDING.value:
-        specific_prompt = """
+    """),
+    PressReleaseType.FUNDING.value: textwrap.dedent("""
         Это пресс-релиз о привлечении инвестиций. Обязательно включи:
         - Размер привлеченного финансирования
         - Информацию об инвесторах
         - Планы по использованию средств
         - Цитаты руководства о планах развития (если есть в запросе)
-        """
-    elif release_type == PressReleaseType.PARTNERSHIP.value:
-        specific_prompt = """
+    """),
+    PressReleaseType.PARTNERSHIP.value: textwrap.dedent("""
         Это пресс-релиз о партнерстве. Обязательно включи:
         - Информацию о партнерах
         - Цели и выгоды партнерства
         - Планируемые совместные проекты
         - Цитаты представителей обеих сторон (если есть в запросе)
-        """
-    else:
-        specific_prompt = """
-        Создай пресс-релиз, следуя стандартной структуре:
-        - Привлекательный заголовок
-        - Информативный лид-абзац
-        - Подробности в основном тексте
-        - Релевантные цитаты (если есть в запросе)
-        """
+    """),
+}
+
+_PRESS_RELEASE_DEFAULT_INSTRUCTIONS = textwrap.dedent("""
+    Создай пресс-релиз, следуя стандартной структуре:
+    - Привлекательный заголовок
+    - Информативный лид-абзац
+    - Подробности в основном тексте
+    - Релевантные цитаты (если есть в запросе)
+""")
 
-    json_format_prompt = """
+_PRESS_RELEASE_JSON_FORMAT = textwrap.dedent("""
 
     Твой ответ должен быть только в формате JSON. Пример структуры:
     {
@@ -125,15 +130,215 @@ def build_prompt_for_press_release(press_release_data: dict) -> str:
         "contact_info": "Контактная информация для СМИ",
         "boilerplate": "Краткая информация о компании"
     }
+""")
+
+# Отметка о том, что текст пользователя сокращён под бюджет промпта
+TRIM_MARKER = " [...]"
+
+# Меньше этого news_summary не сокращается: без сути новости модели не из чего писать релиз
+NEWS_SUMMARY_MIN_TOKENS = 200
+
+
+class PromptBudgetError(ValueError):
+    """Промпт не укладывается в бюджет токенов даже после сокращения полей"""
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Сокращает текст до max_tokens (по оценке estimate_tokens).
+    Начало текста сохраняется целыми предложениями - в нём обычно главное;
+    если не помещается даже первое предложение, оно обрезается по границе слова.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+
+    kept = ""
+    for match in _SENTENCE_END_RE.finditer(text):
+        candidate = text[:match.start()]
+        if estimate_tokens(candidate + TRIM_MARKER) > max_tokens:
+            break
+        kept = candidate
+    if not kept:
+        low, high = 0, len(text)
+        # Бинарный поиск по длине префикса, оценка токенов монотонна по длине
+        while low < high:
+            middle = (low + high + 1) // 2
+            if estimate_tokens(text[:middle] + TRIM_MARKER) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        kept = text[:low]
+        # Не режем слово посередине, если в префиксе есть пробел
+        if " " in kept.strip():
+            kept = kept.rstrip().rsplit(" ", 1)[0]
+    return kept + TRIM_MARKER
+
+
+def _fill_report(report: dict, prompt: str, max_tokens: int, trimmed: list):
+    if report is not None:
+        report.update({
+            "prompt_tokens": estimate_tokens(prompt),
+            "budget": max_tokens,
+            "trimmed_fields": trimmed,
+        })
+
+
+def build_prompt_for_press_release(press_release_data: dict, max_tokens: int = None, report: dict = None) -> str:
     """
+    Создает промпт для генерации пресс-релиза на основе входных данных
 
-    full_prompt = base_prompt + specific_prompt + json_format_prompt
+    Args:
+        press_release_data: Данные запроса
+        max_tokens: Бюджет промпта; при превышении сокращаются additional_info, затем news_summary
+            (не короче NEWS_SUMMARY_MIN_TOKENS)
+        report: Если передан, заполняется оценкой prompt_tokens и списком сокращённых полей
 
-    logger.info(f"Промпт для пресс-релиза создан")
+    Raises:
+        PromptBudgetError: Остальные поля запроса сами по себе не укладываются в max_tokens
+    """
+    logger.info(f"Сборка промпта для пресс-релиза: {press_release_data.get('type')}")
+
+    release_type = press_release_data.get('type', PressReleaseType.COMPANY_NEWS.value)
+    key_messages = press_release_data.get('key_messages', [])
+    fields = {
+        "company_name": press_release_data.get('company_name', ''),
+        "release_type": release_type,
+        "news_summary": press_release_data.get('news_summary', ''),
+        "target_audience": press_release_data.get('target_audience', 'Широкая аудитория'),
+        "key_messages": ', '.join(key_messages) if key_messages else 'Не указаны',
+        "additional_info": press_release_data.get('additional_info', ''),
+    }
+    instructions = _PRESS_RELEASE_TYPE_INSTRUCTIONS.get(release_type, _PRESS_RELEASE_DEFAULT_INSTRUCTIONS)
+
+    def render() -> str:
+        return _PRESS_RELEASE_HEADER.format(**fields) + instructions + _PRESS_RELEASE_JSON_FORMAT
+
+    full_prompt = render()
+    trimmed = []
+    if max_tokens:
+        # Сначала сокращается менее важное поле
+        for field in ("additional_info", "news_summary"):
+            excess = estimate_tokens(full_prompt) - max_tokens
+            if excess <= 0:
+                break
+            if not fields[field]:
+                continue
+            field_budget = estimate_tokens(fields[field]) - excess
+            if field == "news_summary":
+                field_budget = max(field_budget, NEWS_SUMMARY_MIN_TOKENS)
+            trimmed_value = trim_to_tokens(fields[field], field_budget)
+            if trimmed_value == fields[field]:
+                continue
+            fields[field] = trimmed_value
+            trimmed.append(field)
+            full_prompt = render()
+        prompt_tokens = estimate_tokens(full_prompt)
+        if prompt_tokens > max_tokens:
+            raise PromptBudgetError(
+                f"Данные запроса слишком большие: промпт ~{prompt_tokens} токенов при лимите {max_tokens}. "
+                f"Сократите ключевые сообщения или целевую аудиторию"
+            )
+        if trimmed:
+            logger.warning(f"Промпт пресс-релиза сокращён до бюджета {max_tokens} токенов: {', '.join(trimmed)}")
+
+    _fill_report(report, full_prompt, max_tokens, trimmed)
+    logger.info(f"Промпт для пресс-релиза создан (~{estimate_tokens(full_prompt)} токенов)")
     return full_prompt
 
 
-def build_prompt_for_text_improvement(text: str, mode: str, style: str = None) -> str:
+# Подача для дополнительных вариантов пресс-релиза (первый вариант - без изменений)
+PRESS_RELEASE_VARIANT_ANGLES = [
+    "акцент на выгоде для клиентов и пользователей",
+    "акцент на цифрах, фактах и результатах",
+    "яркий, запоминающийся заголовок и более живая подача",
+]
+
+
+def build_variant_prompt(prompt: str, angle: str) -> str:
+    """Промпт альтернативного варианта пресс-релиза с другой подачей"""
+    return prompt + f"""
+
+    АЛЬТЕРНАТИВНЫЙ ВАРИАНТ:
+    Подготовь альтернативную версию этого пресс-релиза: {angle}.
+    Заголовок и лид должны заметно отличаться от стандартной подачи, факты - остаться теми же.
+    """
+
+
+_GRAMMAR_TEMPLATE = textwrap.dedent("""
+    Твоя задача - проверить и исправить грамматические, орфографические и пунктуационные ошибки в тексте.
+
+    ВАЖНО:
+    - Сохрани исходный смысл и структуру текста
+    - Исправь только явные ошибки
+    - НЕ меняй стиль изложения
+    - НЕ добавляй новую информацию
+    - НЕ удаляй важные детали
+    - Исправь опечатки, грамматические и пунктуационные ошибки
+
+    Исходный текст:
+    ```
+    {text}
+    ```
+
+    Верни результат в формате JSON:
+    {{
+        "original_text": "исходный текст",
+        "improved_text": "исправленный текст",
+        "errors_found": [
+            {{
+                "type": "тип ошибки (грамматика/пунктуация/орфография)",
+                "original": "ошибочный фрагмент",
+                "corrected": "исправленный фрагмент",
+                "explanation": "объяснение исправления"
+            }}
+        ],
+        "summary": "краткое описание сделанных исправлений"
+    }}
+""")
+
+_REWRITE_TEMPLATE = textwrap.dedent("""
+    Твоя задача - переписать текст в стиле: {style_description}
+
+    ВАЖНО:
+    - Сохрани основной смысл и ключевые факты
+    - Адаптируй стиль изложения под указанный формат
+    - Улучши читаемость и структуру
+    - Исправь все грамматические ошибки
+    - Сделай текст более профессиональным
+
+    Исходный текст:
+    ```
+    {text}
+    ```
+
+    Верни результат в формате JSON:
+    {{
+        "original_text": "исходный текст",
+        "rewritten_text": "переписанный текст",
+        "style_applied": "{style}",
+        "key_changes": [
+            "описание ключевых изменений"
+        ],
+        "summary": "краткое описание проделанной работы"
+    }}
+""")
+
+_STYLE_DESCRIPTIONS = {
+    WritingStyle.FORMAL.value: "Официальный, формальный стиль для документов и официальных сообщений",
+    WritingStyle.BUSINESS.value: "Деловой стиль для корпоративной переписки и бизнес-коммуникаций",
+    WritingStyle.CASUAL.value: "Неформальный, дружественный стиль для блогов и социальных сетей",
+    WritingStyle.JOURNALISTIC.value: "Журналистский стиль для новостных статей и пресс-релизов",
+    WritingStyle.ACADEMIC.value: "Академический стиль для научных работ и исследований",
+    WritingStyle.MARKETING.value: "Маркетинговый стиль с призывами к действию и эмоциональным воздействием",
+    WritingStyle.CONCISE.value: "Краткий и лаконичный стиль без лишних деталей"
+}
+
+
+def build_prompt_for_text_improvement(text: str, mode: str, style: str = None, report: dict = None) -> str:
     """
     Создает промпт для улучшения текста
 
@@ -141,114 +346,35 @@ def build_prompt_for_text_improvement(text: str, mode: str, style: str = None) -
         text: Исходный текст для улучшения
         mode: Режим работы (grammar или rewrite)
         style: Стиль для переписывания (если mode=rewrite)
+        report: Если передан, заполняется оценкой prompt_tokens
+
+    Длинные тексты не сокращаются: их делит на части вызывающий код (text_chunking).
     """
     logger.info(f"Сборка промпта для улучшения текста, режим: {mode}")
 
     if mode == ImprovementMode.GRAMMAR.value:
-        task_prompt = """
-        Твоя задача - проверить и исправить грамматические, орфографические и пунктуационные ошибки в тексте.
-
-        ВАЖНО:
-        - Сохрани исходный смысл и структуру текста
-        - Исправь только явные ошибки
-        - НЕ меняй стиль изложения
-        - НЕ добавляй новую информацию
-        - НЕ удаляй важные детали
-        - Исправь опечатки, грамматические и пунктуационные ошибки
-
-        Исходный текст:
-        ```
-        {text}
-        ```
-
-        Верни результат в формате JSON:
-        {{
-            "original_text": "исходный текст",
-            "improved_text": "исправленный текст",
-            "errors_found": [
-                {{
-                    "type": "тип ошибки (грамматика/пунктуация/орфография)",
-                    "original": "ошибочный фрагмент",
-                    "corrected": "исправленный фрагмент",
-                    "explanation": "объяснение исправления"
-                }}
-            ],
-            "summary": "краткое описание сделанных исправлений"
-        }}
-        """.format(text=text)
+        task_prompt = _GRAMMAR_TEMPLATE.format(text=text)
 
     elif mode == ImprovementMode.REWRITE.value:
-        style_descriptions = {
-            WritingStyle.FORMAL.value: "Официальный, формальный стиль для документов и официальных сообщений",
-            WritingStyle.BUSINESS.value: "Деловой стиль для корпоративной переписки и бизнес-коммуникаций",
-            WritingStyle.CASUAL.value: "Неформальный, дружественный стиль для блогов и социальных сетей",
-            WritingStyle.JOURNALISTIC.value: "Журналистский стиль для новостных статей и пресс-релизов",
-            WritingStyle.ACADEMIC.value: "Академический стиль для научных работ и исследований",
-            WritingStyle.MARKETING.value: "Маркетинговый стиль с призывами к действию и эмоциональным воздействием",
-            WritingStyle.CONCISE.value: "Краткий и лаконичный стиль без лишних деталей"
-        }
-
-        style_description = style_descriptions.get(style, "профессиональный")
-
-        task_prompt = """
-        Твоя задача - переписать текст в стиле: {style_description}
-
-        ВАЖНО:
-        - Сохрани основной смысл и ключевые факты
-        - Адаптируй стиль изложения под указанный формат
-        - Улучши читаемость и структуру
-        - Исправь все грамматические ошибки
-        - Сделай текст более профессиональным
-
-        Исходный текст:
-        ```
-        {text}
-        ```
-
-        Верни результат в формате JSON:
-        {{
-            "original_text": "исходный текст",
-            "rewritten_text": "переписанный текст",
-            "style_applied": "{style}",
-            "key_changes": [
-                "описание ключевых изменений"
-            ],
-            "summary": "краткое описание проделанной работы"
-        }}
-        """.format(text=text, style_description=style_description, style=style)
+        style_description = _STYLE_DESCRIPTIONS.get(style, "профессиональный")
+        task_prompt = _REWRITE_TEMPLATE.format(text=text, style_description=style_description, style=style)
 
     else:
         raise ValueError(f"Неизвестный режим: {mode}")
 
+    _fill_report(report, task_prompt, None, [])
     logger.info("Промпт для улучшения текста создан")
     return task_prompt
 
 
-def build_prompt_for_media_selection(text: str, available_categories: list) -> str:
-    """
-    Создает промпт для анализа текста и подбора релевантных категорий СМИ
-
-    Args:
-        text: Текст пресс-релиза для анализа
-        available_categories: Список доступных категорий СМИ с их описаниями
-    """
-    logger.info("Сборка промпта для подбора релевантных СМИ")
-
-    categories_info = "\n".join([
-        f"- {cat['name']}: {cat.get('description', 'Без описания')}"
-        for cat in available_categories
-    ])
-
-    prompt = f"""
+_MEDIA_SELECTION_HEADER = textwrap.dedent("""
     Проанализируй следующий текст пресс-релиза и определи, каким категориям СМИ он будет наиболее интересен.
 
     ТЕКСТ ПРЕСС-РЕЛИЗА:
     ```
-    {text}
-    ```
+""")
 
-    ДОСТУПНЫЕ КАТЕГОРИИ СМИ:
-    {categories_info}
+_MEDIA_SELECTION_INSTRUCTIONS = textwrap.dedent("""
 
     ЗАДАЧА:
     1. Внимательно прочитай текст и определи его основную тематику
@@ -263,18 +389,65 @@ def build_prompt_for_media_selection(text: str, available_categories: list) -> s
     - Приоритизируй категории с наибольшей релевантностью
 
     Верни результат в формате JSON:
-    {{
+    {
         "selected_categories": [
-            {{
+            {
                 "category_name": "название категории",
                 "relevance_score": 8,
                 "reasoning": "объяснение, почему эта категория релевантна"
-            }}
+            }
         ],
         "text_summary": "краткое описание тематики текста (1-2 предложения)",
         "target_audience": "целевая аудитория (журналисты, инвесторы, потребители и т.д.)"
-    }}
+    }
+""")
+
+# Описание категории в промпте ограничено: для выбора хватает первых предложений
+CATEGORY_DESCRIPTION_MAX_TOKENS = 60
+
+
+@lru_cache(maxsize=32)
+def _categories_block(categories: tuple) -> str:
+    """Список категорий для промпта; categories - кортеж (name, description), список меняется редко"""
+    return "\n".join(
+        f"- {name}: {trim_to_tokens(description or 'Без описания', CATEGORY_DESCRIPTION_MAX_TOKENS)}"
+        for name, description in categories
+    )
+
+
+def build_prompt_for_media_selection(
+    text: str,
+    available_categories: list,
+    max_tokens: int = None,
+    report: dict = None
+) -> str:
+    """
+    Создает промпт для анализа текста и подбора релевантных категорий СМИ
+
+    Args:
+        text: Текст пресс-релиза для анализа
+        available_categories: Список доступных категорий СМИ с их описаниями
+        max_tokens: Бюджет промпта; при превышении сокращается текст пресс-релиза
+        report: Если передан, заполняется оценкой prompt_tokens и списком сокращённых полей
     """
+    logger.info("Сборка промпта для подбора релевантных СМИ")
 
-    logger.info("Промпт для подбора СМИ создан")
+    categories_info = _categories_block(tuple(
+        (cat['name'], cat.get('description')) for cat in available_categories
+    ))
+    prefix = _MEDIA_SELECTION_HEADER
+    suffix = "\n```\n\nДОСТУПНЫЕ КАТЕГОРИИ СМИ:\n" + categories_info + _MEDIA_SELECTION_INSTRUCTIONS
+
+    trimmed = []
+    if max_tokens:
+        text_budget = max_tokens - estimate_tokens(prefix) - estimate_tokens(suffix)
+        if estimate_tokens(text) > text_budget:
+            # Для выбора категорий достаточно начала пресс-релиза (заголовок и лид)
+            text = trim_to_tokens(text, max(text_budget, CATEGORY_DESCRIPTION_MAX_TOKENS))
+            trimmed.append("text")
+            logger.warning(f"Текст для подбора СМИ сокращён до бюджета {max_tokens} токенов")
+
+    prompt = prefix + text + suffix
+    _fill_report(report, prompt, max_tokens, trimmed)
+    logger.info(f"Промпт для подбора СМИ создан (~{estimate_tokens(prompt)} токенов)")
     return prompt
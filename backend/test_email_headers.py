@@ -0,0 +1,73 @@
+"""
+Тестирование заголовков подготовленного письма рассылки (без SMTP)
+
+Тема письма - заголовок пресс-релиза от пользователя: переводы строк в ней
+не должны превращаться в дополнительные заголовки письма.
+"""
+import sys
+from email import message_from_bytes, policy
+from pathlib import Path
+
+# Добавляем путь для импортов
+sys.path.append(str(Path(__file__).parent))
+
+from press_email_service import InvalidHeaderError, PreparedMessage
+
+FROM_HEADER = "Компания XYZ <info@pressreach.ru>"
+REPLY_TO = "info@pressreach.ru"
+
+
+def _prepare(subject: str) -> PreparedMessage:
+    return PreparedMessage(subject, FROM_HEADER, REPLY_TO)
+
+
+def _expect_rejected(subject: str):
+    try:
+        _prepare(subject)
+    except InvalidHeaderError:
+        return
+    raise AssertionError(f"Тема {subject!r} должна отклоняться")
+
+
+def test_subject_with_line_breaks_is_rejected():
+    """Короткая ASCII тема (пишется без кодирования) с CRLF/CR/LF"""
+    _expect_rejected("Hi\r\nX-Injected: yes")
+    _expect_rejected("Hi\nX-Injected: yes")
+    _expect_rejected("Hi\rX-Injected: yes")
+
+
+def test_long_and_non_ascii_subject_with_line_breaks_is_rejected():
+    """Темы, которые кодируются через header_factory"""
+    _expect_rejected("Пресс-релиз\r\nX-Injected: yes")
+    _expect_rejected("A" * 100 + "\r\nX-Injected: yes")
+
+
+def test_recipient_with_line_breaks_is_rejected():
+    prepared = _prepare("Пресс-релиз")
+    try:
+        prepared.render("media@example.com\r\nBcc: victim@example.com", "<p>Текст</p>", "Текст")
+    except InvalidHeaderError:
+        return
+    raise AssertionError("Адрес получателя с переводом строки должен отклоняться")
+
+
+def test_regular_subjects_are_single_headers():
+    for subject in ("Hello", "Компания XYZ запускает новый продукт", " ".join(["Launch"] * 20)):
+        message = message_from_bytes(
+            _prepare(subject).render("media@example.com", "<p>Текст</p>", "Текст"),
+            policy=policy.default
+        )
+        assert message["Subject"] == subject, message["Subject"]
+        assert message["To"] == "media@example.com"
+        assert "X-Injected" not in message
+
+
+if __name__ == "__main__":
+    for test in (
+        test_subject_with_line_breaks_is_rejected,
+        test_long_and_non_ascii_subject_with_line_breaks_is_rejected,
+        test_recipient_with_line_breaks_is_rejected,
+        test_regular_subjects_are_single_headers,
+    ):
+        test()
+        print(f"✅ {test.__name__}")
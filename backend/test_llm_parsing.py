@@ -0,0 +1,133 @@
+"""
+Тестирование разбора ответов LLM без обращения к модели
+
+- потоковый разбор полей JSON (JSONFieldStreamParser);
+- восстановление JSON от модели (repair_json, parse_llm_json);
+- деление длинного текста на части и сборка обратно (text_chunking).
+"""
+import json
+import sys
+from pathlib import Path
+
+# Добавляем путь для импортов
+sys.path.append(str(Path(__file__).parent))
+
+from llm_schemas import GrammarOutput, LLMOutputError, PressReleaseOutput, parse_llm_json, repair_json
+from llm_streaming import JSONFieldStreamParser
+from prompts import estimate_tokens
+from text_chunking import locate, merge_chunks, split_into_chunks
+
+PRESS_RELEASE = {
+    "headline": "Компания XYZ запускает продукт",
+    "lead_paragraph": "Сегодня компания представила \"новый\" продукт.",
+    "quotes": [{"text": "Мы рады", "author": "CEO"}],
+    "score": 7,
+    "published": True,
+    "extra": None,
+}
+
+
+def _feed_in_pieces(text: str, size: int) -> list:
+    parser = JSONFieldStreamParser()
+    fields = []
+    for start in range(0, len(text), size):
+        fields.extend(parser.feed(text[start:start + size]))
+    assert parser.done
+    return fields
+
+
+def test_stream_parser_emits_fields_for_any_chunking():
+    raw = "```json\n" + json.dumps(PRESS_RELEASE, ensure_ascii=False) + "\n```"
+    for size in (1, 3, 7, len(raw)):
+        assert _feed_in_pieces(raw, size) == list(PRESS_RELEASE.items()), size
+
+
+def test_stream_parser_emits_field_as_soon_as_value_is_complete():
+    parser = JSONFieldStreamParser()
+    assert parser.feed('{"headline": "Заголо') == []
+    assert parser.feed('вок", "body_text": "Те') == [("headline", "Заголовок")]
+    assert parser.feed('кст"}') == [("body_text", "Текст")]
+    assert parser.done
+
+
+def test_repair_json_fixes_trailing_commas_and_truncation():
+    assert json.loads(repair_json('{"a": [1, 2,], "b": "x",}')) == {"a": [1, 2], "b": "x"}
+    assert json.loads(repair_json('{"headline": "Заголовок", "body_text": "Обрезанный те')) == {
+        "headline": "Заголовок", "body_text": "Обрезанный те"
+    }
+    assert json.loads(repair_json('{"headline": "Заголовок", "quotes": [{"text": "Цитата"}, ')) == {
+        "headline": "Заголовок", "quotes": [{"text": "Цитата"}]
+    }
+    assert json.loads(repair_json('{"headline": "Заголовок", "body_text":')) == {"headline": "Заголовок"}
+
+
+def test_repair_json_escapes_quotes_and_newlines_inside_strings():
+    raw = '{"improved_text": "Он сказал "привет"\nи ушёл", "summary": "ok"}'
+    assert json.loads(repair_json(raw)) == {"improved_text": 'Он сказал "привет"\nи ушёл', "summary": "ok"}
+
+
+def test_parse_llm_json_reports_repair_and_validates_schema():
+    data, repaired = parse_llm_json('Ответ:\n```json\n{"improved_text": "Текст",}\n```', GrammarOutput)
+    assert repaired and data["improved_text"] == "Текст" and data["errors_found"] == []
+
+    data, repaired = parse_llm_json(json.dumps(PRESS_RELEASE | {"body_text": "Текст"}), PressReleaseOutput)
+    assert not repaired and data["quotes"][0]["author"] == "CEO"
+
+    try:
+        parse_llm_json('{"headline": "Без обязательных полей"}', PressReleaseOutput)
+    except LLMOutputError as e:
+        assert e.raw_response
+    else:
+        raise AssertionError("Ответ без lead_paragraph и body_text должен отклоняться")
+
+
+def _long_text() -> str:
+    paragraphs = [
+        " ".join(f"Предложение {p}.{s} о продукте компании и его возможностях." for s in range(12))
+        for p in range(8)
+    ]
+    return "\n\n".join(paragraphs)
+
+
+def test_split_into_chunks_respects_budget_and_covers_text():
+    text = _long_text()
+    spans = split_into_chunks(text, 120)
+    assert len(spans) > 1
+    for (start, end), (next_start, _) in zip(spans, spans[1:]):
+        assert end <= next_start and not text[end:next_start].strip()
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    for start, end in spans:
+        assert estimate_tokens(text[start:end]) <= 120
+
+
+def test_merge_chunks_keeps_separators_and_offsets():
+    text = _long_text()
+    spans = split_into_chunks(text, 120)
+    # Без изменений частей документ собирается в исходный
+    merged, offsets = merge_chunks(text, spans, [text[start:end] for start, end in spans])
+    assert merged == text
+    assert offsets == [start for start, _ in spans]
+
+    improved = [text[start:end].replace("продукте", "сервисе") for start, end in spans]
+    merged, offsets = merge_chunks(text, spans, improved)
+    assert merged == text.replace("продукте", "сервисе")
+    for index, chunk in enumerate(improved):
+        assert merged[offsets[index]:offsets[index] + len(chunk)] == chunk
+
+    start, end = spans[1]
+    assert locate("Предложение", text[start:end], start) == start
+    assert locate("нет такого", text[start:end], start) is None
+
+
+if __name__ == "__main__":
+    for test in (
+        test_stream_parser_emits_fields_for_any_chunking,
+        test_stream_parser_emits_field_as_soon_as_value_is_complete,
+        test_repair_json_fixes_trailing_commas_and_truncation,
+        test_repair_json_escapes_quotes_and_newlines_inside_strings,
+        test_parse_llm_json_reports_repair_and_validates_schema,
+        test_split_into_chunks_respects_budget_and_covers_text,
+        test_merge_chunks_keeps_separators_and_offsets,
+    ):
+        test()
+        print(f"✅ {test.__name__}")
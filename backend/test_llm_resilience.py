@@ -0,0 +1,255 @@
+"""
+Тестирование устойчивости вызовов LLM против локального mock-сервера (llm_mock_server.py)
+
+- circuit breaker, маршрутизация моделей и фоновые задачи генерации;
+- OpenRouterClient поверх mock-сервера (ASGI транспорт, без сети и ключа):
+  резервная модель после ошибки, hedging при переполненном контроле допуска.
+"""
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from openai import AsyncOpenAI
+
+# Добавляем путь для импортов
+sys.path.append(str(Path(__file__).parent))
+
+# Клиент LLM настраивается окружением при создании: без кэша, роутера и общих слотов
+os.environ.update({
+    "LLM_CACHE_ENABLED": "false",
+    "LLM_ROUTER_ENABLED": "false",
+    "LLM_FALLBACK_MODELS": "",
+    "LLM_GLOBAL_SLOTS": "0",
+})
+
+from circuit_breaker import CircuitBreaker, CircuitBreakerRegistry, CircuitState
+from llm_jobs import DONE, FAILED, JobManager
+from llm_limiter import AdmissionController, LLMOverloadedError
+from llm_mock_server import FixtureStore, LatencyModel, create_app
+from llm_router import IMPROVE_TEXT_MODEL_ALIASES, ModelRouter, resolve_model
+from open_router_client import OpenRouterClient
+
+PRIMARY = "mock/primary"
+SECONDARY = "mock/secondary"
+MESSAGES = [
+    {"role": "system", "content": "Ты - редактор."},
+    {"role": "user", "content": "Компания: XYZ\nНапиши пресс-релиз."},
+]
+
+
+def _client(latency: str = "fixed:0.05", error_rate: float = 0.0, seed: int = 0) -> OpenRouterClient:
+    """OpenRouterClient, чьи запросы обслуживает mock-сервер в том же процессе"""
+    mock_app = create_app(FixtureStore(None), LatencyModel(latency), error_rate=error_rate, chunk_delay=0, seed=seed)
+    client = OpenRouterClient()
+    client.client = AsyncOpenAI(
+        base_url="http://mock/api/v1",
+        api_key="mock",
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_app), base_url="http://mock"),
+    )
+    return client
+
+
+# ==================== CIRCUIT BREAKER ====================
+
+def test_breaker_opens_on_failures_and_probes_in_half_open():
+    breaker = CircuitBreaker("model", min_calls=4, open_seconds=0.05)
+    for _ in range(4):
+        assert breaker.allow_request()
+        breaker.record_failure(0.1)
+    assert breaker.state == CircuitState.OPEN and not breaker.allow_request()
+
+    time.sleep(0.06)
+    # Half-open: пропускается один пробный запрос
+    assert breaker.allow_request()
+    assert breaker.state == CircuitState.HALF_OPEN and not breaker.allow_request()
+    breaker.record_failure(0.1)
+    assert breaker.state == CircuitState.OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitState.CLOSED and breaker.allow_request()
+
+
+def test_breaker_release_frees_the_half_open_slot():
+    breaker = CircuitBreaker("model", min_calls=1, open_seconds=0)
+    breaker.allow_request()
+    breaker.record_failure(0.1)
+    assert breaker.allow_request() and not breaker.allow_request()
+    # Пробный запрос отменён без результата (проиграл hedging-гонку)
+    breaker.release()
+    assert breaker.allow_request()
+
+
+# ==================== МАРШРУТИЗАЦИЯ ====================
+
+def test_router_prefers_much_faster_model_with_enough_samples():
+    router = ModelRouter(CircuitBreakerRegistry(), min_samples=3, switch_margin=0.3)
+    for _ in range(3):
+        router.record(PRIMARY, "press_release", 100, 4.0, ok=True)
+        router.record(SECONDARY, "press_release", 100, 1.0, ok=True)
+
+    order, decision = router.plan([PRIMARY, SECONDARY], "press_release", 100)
+    assert order == [SECONDARY, PRIMARY] and decision["model"] == SECONDARY
+
+    # Статистика ведётся отдельно по типу запроса: для improve_text данных нет
+    order, decision = router.plan([PRIMARY, SECONDARY], "improve_text", 100)
+    assert order == [PRIMARY, SECONDARY] and decision["reason"] == "preferred"
+
+
+def test_router_skips_model_with_open_breaker():
+    breakers = CircuitBreakerRegistry()
+    breakers.get(PRIMARY).state = CircuitState.OPEN
+    breakers.get(PRIMARY).opened_at = time.monotonic()
+    order, decision = ModelRouter(breakers).plan([PRIMARY, SECONDARY], "press_release", 100)
+    assert order[0] == SECONDARY and decision["reason"] == f"{PRIMARY} circuit open"
+
+
+def test_resolve_model_uses_endpoint_alias_table():
+    default = "google/gemini-3-flash-preview"
+    assert resolve_model("claude4", default) == "anthropic/claude-sonnet-4"
+    assert resolve_model("claude4", default, aliases=IMPROVE_TEXT_MODEL_ALIASES) == default
+    assert resolve_model("gpt35", default, aliases=IMPROVE_TEXT_MODEL_ALIASES) == "openai/gpt-3.5-turbo"
+    assert resolve_model("unknown/model", default) == default
+    assert resolve_model("unknown/model", default, allowed={"unknown/model"}) == "unknown/model"
+
+
+# ==================== ФОНОВЫЕ ЗАДАЧИ ====================
+
+def test_job_manager_dedupes_running_jobs_per_user():
+    async def run():
+        jobs = JobManager(ttl=60)
+        started = []
+
+        async def generate():
+            started.append(1)
+            await asyncio.sleep(0.05)
+            return {"text": "ok"}
+
+        fingerprint = JobManager.fingerprint("press_release", {"prompt": "x"}, "user-a")
+        job = jobs.submit("press_release", generate, fingerprint, user_id="user-a")
+        assert jobs.submit("press_release", generate, fingerprint, user_id="user-a") is job
+
+        # Чужая задача не видна
+        assert await jobs.get(job.id, "user-b") is None
+        assert await jobs.wait(job.id, timeout=1, user_id="user-b") is None
+
+        state = await jobs.wait(job.id, timeout=1, user_id="user-a")
+        assert state["status"] == DONE and state["result"] == {"text": "ok"}
+
+        # Завершённая задача не переиспользуется
+        repeated = jobs.submit("press_release", generate, fingerprint, user_id="user-a")
+        assert repeated is not job
+        await jobs.wait(repeated.id, timeout=1, user_id="user-a")
+        assert len(started) == 2 and jobs.deduplicated == 1
+
+    asyncio.run(run())
+
+
+def test_job_manager_reports_failures():
+    async def run():
+        jobs = JobManager(ttl=60)
+
+        async def generate():
+            raise RuntimeError("model failed")
+
+        job = jobs.submit("press_release", generate)
+        state = await jobs.wait(job.id, timeout=1)
+        assert state["status"] == FAILED and state["error"] == "model failed"
+
+    asyncio.run(run())
+
+
+# ==================== КЛИЕНТ ПОВЕРХ MOCK-СЕРВЕРА ====================
+
+def test_client_answers_from_mock_server():
+    async def run():
+        client = _client()
+        text, info = await client._complete(MESSAGES, [PRIMARY], 0.7, 500, json_mode=True)
+        assert '"headline": "XYZ объявляет' in text
+        assert info["model"] == PRIMARY
+        assert client.metrics.model_stats(PRIMARY)["outcomes"] == {"success": 1}
+
+    asyncio.run(run())
+
+
+def test_client_falls_back_when_model_fails():
+    async def run():
+        client = _client(error_rate=1.0)
+        try:
+            await client._run_models(MESSAGES, [PRIMARY, SECONDARY], 0.7, 500, hedge=False)
+        except Exception as e:
+            assert "Model failed" in str(e)
+        else:
+            raise AssertionError("При ошибках всех моделей должно быть исключение")
+        assert client.metrics.model_stats(PRIMARY)["outcomes"] == {"error": 1}
+        assert client.metrics.model_stats(SECONDARY)["outcomes"] == {"error": 1}
+
+        # После серии ошибок breaker модели открыт, и она пропускается без запроса
+        for _ in range(client.breakers.get(PRIMARY).min_calls):
+            client.breakers.get(PRIMARY).record_failure(0.1)
+        client.client = _client().client
+        text, model = await client._run_models(MESSAGES, [PRIMARY, SECONDARY], 0.7, 500, hedge=False)
+        assert model == SECONDARY and text
+
+    asyncio.run(run())
+
+
+def test_hedge_without_admission_slot_keeps_primary_running():
+    """
+    Один слот и нет очереди: hedge-попытка через 0.2с получает LLMOverloadedError,
+    а основная модель (ответ через 1с) должна продолжить работу и ответить.
+    """
+    async def run():
+        client = _client(latency="fixed:1.0")
+        client.limiter = AdmissionController(max_concurrent=1, max_queue=0)
+        client.hedge_delay_default = client.hedge_delay_min = 0.2
+
+        started = time.monotonic()
+        text, model = await client._run_models(MESSAGES, [PRIMARY, SECONDARY], 0.7, 500, hedge=True)
+        assert model == PRIMARY and text
+        assert time.monotonic() - started >= 1.0
+        assert client.limiter.rejected == 1
+        assert client.metrics.model_stats(SECONDARY) is None
+
+    asyncio.run(run())
+
+
+def test_overload_is_raised_when_no_attempt_is_pending():
+    async def run():
+        client = _client(latency="fixed:0.5")
+        client.limiter = AdmissionController(max_concurrent=1, max_queue=0)
+
+        first = asyncio.create_task(client._run_models(MESSAGES, [PRIMARY], 0.7, 500, hedge=False))
+        await asyncio.sleep(0.1)
+        try:
+            await client._run_models(MESSAGES, [SECONDARY], 0.7, 500, hedge=False)
+        except LLMOverloadedError:
+            pass
+        else:
+            raise AssertionError("Без свободного слота и других попыток должен быть LLMOverloadedError")
+        assert (await first)[1] == PRIMARY
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for test in (
+        test_breaker_opens_on_failures_and_probes_in_half_open,
+        test_breaker_release_frees_the_half_open_slot,
+        test_router_prefers_much_faster_model_with_enough_samples,
+        test_router_skips_model_with_open_breaker,
+        test_resolve_model_uses_endpoint_alias_table,
+        test_job_manager_dedupes_running_jobs_per_user,
+        test_job_manager_reports_failures,
+        test_client_answers_from_mock_server,
+        test_client_falls_back_when_model_fails,
+        test_hedge_without_admission_slot_keeps_primary_running,
+        test_overload_is_raised_when_no_attempt_is_pending,
+    ):
+        test()
+        print(f"✅ {test.__name__}")
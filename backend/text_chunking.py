@@ -0,0 +1,97 @@
+"""
+Разбиение длинных текстов на части по абзацам и сборка результатов обратно
+
+Используется для параллельной корректуры длинных документов: каждая часть
+укладывается в бюджет токенов, а результаты склеиваются с исходными
+разделителями между частями и пересчитанными смещениями ошибок.
+"""
+import re
+from typing import List, Optional, Tuple
+
+try:
+    from prompts import estimate_tokens
+except ImportError:
+    from .prompts import estimate_tokens
+
+_PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+_SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?…])\s+")
+
+Span = Tuple[int, int]
+
+
+def _split_spans(text: str, start: int, end: int, pattern: re.Pattern) -> List[Span]:
+    """Спаны фрагментов text[start:end] между совпадениями pattern"""
+    spans = []
+    position = start
+    for match in pattern.finditer(text, start, end):
+        if match.start() > position:
+            spans.append((position, match.start()))
+        position = match.end()
+    if position < end:
+        spans.append((position, end))
+    return spans
+
+
+def _pack(text: str, units: List[Span], max_tokens: int) -> List[Span]:
+    """Объединяет подряд идущие фрагменты в части не больше max_tokens"""
+    chunks = []
+    current: Optional[Span] = None
+    for unit in units:
+        if current is None:
+            current = unit
+        elif estimate_tokens(text[current[0]:unit[1]]) <= max_tokens:
+            current = (current[0], unit[1])
+        else:
+            chunks.append(current)
+            current = unit
+    if current is not None:
+        chunks.append(current)
+    return chunks
+
+
+def split_into_chunks(text: str, max_tokens: int) -> List[Span]:
+    """
+    Делит текст на части по границам абзацев, каждая не больше max_tokens.
+    Абзац, который сам не помещается в бюджет, делится по предложениям.
+
+    Returns:
+        Список (start, end) смещений частей в исходном тексте
+    """
+    units = []
+    for start, end in _split_spans(text, 0, len(text), _PARAGRAPH_BREAK_RE):
+        if estimate_tokens(text[start:end]) > max_tokens:
+            units.extend(_pack(text, _split_spans(text, start, end, _SENTENCE_BREAK_RE), max_tokens))
+        else:
+            units.append((start, end))
+    return _pack(text, units, max_tokens)
+
+
+def merge_chunks(text: str, spans: List[Span], chunk_texts: List[str]) -> Tuple[str, List[int]]:
+    """
+    Собирает документ из обработанных частей, сохраняя исходные разделители.
+
+    Returns:
+        (собранный текст, смещения начала каждой части в собранном тексте)
+    """
+    parts = []
+    offsets = []
+    length = 0
+    previous_end = 0
+    for (start, end), chunk_text in zip(spans, chunk_texts):
+        separator = text[previous_end:start]
+        parts.append(separator)
+        length += len(separator)
+        offsets.append(length)
+        parts.append(chunk_text)
+        length += len(chunk_text)
+        previous_end = end
+    parts.append(text[previous_end:])
+    return "".join(parts), offsets
+
+
+def locate(fragment: str, haystack: str, base_offset: int) -> Optional[int]:
+    """Смещение fragment в документе по его поиску внутри части"""
+    if not fragment:
+        return None
+    index = haystack.find(fragment)
+    return base_offset + index if index >= 0 else None